@@ -3,12 +3,11 @@ Aplicación Web Streamlit para Generación de Documentos de Auditoría con IA
 """
 
 import streamlit as st
-import io
-import zipfile
+import time
+import uuid
 from datetime import datetime
-import tempfile
-import os
-import shutil
+
+from trabajos import obtener_gestor, EN_COLA, PROCESANDO, COMPLETADO, ERROR, CANCELADO
 
 st.set_page_config(
     page_title="Generador de Documentos de Auditoría IA",
@@ -27,7 +26,7 @@ with st.sidebar:
     1. **Sube el archivo DATA.xlsx** con los datos de la auditoría
     2. **Sube las plantillas Word y/o Excel** que deseas procesar
     3. **(Opcional)** Sube documentos de la empresa para contexto
-    4. **Haz clic en Generar** y espera
+    4. **Haz clic en Generar**: verás las respuestas IA a medida que se generan y puedes cancelar si no son las esperadas
     5. **Descarga** los documentos generados
     
     ### Tecnología:
@@ -44,6 +43,39 @@ if 'documentos_generados' not in st.session_state:
 if 'procesamiento_completo' not in st.session_state:
     st.session_state.procesamiento_completo = False
 
+# El usuario y el trabajo en curso van en la URL: sobreviven a recargar el navegador
+if 'usuario' not in st.session_state:
+    st.session_state.usuario = st.query_params.get('usuario') or uuid.uuid4().hex[:12]
+    st.query_params['usuario'] = st.session_state.usuario
+if 'trabajo_id' not in st.session_state:
+    st.session_state.trabajo_id = st.query_params.get('trabajo')
+
+gestor = obtener_gestor()
+
+def descarga(trabajo_id, referencia):
+    """Lector diferido de un archivo del trabajo: Streamlit lo llama solo al pulsar la descarga."""
+    return lambda: gestor.leer_artefacto(trabajo_id, referencia['archivo'])
+
+ICONOS_VISTA_PREVIA = {'pendiente': '⏳', 'generando': '✍️', 'lista': '✅', 'error': '❌'}
+
+def mostrar_vista_previa(vista):
+    """Respuestas IA generadas hasta ahora, por plantilla (las etiquetas se completan en cada recarga)."""
+    if not vista:
+        return
+    st.subheader("👁️ Vista previa de las respuestas IA")
+    for plantilla in vista['plantillas']:
+        etiquetas = plantilla['etiquetas']
+        if not etiquetas:
+            continue
+        entradas = [(nombre, vista['etiquetas'].get(nombre, {'estado': 'pendiente', 'texto': ''})) for nombre in etiquetas]
+        listas = sum(1 for _, entrada in entradas if entrada['estado'] in ('lista', 'error'))
+        with st.expander(f"📄 {plantilla['nombre']} · {listas}/{len(etiquetas)} etiquetas IA",
+                         expanded=listas < len(etiquetas)):
+            for nombre, entrada in entradas:
+                st.markdown(f"{ICONOS_VISTA_PREVIA[entrada['estado']]} **{nombre}**")
+                if entrada['texto']:
+                    st.caption(entrada['texto'] + (" ▌" if entrada['estado'] == 'generando' else ""))
+
 col1, col2 = st.columns([1, 1])
 
 with col1:
@@ -96,6 +128,9 @@ if docs_empresa:
 
 st.markdown("---")
 
+trabajo_activo = bool(st.session_state.trabajo_id) and \
+    (gestor.estado(st.session_state.trabajo_id) or {}).get('estado') in (EN_COLA, PROCESANDO)
+
 col_btn1, col_btn2, col_btn3 = st.columns([1, 2, 1])
 
 with col_btn2:
@@ -103,7 +138,7 @@ with col_btn2:
         "🚀 Generar Documentos",
         type="primary",
         use_container_width=True,
-        disabled=not (data_file and plantillas)
+        disabled=not (data_file and plantillas) or trabajo_activo
     )
 
 if not (data_file and plantillas):
@@ -111,55 +146,77 @@ if not (data_file and plantillas):
 
 if procesar_btn:
     try:
-        from procesador_streamlit import procesar_documentos_streamlit
-        
-        with st.spinner("🔄 Procesando documentos con IA... Esto puede tomar varios minutos."):
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            status_text.text("Inicializando...")
-            progress_bar.progress(10)
-            
-            documentos_generados = procesar_documentos_streamlit(
-                data_file=data_file,
-                plantillas=plantillas,
-                docs_empresa=docs_empresa,
-                progress_callback=lambda p, msg: (progress_bar.progress(p), status_text.text(msg))
-            )
-            
-            progress_bar.progress(100)
-            status_text.text("✅ Procesamiento completado!")
-            
-            st.session_state.documentos_generados = documentos_generados
-            st.session_state.procesamiento_completo = True
-            
-        st.success("✅ ¡Documentos generados exitosamente!")
-        st.balloons()
-        
+        trabajo_id = gestor.enviar(st.session_state.usuario, data_file, plantillas, docs_empresa)
+        st.session_state.trabajo_id = trabajo_id
+        st.query_params['trabajo'] = trabajo_id
+        st.session_state.documentos_generados = None
+        st.session_state.procesamiento_completo = False
     except Exception as e:
-        st.error(f"❌ Error durante el procesamiento: {str(e)}")
+        st.error(f"❌ No se pudo enviar el trabajo: {str(e)}")
         st.exception(e)
 
+trabajo = gestor.estado(st.session_state.trabajo_id) if st.session_state.trabajo_id else None
+
+if st.session_state.trabajo_id and trabajo is None:
+    st.warning("⚠️ El trabajo ya no existe (caducó o se eliminó). Vuelve a generar los documentos.")
+    st.session_state.trabajo_id = None
+    st.query_params.pop('trabajo', None)
+
+elif trabajo and trabajo['estado'] in (EN_COLA, PROCESANDO):
+    st.markdown("---")
+    st.header("🔄 Procesando documentos con IA")
+    st.caption(f"Trabajo {trabajo['id']} · {len(trabajo['plantillas'])} plantilla(s). "
+               "Puedes recargar la página: el procesamiento continúa en segundo plano.")
+    if trabajo['estado'] == EN_COLA:
+        posicion = trabajo['posicion']
+        st.info(f"⏳ En cola{f' (posición {posicion})' if posicion else ''}: "
+                "el servidor está procesando trabajos de otros usuarios.")
+    st.progress(trabajo['progreso'])
+    st.text(trabajo['mensaje'])
+    if st.button("⛔ Cancelar", help="Detiene el trabajo: no se hacen más llamadas a la IA ni se escriben más plantillas"):
+        gestor.cancelar(trabajo['id'])
+        st.rerun()
+    mostrar_vista_previa(gestor.vista_previa(trabajo['id']))
+    time.sleep(1)
+    st.rerun()
+
+elif trabajo and trabajo['estado'] in (ERROR, CANCELADO):
+    if trabajo['estado'] == CANCELADO:
+        st.warning("⛔ Procesamiento cancelado: no se generaron documentos.")
+    else:
+        st.error(f"❌ Error durante el procesamiento: {trabajo['error']}")
+    mostrar_vista_previa(gestor.vista_previa(trabajo['id']))
+    if st.button("🔄 Intentar de nuevo"):
+        st.session_state.trabajo_id = None
+        st.query_params.pop('trabajo', None)
+        st.rerun()
+
+elif trabajo and trabajo['estado'] == COMPLETADO and not st.session_state.procesamiento_completo:
+    # En la sesión solo se guardan referencias; los archivos quedan en la carpeta del trabajo
+    st.session_state.documentos_generados = gestor.resultado(trabajo['id'])
+    st.session_state.procesamiento_completo = True
+    if st.session_state.documentos_generados is None:
+        st.warning("⚠️ No se encontraron los documentos de este trabajo. Vuelve a generarlos.")
+    if trabajo['fin'] and time.time() - trabajo['fin'] < 10:
+        st.success("✅ ¡Documentos generados exitosamente!")
+        st.balloons()
+
 if st.session_state.procesamiento_completo and st.session_state.documentos_generados:
     st.markdown("---")
     st.header("📥 Descargar Documentos Generados")
     
-    documentos = st.session_state.documentos_generados
-    
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for doc in documentos:
-            zip_file.writestr(doc['nombre'], doc['contenido'])
-    
-    zip_buffer.seek(0)
+    trabajo_id = st.session_state.trabajo_id
+    documentos = st.session_state.documentos_generados['documentos']
+    paquete = st.session_state.documentos_generados['paquete']
     
     col_zip1, col_zip2, col_zip3 = st.columns([1, 2, 1])
     with col_zip2:
         st.download_button(
             label="📦 Descargar Todos (ZIP)",
-            data=zip_buffer,
-            file_name=f"documentos_auditoria_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            data=descarga(trabajo_id, paquete),
+            file_name=paquete['nombre'],
             mime="application/zip",
+            on_click="ignore",
             use_container_width=True
         )
     
@@ -184,9 +241,10 @@ if st.session_state.procesamiento_completo and st.session_state.documentos_gener
                 
                 st.download_button(
                     label="⬇️ Descargar",
-                    data=doc['contenido'],
+                    data=descarga(trabajo_id, doc),
                     file_name=doc['nombre'],
                     mime=mime_type,
+                    on_click="ignore",
                     key=f"download_doc_{i}"
                 )
     
@@ -203,9 +261,10 @@ if st.session_state.procesamiento_completo and st.session_state.documentos_gener
             with col2:
                 st.download_button(
                     label="⬇️ Descargar",
-                    data=doc['contenido'],
+                    data=descarga(trabajo_id, doc),
                     file_name=doc['nombre'],
                     mime="text/plain",
+                    on_click="ignore",
                     key=f"download_ctx_{i}"
                 )
     
@@ -222,16 +281,37 @@ if st.session_state.procesamiento_completo and st.session_state.documentos_gener
             with col2:
                 st.download_button(
                     label="⬇️ Descargar",
-                    data=doc['contenido'],
+                    data=descarga(trabajo_id, doc),
                     file_name=doc['nombre'],
                     mime="text/plain",
+                    on_click="ignore",
                     key=f"download_mem_{i}"
                 )
-    
+
+    docs_traza = [d for d in documentos if d.get('tipo') == 'traza']
+
+    if docs_traza:
+        st.markdown("### ⏱️ Rendimiento del Procesamiento")
+        st.caption("Tiempo por etapa, tokens estimados, aciertos de caché y reintentos de esta ejecución. "
+                   "En generar_texto el total suma las llamadas en paralelo.")
+
+        traza = docs_traza[0]
+        st.dataframe(traza.get('resumen', []), use_container_width=True, hide_index=True)
+        st.download_button(
+            label="⬇️ Descargar traza (JSONL)",
+            data=descarga(trabajo_id, traza),
+            file_name=traza['nombre'],
+            mime="application/x-ndjson",
+            on_click="ignore",
+            key="download_traza"
+        )
+
     st.markdown("---")
     if st.button("🔄 Procesar Nuevos Documentos"):
         st.session_state.documentos_generados = None
         st.session_state.procesamiento_completo = False
+        st.session_state.trabajo_id = None
+        st.query_params.pop('trabajo', None)
         st.rerun()
 
 st.markdown("---")
@@ -0,0 +1,347 @@
+"""
+Backends de modelos de lenguaje intercambiables.
+
+GeminiClient se encarga de la orquestación (variables del prompt, caché de
+respuestas, limitador, reintentos, presupuesto de errores) y delega la
+llamada al modelo en un backend con esta interfaz:
+
+- generar(prompt, contexto_sistema): una respuesta
+- generar_stream(prompt, contexto_sistema): la respuesta por fragmentos
+- generar_lote(prompts, contexto_sistema, max_concurrencia): varias respuestas
+- contar_tokens(texto): tokens del texto según el modelo
+- preparar_contexto / liberar_contexto: contexto compartido de la ejecución
+
+Backends disponibles (variable de entorno LLM_BACKEND):
+- 'gemini' (por defecto): Gemini API de Google
+- 'simulado': respuestas deterministas sin red, con latencia y tasa de
+  error configurables, para pruebas de carga y CI
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from dotenv import load_dotenv
+
+# Caché de contexto en Gemini: el contexto_sistema se sube una vez por ejecución
+GEMINI_CACHE_CONTEXTO = os.getenv('GEMINI_CACHE_CONTEXTO', '1') != '0'
+GEMINI_CONTEXTO_TTL_MIN = int(os.getenv('GEMINI_CONTEXTO_TTL_MIN', '60'))
+
+# Modelos Gemini compartidos por el proceso (ver modelo_gemini_compartido)
+_modelos_gemini = {}
+_lock_gemini = threading.Lock()
+
+def componer_prompt(prompt, contexto_sistema=None):
+    """Une el contexto del sistema y la tarea específica en un solo prompt."""
+    if contexto_sistema:
+        return f"{contexto_sistema}\n\n---\n\nTAREA ESPECÍFICA:\n{prompt}"
+    return prompt
+
+def estimar_tokens(texto):
+    """Estimación local y gratuita de tokens (≈ 4 caracteres por token)."""
+    return len(texto) // 4
+
+def leer_api_key():
+    """API key de Gemini: Streamlit secrets o, si no, GEMINI_API_KEY del entorno / .env."""
+    api_key = None
+    try:
+        import streamlit as st
+        if hasattr(st, 'secrets') and 'GEMINI_API_KEY' in st.secrets:
+            api_key = st.secrets['GEMINI_API_KEY']
+    except:
+        pass
+
+    if not api_key:
+        load_dotenv()
+        api_key = os.getenv('GEMINI_API_KEY')
+
+    if not api_key:
+        raise ValueError(
+            "GEMINI_API_KEY no encontrada. "
+            "Configúrala en .env o en Streamlit secrets"
+        )
+    return api_key
+
+def modelo_gemini_compartido(nombre_modelo):
+    """
+    GenerativeModel del proceso para `nombre_modelo`, creado la primera vez.
+
+    genai.configure se llama una sola vez por proceso: cada llamada descarta
+    los clientes de la API que genai guarda, y con ellos sus conexiones, así
+    que configurarlo en cada ejecución obligaba a abrirlas de nuevo. Las
+    ejecuciones de todos los usuarios comparten el modelo, la configuración
+    y las conexiones.
+    """
+    with _lock_gemini:
+        modelo = _modelos_gemini.get(nombre_modelo)
+        if modelo is None:
+            import google.generativeai as genai
+            if not _modelos_gemini:
+                genai.configure(api_key=leer_api_key())
+            modelo = _modelos_gemini[nombre_modelo] = genai.GenerativeModel(nombre_modelo)
+        return modelo
+
+class BackendLLM:
+    """
+    Interfaz común de los backends. Las subclases implementan generar();
+    generar_lote() usa por defecto un pool de hilos sobre generar().
+    """
+
+    nombre_modelo = 'desconocido'
+    modo_contexto = 'inline'
+
+    def generar(self, prompt, contexto_sistema=None):
+        """Devuelve el texto generado para un prompt. Lanza excepción si falla."""
+        raise NotImplementedError
+
+    def generar_stream(self, prompt, contexto_sistema=None):
+        """
+        Genera la respuesta por fragmentos de texto a medida que llegan.
+        Por defecto, un solo fragmento con la respuesta completa de generar().
+        """
+        yield self.generar(prompt, contexto_sistema)
+
+    def generar_lote(self, prompts, contexto_sistema=None, max_concurrencia=4):
+        """Genera varias respuestas en paralelo, conservando el orden de entrada."""
+        if not prompts:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrencia, len(prompts)))) as pool:
+            return list(pool.map(lambda p: self.generar(p, contexto_sistema), prompts))
+
+    def contar_tokens(self, texto):
+        return estimar_tokens(texto)
+
+    def preparar_contexto(self, contexto_sistema):
+        """Prepara un contexto compartido; por defecto se envía en línea."""
+        return self.modo_contexto
+
+    def liberar_contexto(self):
+        pass
+
+class BackendGemini(BackendLLM):
+    """
+    Backend Gemini API.
+
+    Admite subir el contexto del sistema una vez por ejecución (CachedContent),
+    con respaldo a instrucción de sistema y, si la API lo rechaza, a envío en línea.
+
+    El modelo y las conexiones se comparten en el proceso
+    (modelo_gemini_compartido); cada instancia solo guarda el contexto
+    preparado de su ejecución, así que crearla no tiene coste.
+    """
+
+    def __init__(self, nombre_modelo='gemini-2.5-flash'):
+        import google.generativeai as genai
+        from google.api_core import exceptions as api_exceptions
+
+        self._genai = genai
+        self._api_exceptions = api_exceptions
+        self.nombre_modelo = nombre_modelo
+        self.model = modelo_gemini_compartido(nombre_modelo)
+
+        self.modo_contexto = 'inline'
+        self._contexto_preparado = None
+        self._modelo_contexto = None
+        self._cache_contexto = None
+
+    def _contexto_invalido(self, error):
+        """
+        Indica si el error se debe a que el contexto preparado ya no sirve
+        (caché expirada, borrada o rechazada). Los errores transitorios (429,
+        503, timeouts) no cuentan: se propagan para que los reintente
+        ejecutar_con_reintentos sin renunciar a la caché.
+        """
+        api_exceptions = self._api_exceptions
+        if isinstance(error, (api_exceptions.NotFound, api_exceptions.PermissionDenied)):
+            return True
+        if isinstance(error, (api_exceptions.FailedPrecondition, api_exceptions.InvalidArgument)):
+            mensaje = str(error).lower()
+            return 'cache' in mensaje or 'cached_content' in mensaje
+        return False
+
+    def _descartar_contexto(self, modelo_contexto, error):
+        """Pasa a enviar el contexto en línea si el error invalida el contexto preparado; si no, lo relanza."""
+        if not self._contexto_invalido(error):
+            raise error
+        print(f"      ⚠️ Contexto preparado no disponible ({str(error)[:80]}), enviando en línea")
+        if self._modelo_contexto is modelo_contexto:
+            self.liberar_contexto()
+
+    def generar(self, prompt, contexto_sistema=None):
+        modelo_contexto = self._modelo_contexto
+        if modelo_contexto is not None and contexto_sistema == self._contexto_preparado:
+            try:
+                return modelo_contexto.generate_content(f"TAREA ESPECÍFICA:\n{prompt}").text
+            except self._api_exceptions.GoogleAPICallError as e:
+                self._descartar_contexto(modelo_contexto, e)
+
+        return self.model.generate_content(componer_prompt(prompt, contexto_sistema)).text
+
+    def generar_stream(self, prompt, contexto_sistema=None):
+        """Como generar(), con stream=True: los errores de la API llegan al pedir el primer fragmento."""
+        modelo_contexto = self._modelo_contexto
+        if modelo_contexto is not None and contexto_sistema == self._contexto_preparado:
+            try:
+                respuesta = modelo_contexto.generate_content(f"TAREA ESPECÍFICA:\n{prompt}", stream=True)
+            except self._api_exceptions.GoogleAPICallError as e:
+                self._descartar_contexto(modelo_contexto, e)
+            else:
+                for fragmento in respuesta:
+                    yield fragmento.text
+                return
+
+        for fragmento in self.model.generate_content(componer_prompt(prompt, contexto_sistema), stream=True):
+            yield fragmento.text
+
+    def contar_tokens(self, texto):
+        """Cuenta exacta con la API (hace una llamada de red)."""
+        return self.model.count_tokens(texto).total_tokens
+
+    def preparar_contexto(self, contexto_sistema):
+        """
+        Sube el contexto del sistema una sola vez para reutilizarlo en todas
+        las llamadas de la ejecución.
+
+        Intenta, en orden:
+        1. 'cache': CachedContent de Gemini (el prefijo no se reenvía ni se
+           vuelve a facturar completo en cada llamada)
+        2. 'system_instruction': modelo con el contexto como instrucción de sistema
+        3. 'inline': se sigue concatenando el contexto en cada prompt
+
+        Returns:
+            Modo utilizado ('cache', 'system_instruction' o 'inline')
+        """
+        self.liberar_contexto()
+
+        if not contexto_sistema or not GEMINI_CACHE_CONTEXTO:
+            return self.modo_contexto
+
+        try:
+            self._cache_contexto = self._genai.caching.CachedContent.create(
+                model=f"models/{self.nombre_modelo}",
+                display_name="contexto-auditoria",
+                system_instruction=contexto_sistema,
+                ttl=timedelta(minutes=GEMINI_CONTEXTO_TTL_MIN)
+            )
+            self._modelo_contexto = self._genai.GenerativeModel.from_cached_content(cached_content=self._cache_contexto)
+            self.modo_contexto = 'cache'
+        except Exception as e:
+            # Contexto demasiado corto para cachear, modelo sin soporte, etc.
+            print(f"   ⚠️  Caché de contexto no disponible ({str(e)[:80]}), usando instrucción de sistema")
+            self._cache_contexto = None
+            self._modelo_contexto = self._genai.GenerativeModel(self.nombre_modelo, system_instruction=contexto_sistema)
+            self.modo_contexto = 'system_instruction'
+
+        self._contexto_preparado = contexto_sistema
+        return self.modo_contexto
+
+    def liberar_contexto(self):
+        """Elimina el contexto cacheado en Gemini (si existe) y vuelve al modo en línea."""
+        if self._cache_contexto is not None:
+            try:
+                self._cache_contexto.delete()
+            except Exception:
+                pass  # Expira solo al cumplirse el TTL
+
+        self.modo_contexto = 'inline'
+        self._contexto_preparado = None
+        self._modelo_contexto = None
+        self._cache_contexto = None
+
+class ErrorSimulado(Exception):
+    """Error transitorio generado por el backend simulado (se reintenta como un 429)."""
+
+class BackendSimulado(BackendLLM):
+    """
+    Backend local sin red para pruebas y benchmarks.
+
+    - Determinista: el mismo prompt y contexto producen siempre el mismo texto
+    - Longitud realista: ~`palabras` palabras por respuesta (±20 %)
+    - Latencia simulada: `latencia` segundos de media por llamada
+    - Errores simulados: fracción `tasa_error` de llamadas lanza ErrorSimulado
+    """
+
+    nombre_modelo = 'simulado'
+
+    VOCABULARIO = (
+        "se verificó el procedimiento documentado registro evidencia control "
+        "operacional responsable proceso auditoría requisito cumplimiento norma "
+        "sistema gestión calidad ambiental seguridad salud trabajo riesgo "
+        "oportunidad objetivo indicador seguimiento medición revisión dirección "
+        "competencia personal capacitación mantenimiento equipo proveedor cliente "
+        "satisfacción acción correctiva mejora continua política documento versión "
+        "fecha código entrevista muestra obra servicio contrato inspección"
+    ).split()
+
+    def __init__(self, latencia=0.5, tasa_error=0.0, palabras=90, semilla=0):
+        self.latencia = latencia
+        self.tasa_error = tasa_error
+        self.palabras = palabras
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.llamadas = 0
+
+    def _semilla(self, prompt, contexto_sistema):
+        h = hashlib.sha256(f"{contexto_sistema or ''}\x00{prompt}".encode('utf-8')).digest()
+        return int.from_bytes(h[:8], 'big')
+
+    def _respuesta(self, prompt, contexto_sistema):
+        """Espera, fallo y oraciones de una llamada (el texto es determinista por prompt)."""
+        rnd = random.Random(self._semilla(prompt, contexto_sistema))
+
+        with self._lock:
+            self.llamadas += 1
+            falla = self.tasa_error > 0 and self._azar.random() < self.tasa_error
+
+        espera = self.latencia * (0.5 + rnd.random()) if self.latencia > 0 else 0
+
+        cantidad = max(1, int(self.palabras * (0.8 + 0.4 * rnd.random())))
+        palabras = [rnd.choice(self.VOCABULARIO) for _ in range(cantidad)]
+        oraciones = []
+        for i in range(0, cantidad, 15):
+            oracion = " ".join(palabras[i:i + 15])
+            oraciones.append(oracion[0].upper() + oracion[1:] + ".")
+        return espera, falla, oraciones
+
+    def generar(self, prompt, contexto_sistema=None):
+        espera, falla, oraciones = self._respuesta(prompt, contexto_sistema)
+        if espera:
+            time.sleep(espera)
+        if falla:
+            raise ErrorSimulado("429 RESOURCE_EXHAUSTED (simulado)")
+        return " ".join(oraciones)
+
+    def generar_stream(self, prompt, contexto_sistema=None):
+        """Mismo texto que generar(), una oración por fragmento con la latencia repartida entre ellas."""
+        espera, falla, oraciones = self._respuesta(prompt, contexto_sistema)
+        if falla:
+            time.sleep(espera)
+            raise ErrorSimulado("429 RESOURCE_EXHAUSTED (simulado)")
+        for i, oracion in enumerate(oraciones):
+            if espera:
+                time.sleep(espera / len(oraciones))
+            yield oracion if i == 0 else " " + oracion
+
+def crear_backend(nombre=None):
+    """
+    Crea el backend indicado o el configurado en LLM_BACKEND.
+
+    Variables del backend simulado: LLM_SIMULADO_LATENCIA (segundos, 0.5),
+    LLM_SIMULADO_TASA_ERROR (0.0), LLM_SIMULADO_PALABRAS (90).
+    """
+    nombre = (nombre or os.getenv('LLM_BACKEND', 'gemini')).lower()
+
+    if nombre == 'simulado':
+        return BackendSimulado(
+            latencia=float(os.getenv('LLM_SIMULADO_LATENCIA', '0.5')),
+            tasa_error=float(os.getenv('LLM_SIMULADO_TASA_ERROR', '0')),
+            palabras=int(os.getenv('LLM_SIMULADO_PALABRAS', '90'))
+        )
+    if nombre == 'gemini':
+        return BackendGemini()
+
+    raise ValueError(f"Backend LLM desconocido: '{nombre}' (usa 'gemini' o 'simulado')")
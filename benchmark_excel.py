@@ -0,0 +1,197 @@
+"""
+Benchmark de memoria de la lectura de Excel: modo normal vs. streaming.
+
+Compara openpyxl en modo normal (load_workbook con un objeto por celda,
+como se leía antes) con el lector en streaming de lector_excel.py
+(read_only=True y corte al final de la región de datos), en dos usos:
+
+- datos: leer DATA.xlsx (campo, valor, etiqueta) como leer_datos_excel
+- texto: extraer el texto de un libro de la empresa como extraer_texto_excel
+
+Cada medición se ejecuta en un proceso nuevo y reporta el tiempo y el
+aumento del pico de RSS (lo que cuenta en la instancia de 1 GB de
+Streamlit Cloud). Por defecto usa libros sintéticos: un DATA con 5.000
+campos y una Lista Maestra de Documentos de 10.000 filas con el formato
+extendido a 30.000 filas vacías. Se pueden añadir libros reales.
+
+Uso:
+    python benchmark_excel.py [--filas 10000] [--libro ruta.xlsx ...]
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import openpyxl
+from openpyxl.styles import Border, Side
+
+from lector_excel import iterar_filas
+from lector_informacion import extraer_texto_excel
+
+
+def leer_datos_normal(ruta):
+    """Lectura anterior de DATA.xlsx: libro completo en memoria."""
+    wb = openpyxl.load_workbook(ruta, data_only=True)
+    datos = {}
+    for row in wb.active.iter_rows(min_row=2, values_only=True):
+        if row[0]:
+            datos[str(row[0]).strip()] = row[1] if row[1] is not None else ""
+    wb.close()
+    return len(datos)
+
+
+def leer_datos_streaming(ruta):
+    datos = {}
+    for _, row in iterar_filas(ruta, min_fila=2, max_columnas=3):
+        if row[0]:
+            datos[str(row[0]).strip()] = row[1] if row[1] is not None else ""
+    return len(datos)
+
+
+def texto_normal(ruta):
+    """Extracción anterior de texto: libro completo en memoria."""
+    wb = openpyxl.load_workbook(ruta, data_only=True)
+    partes = []
+    for hoja in wb.sheetnames:
+        if hoja in ['Hoja1', 'Sheet1', 'PROMPTS', 'CLAUSULAS']:
+            continue
+        partes.append(f"\n--- Hoja: {hoja} ---\n")
+        for fila in wb[hoja].iter_rows(values_only=True):
+            valores = [str(v) for v in fila if v is not None]
+            if valores:
+                partes.append(" | ".join(valores) + "\n")
+    wb.close()
+    return len("".join(partes).strip())
+
+
+def texto_streaming(ruta):
+    return len(extraer_texto_excel(ruta))
+
+
+FUNCIONES = {
+    ('datos', 'normal'): leer_datos_normal,
+    ('datos', 'streaming'): leer_datos_streaming,
+    ('texto', 'normal'): texto_normal,
+    ('texto', 'streaming'): texto_streaming,
+}
+
+
+def generar_data(ruta, campos, semilla=42):
+    """DATA.xlsx sintético: Campo | Valor | Campo Generado."""
+    rnd = random.Random(semilla)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Campo", "Valor", "Campo Generado"])
+    prefijos = ['DOC_', 'PROCESO_', 'SERVICIO_', 'NOMBRE_RESP', 'CAMPO_']
+    for i in range(campos):
+        campo = f"{prefijos[i % len(prefijos)]}{i}"
+        if i % 50 == 0:
+            ws.append([f"IA_{i}", f"Redacta la evidencia número {i} del proceso", f"{{{{IA:IA_{i}}}}}"])
+        else:
+            ws.append([campo, f"Valor {rnd.randint(0, 10 ** 6)} " * 3, f"{{{{{campo}}}}}"])
+    wb.save(ruta)
+
+
+def generar_lista_maestra(ruta, filas, filas_formato, semilla=42):
+    """
+    Lista Maestra de Documentos sintética: filas con datos y, debajo, filas
+    vacías con borde (formato extendido, como en los libros reales).
+    """
+    rnd = random.Random(semilla)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Lista Maestra"
+    ws.append(["Código", "Documento", "Versión", "Fecha", "Responsable", "Ubicación", "Estado", "Observaciones"])
+    tipos = ["PR", "FO", "IT", "MA", "PL"]
+    for i in range(filas):
+        ws.append([f"SIG-{rnd.choice(tipos)}-{i:04d}", f"Documento del sistema de gestión número {i}",
+                   rnd.randint(1, 9), f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                   "Jefe de Calidad", "Servidor / SIG", rnd.choice(["Vigente", "Obsoleto"]), ""])
+    borde = Border(bottom=Side(style='thin'))
+    for fila in range(filas + 2, filas + 2 + filas_formato):
+        for columna in range(1, 9):
+            ws.cell(row=fila, column=columna).border = borde
+    wb.save(ruta)
+
+
+def pico_rss_kb():
+    """
+    Pico de memoria residente del proceso (KB). En Linux se lee VmHWM:
+    ru_maxrss se hereda del proceso padre a través de exec.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for linea in f:
+                if linea.startswith('VmHWM:'):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def medir_en_hijo(uso, modo, ruta):
+    """Ejecuta una medición en un proceso nuevo y devuelve su resultado."""
+    salida = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--hijo', uso, modo, ruta],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def ejecutar_hijo(uso, modo, ruta):
+    base = pico_rss_kb()
+    inicio = time.perf_counter()
+    resultado = FUNCIONES[(uso, modo)](ruta)
+    duracion = time.perf_counter() - inicio
+    pico = pico_rss_kb()
+    print(json.dumps({'segundos': duracion, 'rss_mb': (pico - base) / 1024, 'resultado': resultado}))
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--hijo':
+        ejecutar_hijo(*sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description="Memoria de la lectura de Excel: modo normal vs. streaming")
+    parser.add_argument('--filas', type=int, default=10000, help="Filas de la Lista Maestra sintética")
+    parser.add_argument('--campos', type=int, default=5000, help="Campos del DATA.xlsx sintético")
+    parser.add_argument('--libro', action='append', default=[], help="Libro real adicional (uso: texto)")
+    args = parser.parse_args()
+
+    print("=" * 78)
+    print("BENCHMARK DE MEMORIA: EXCEL MODO NORMAL VS. STREAMING")
+    print("=" * 78)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta_data = os.path.join(tmp, "DATA.xlsx")
+        generar_data(ruta_data, args.campos)
+        ruta_lista = os.path.join(tmp, "SIG-FO-001 Lista Maestra de Documentos.xlsx")
+        generar_lista_maestra(ruta_lista, args.filas, args.filas * 3)
+
+        casos = [('datos', ruta_data), ('texto', ruta_lista)] + [('texto', r) for r in args.libro]
+
+        print(f"{'Libro':<40}{'Uso':>6}{'KB':>8}{'Normal s':>10}{'RSS MB':>8}{'Stream s':>10}{'RSS MB':>8}")
+        for uso, ruta in casos:
+            normal = medir_en_hijo(uso, 'normal', ruta)
+            streaming = medir_en_hijo(uso, 'streaming', ruta)
+            if normal['resultado'] != streaming['resultado']:
+                print(f"❌ Resultados distintos en {os.path.basename(ruta)}: "
+                      f"{normal['resultado']} vs {streaming['resultado']}")
+                sys.exit(1)
+            nombre = os.path.basename(ruta)
+            nombre = nombre if len(nombre) <= 38 else nombre[:35] + "..."
+            print(f"{nombre:<40}{uso:>6}{os.path.getsize(ruta) // 1024:>8}"
+                  f"{normal['segundos']:>10.2f}{normal['rss_mb']:>8.1f}"
+                  f"{streaming['segundos']:>10.2f}{streaming['rss_mb']:>8.1f}")
+
+    print("\nRSS MB: aumento del pico de memoria residente del proceso durante la lectura.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Benchmark de extracción de texto de documentos de la empresa.
+
+Genera un PDF sintético (por defecto 500 páginas) y un Excel sintético
+(por defecto 10.000 filas) y mide, a 1/4, 1/2 y el tamaño completo, el
+tiempo y, con --memoria, el pico de memoria (tracemalloc, mucho más lento) de:
+
+- los extractores actuales (fragmentos generados y unidos una sola vez)
+- la implementación anterior (texto += ... en el bucle), como referencia
+
+Si el tiempo por página/fila se mantiene constante al crecer el documento,
+el ensamblado es lineal. También mide formatear_informacion_empresa con
+muchos documentos. Los extractores se llaman directamente, sin la caché
+de extracción.
+
+Uso:
+    python benchmark_extraccion.py [paginas_pdf] [filas_excel] [--memoria]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+from PyPDF2 import PdfReader
+
+from lector_informacion import (extraer_texto_excel, extraer_texto_pdf,
+                                formatear_informacion_empresa)
+
+PALABRAS = ("auditoría proceso control documento registro procedimiento responsable "
+            "calidad seguridad ambiente riesgo mejora evidencia cumplimiento gestión "
+            "objetivo indicador revisión servicio cliente proveedor").split()
+
+
+def extraer_pdf_anterior(ruta_archivo):
+    """Implementación anterior: concatena página a página."""
+    reader = PdfReader(ruta_archivo)
+    texto = ""
+    for pagina in reader.pages:
+        texto += pagina.extract_text() + "\n"
+    return texto.strip()
+
+
+def extraer_excel_anterior(ruta_archivo):
+    """Implementación anterior: concatena fila a fila."""
+    wb = openpyxl.load_workbook(ruta_archivo, data_only=True)
+    texto = ""
+    for hoja in wb.sheetnames:
+        if hoja in ['Hoja1', 'Sheet1', 'PROMPTS', 'CLAUSULAS']:
+            continue
+        ws = wb[hoja]
+        texto += f"\n--- Hoja: {hoja} ---\n"
+        for fila in ws.iter_rows(values_only=True):
+            valores = [str(v) for v in fila if v is not None]
+            if valores:
+                texto += " | ".join(valores) + "\n"
+    wb.close()
+    return texto.strip()
+
+
+def formatear_anterior(documentos):
+    """Implementación anterior de formatear_informacion_empresa."""
+    contenido_total = "\n" + "="*80 + "\n"
+    contenido_total += "INFORMACIÓN ADICIONAL DE LA EMPRESA (usar para generar contenido realista)\n"
+    contenido_total += "="*80 + "\n\n"
+    for nombre, texto in documentos:
+        contenido_total += f"\n--- Archivo: {nombre} ---\n{texto}\n\n"
+    contenido_total += "="*80 + "\n"
+    return contenido_total
+
+
+def frase(rnd, palabras):
+    return " ".join(rnd.choice(PALABRAS) for _ in range(palabras))
+
+
+def generar_pdf(ruta, paginas, lineas_por_pagina=45, semilla=42):
+    """Escribe un PDF mínimo (Helvetica, texto ASCII) con el número de páginas indicado."""
+    rnd = random.Random(semilla)
+    objetos = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for p in range(paginas):
+        num_pagina, num_contenido = 4 + 2 * p, 5 + 2 * p
+        lineas = [f"Pagina {p + 1} - {frase(rnd, 10)}" for _ in range(lineas_por_pagina)]
+        lineas = [l.encode('ascii', 'replace').decode('ascii') for l in lineas]
+        flujo = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({l}) Tj T*" for l in lineas) + " ET"
+        flujo = flujo.encode('latin-1')
+        objetos[num_contenido] = b"<< /Length %d >>\nstream\n" % len(flujo) + flujo + b"\nendstream"
+        objetos[num_pagina] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                               b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % num_contenido)
+        kids.append(b"%d 0 R" % num_pagina)
+    objetos[2] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % paginas
+
+    with open(ruta, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        desplazamientos = {}
+        for num in sorted(objetos):
+            desplazamientos[num] = f.tell()
+            f.write(b"%d 0 obj\n" % num + objetos[num] + b"\nendobj\n")
+        inicio_xref = f.tell()
+        total = max(objetos) + 1
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % total)
+        for num in range(1, total):
+            f.write(b"%010d 00000 n \n" % desplazamientos[num])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (total, inicio_xref))
+
+
+def generar_excel(ruta, filas, semilla=42):
+    """Escribe un Excel con una hoja de registros de filas x 6 columnas."""
+    rnd = random.Random(semilla)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Registros"
+    ws.append(["Código", "Proceso", "Responsable", "Descripción", "Fecha", "Estado"])
+    for i in range(filas):
+        ws.append([f"REG-{i:05d}", rnd.choice(PALABRAS).upper(), frase(rnd, 2).title(),
+                   frase(rnd, 12), f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                   rnd.choice(["Abierto", "Cerrado", "En revisión"])])
+    wb.save(ruta)
+
+
+def medir(funcion, args, memoria):
+    """Devuelve (segundos, pico_mb, resultado). El pico solo se mide con memoria=True (otra llamada)."""
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    duracion = time.perf_counter() - inicio
+    if not memoria:
+        return duracion, None, resultado
+
+    tracemalloc.start()
+    funcion(*args)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duracion, pico / 1024 / 1024, resultado
+
+
+def formato_mb(pico):
+    return f"{pico:>10.1f}" if pico is not None else f"{'-':>10}"
+
+
+def comparar(titulo, unidad, casos, actual, anterior, memoria):
+    """Imprime la tabla de una comparación. casos: lista de (tamaño, argumentos)."""
+    print(f"\n{titulo}")
+    print(f"{unidad:>10}{'Actual s':>11}{'ms/1k':>9}{'Pico MB':>10}{'Anterior s':>12}{'ms/1k':>9}{'Pico MB':>10}")
+    for tamano, args in casos:
+        t_act, m_act, r_act = medir(actual, args, memoria)
+        t_ant, m_ant, r_ant = medir(anterior, args, memoria)
+        if r_act != r_ant:
+            print(f"❌ Resultados distintos con {tamano} {unidad.lower()}")
+            sys.exit(1)
+        print(f"{tamano:>10}{t_act:>11.3f}{t_act / tamano * 1e6:>9.1f}{formato_mb(m_act)}"
+              f"{t_ant:>12.3f}{t_ant / tamano * 1e6:>9.1f}{formato_mb(m_ant)}")
+
+
+def main():
+    memoria = '--memoria' in sys.argv
+    argumentos = [a for a in sys.argv[1:] if a != '--memoria']
+    paginas = int(argumentos[0]) if len(argumentos) > 0 else 500
+    filas = int(argumentos[1]) if len(argumentos) > 1 else 10000
+
+    print("=" * 72)
+    print("BENCHMARK DE EXTRACCIÓN DE TEXTO")
+    print("=" * 72)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        casos_pdf = []
+        casos_excel = []
+        for divisor in (4, 2, 1):
+            ruta_pdf = os.path.join(tmp, f"manual_{paginas // divisor}.pdf")
+            generar_pdf(ruta_pdf, paginas // divisor)
+            casos_pdf.append((paginas // divisor, (ruta_pdf,)))
+            ruta_excel = os.path.join(tmp, f"registros_{filas // divisor}.xlsx")
+            generar_excel(ruta_excel, filas // divisor)
+            casos_excel.append((filas // divisor, (ruta_excel,)))
+
+        comparar("📄 PDF (extraer_texto_pdf)", "Páginas", casos_pdf, extraer_texto_pdf, extraer_pdf_anterior, memoria)
+        comparar("📊 Excel (extraer_texto_excel)", "Filas", casos_excel, extraer_texto_excel, extraer_excel_anterior, memoria)
+
+    rnd = random.Random(7)
+    casos_formato = []
+    for num_docs in (500, 1000, 2000):
+        documentos = [(f"doc_{i}.txt", frase(rnd, 400)) for i in range(num_docs)]
+        casos_formato.append((num_docs, (documentos,)))
+    comparar("🏢 formatear_informacion_empresa", "Docs", casos_formato,
+             formatear_informacion_empresa, formatear_anterior, memoria)
+
+    print("\nms/1k: milisegundos por cada 1.000 páginas, filas o documentos "
+          "(constante = escalado lineal).")
+
+
+if __name__ == "__main__":
+    main()
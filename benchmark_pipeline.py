@@ -0,0 +1,488 @@
+"""
+Benchmark de extremo a extremo del pipeline de generación de documentos.
+
+Ejecuta las plantillas reales de "2. Plantilla/" y versiones sintéticas
+escaladas (por defecto 1×, 10× y 100×) contra el backend LLM simulado y
+mide, por etapa, el tiempo real, el pico de RSS del proceso y, con
+--tracemalloc, la memoria asignada (tracemalloc multiplica varias veces el
+tiempo de parseo de los .xlsx grandes, por eso es opcional):
+
+    leer_datos  → cargar_datos_auditoria
+    contexto    → generar_contexto_base
+    parseo      → abrir los .docx / .xlsx
+    escaneo     → compilar el índice de etiquetas y recolectar las IA
+    llm         → generar_respuestas_ia (esperas del LLM simulado)
+    escritura   → procesar_plantilla_*_memoria
+    guardado    → guardar cada documento en memoria
+
+Son las mismas fases de procesar_word, procesar_excel y
+procesar_documentos_streamlit; además se mide procesar_documentos_streamlit
+completo ('e2e', con la caché de plantillas en frío).
+
+Escalado sintético (factor N):
+- Word: el cuerpo del documento (párrafos y tablas) se repite N veces
+- Excel: las filas con contenido de las hojas con etiquetas se repiten N veces
+- DATA.xlsx: se añaden campos estáticos hasta multiplicar por N su número
+
+Las plantillas reales no contienen etiquetas {{IA:...}}, así que se inyectan
+--ia etiquetas por plantilla (antes de escalar) para ejercitar la etapa LLM.
+
+Los resultados se guardan en benchmarks/pipeline_<fecha>_<commit>.json y se
+comparan con el último resultado obtenido con los mismos parámetros para
+hacer visibles las regresiones entre commits.
+
+Uso:
+    python benchmark_pipeline.py [--escalas 1,10,100] [--latencia 0.02] [--ia 5]
+                                 [--plantillas "ICO-FO-06"] [--tracemalloc] [--sin-e2e]
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from copy import deepcopy
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIO_PLANTILLAS = os.path.join(BASE_DIR, "2. Plantilla")
+RUTA_DATA = os.path.join(BASE_DIR, "1. Data", "DATA.xlsx")
+DIRECTORIO_RESULTADOS = os.path.join(BASE_DIR, "benchmarks")
+
+# Umbral para marcar una etapa como regresión frente al resultado anterior
+UMBRAL_REGRESION = 0.10
+
+ETAPAS = ['leer_datos', 'contexto', 'parseo', 'escaneo', 'llm', 'escritura', 'guardado']
+
+
+def configurar_entorno(latencia, directorio_cache):
+    """
+    Fuerza un entorno sin red y sin cachés compartidas. Debe llamarse antes
+    de importar los módulos del proyecto (leen la configuración al importarse).
+    """
+    os.environ['LLM_BACKEND'] = 'simulado'
+    os.environ['LLM_SIMULADO_LATENCIA'] = str(latencia)
+    os.environ['LLM_SIMULADO_TASA_ERROR'] = '0'
+    os.environ['GEMINI_CACHE'] = '0'
+    os.environ['GEMINI_RPM'] = '1000000'
+    os.environ['GEMINI_TPM'] = '0'
+    os.environ['AGENTE_CACHE_DIR'] = directorio_cache
+
+
+class ArchivoMemoria:
+    """Imita un UploadedFile de Streamlit sobre unos bytes."""
+
+    def __init__(self, nombre, contenido):
+        self.name = nombre
+        self._contenido = contenido
+
+    def read(self):
+        return self._contenido
+
+    def abrir(self):
+        return io.BytesIO(self._contenido)
+
+
+def rss_pico_mb():
+    """Pico de memoria residente del proceso (MB), o None si no está disponible."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo reporta en KB, macOS en bytes
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+
+class Medidor:
+    """Mide tiempo, pico de RSS y memoria asignada de cada etapa."""
+
+    def __init__(self, usar_tracemalloc=False):
+        self.usar_tracemalloc = usar_tracemalloc
+        self.etapas = {}
+
+    @contextmanager
+    def etapa(self, nombre):
+        if self.usar_tracemalloc:
+            tracemalloc.reset_peak()
+            actual_inicio, _ = tracemalloc.get_traced_memory()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracion = time.perf_counter() - inicio
+            resultado = self.etapas.setdefault(nombre, {'segundos': 0.0})
+            resultado['segundos'] = round(resultado['segundos'] + duracion, 4)
+            resultado['rss_pico_mb'] = rss_pico_mb()
+            if self.usar_tracemalloc:
+                actual, pico = tracemalloc.get_traced_memory()
+                resultado['asignado_pico_mb'] = round(
+                    max(resultado.get('asignado_pico_mb', 0), (pico - actual_inicio) / (1024 * 1024)), 2
+                )
+                resultado['retenido_mb'] = round((actual - actual_inicio) / (1024 * 1024), 2)
+
+
+def inyectar_etiquetas_ia(doc, indice, cantidad, prefijo):
+    """
+    Añade una etiqueta {{IA:...}} al final de las primeras `cantidad`
+    ubicaciones con etiquetas de la plantilla.
+
+    Returns:
+        Lista de nombres de las etiquetas añadidas
+    """
+    from plantillas import parrafos_indexados, celdas_indexadas
+
+    es_excel = indice['tipo'] == 'excel'
+    elementos = celdas_indexadas(doc, indice) if es_excel else parrafos_indexados(doc, indice)
+
+    nombres = []
+    for i, elemento in enumerate(elementos):
+        if i >= cantidad:
+            break
+        nombre = f"{prefijo}_{i + 1}"
+        if es_excel:
+            elemento.value = f"{elemento.value} {{{{IA:{nombre}}}}}"
+        else:
+            elemento.add_run(f" {{{{IA:{nombre}}}}}")
+        nombres.append(nombre)
+    return nombres
+
+
+def escalar_word(doc, factor):
+    """Repite factor veces el contenido del cuerpo (párrafos y tablas)."""
+    from docx.oxml.ns import qn
+
+    cuerpo = doc.element.body
+    elementos = [e for e in cuerpo if e.tag != qn('w:sectPr')]
+    seccion = cuerpo.find(qn('w:sectPr'))
+    for _ in range(factor - 1):
+        for elemento in elementos:
+            copia = deepcopy(elemento)
+            if seccion is not None:
+                seccion.addprevious(copia)
+            else:
+                cuerpo.append(copia)
+
+
+def escalar_excel(wb, factor, indice):
+    """Repite factor veces las filas con contenido de las hojas que tienen etiquetas."""
+    hojas = {ubicacion['hoja'] for ubicacion in indice['ubicaciones']}
+    for nombre_hoja in hojas:
+        ws = wb[nombre_hoja]
+        alto = ws.max_row
+        valores = [
+            (celda.row, celda.column, celda.value)
+            for fila in ws.iter_rows(min_row=1, max_row=alto)
+            for celda in fila
+            if celda.value is not None
+        ]
+        for copia in range(1, factor):
+            desplazamiento = copia * alto
+            for fila, columna, valor in valores:
+                ws.cell(row=fila + desplazamiento, column=columna, value=valor)
+
+
+def preparar_plantillas(rutas, factor, ia_por_plantilla):
+    """
+    Genera los bytes de cada plantilla escalada con sus etiquetas IA inyectadas.
+
+    Returns:
+        Tupla (lista de (nombre, bytes), etiquetas estáticas, etiquetas IA)
+    """
+    import openpyxl
+    from docx import Document
+    from plantillas import compilar_word, compilar_excel
+
+    plantillas = []
+    estaticas = set()
+    etiquetas_ia = []
+
+    for numero, ruta in enumerate(rutas, 1):
+        nombre = os.path.basename(ruta)
+        es_excel = nombre.endswith('.xlsx')
+
+        doc = openpyxl.load_workbook(ruta) if es_excel else Document(ruta)
+        indice = compilar_excel(doc) if es_excel else compilar_word(doc)
+
+        if ia_por_plantilla:
+            etiquetas_ia.extend(inyectar_etiquetas_ia(doc, indice, ia_por_plantilla, f"BENCH_P{numero}"))
+
+        for ubicacion in indice['ubicaciones']:
+            estaticas.update(ubicacion['estaticas'])
+
+        if factor > 1:
+            if es_excel:
+                escalar_excel(doc, factor, indice)
+            else:
+                escalar_word(doc, factor)
+
+        salida = io.BytesIO()
+        doc.save(salida)
+        plantillas.append((nombre, salida.getvalue()))
+
+    return plantillas, estaticas, etiquetas_ia
+
+
+def preparar_data(estaticas, etiquetas_ia, factor):
+    """
+    Construye un DATA.xlsx con el formato real (CAMPO | VALOR | CAMPO_GENERADO).
+
+    Parte del DATA.xlsx real si existe, completa las etiquetas de las
+    plantillas que falten y multiplica por `factor` el número de campos.
+    """
+    import openpyxl
+
+    filas = []
+    if os.path.exists(RUTA_DATA):
+        ws = openpyxl.load_workbook(RUTA_DATA, data_only=True).active
+        filas = [list(fila[:3]) for fila in ws.iter_rows(min_row=2, values_only=True) if fila and fila[0]]
+
+    existentes = {str(fila[0]).strip() for fila in filas}
+    for campo in sorted(estaticas - existentes):
+        filas.append([campo, f"Valor de {campo}", f"{{{{{campo}}}}}"])
+    for campo in etiquetas_ia:
+        filas.append([
+            campo,
+            f"Redacta en máximo 90 palabras la sección {campo} del informe de auditoría de {{{{EMPRESA}}}}.",
+            f"{{{{IA:{campo}}}}}"
+        ])
+
+    base = len(filas)
+    for i in range(base * (factor - 1)):
+        filas.append([f"CAMPO_SINTETICO_{i}", f"Valor sintético {i}", f"{{{{CAMPO_SINTETICO_{i}}}}}"])
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['CAMPO', 'VALOR', 'CAMPO_GENERADO'])
+    for fila in filas:
+        ws.append(fila)
+    salida = io.BytesIO()
+    wb.save(salida)
+    return salida.getvalue(), len(filas)
+
+
+def medir_escenario(plantillas, data, usar_tracemalloc):
+    """Ejecuta las fases del pipeline midiendo cada etapa por separado."""
+    import openpyxl
+    from docx import Document
+    from config_auditoria import generar_contexto_base
+    from gemini_client import GeminiClient
+    from generacion_ia import recolectar_etiquetas_ia, resolver_etiquetas_ia, generar_respuestas_ia
+    from plantillas import compilar_word, compilar_excel
+    from datos_auditoria import cargar_datos_auditoria
+    from procesador_streamlit import procesar_plantilla_word_memoria, procesar_plantilla_excel_memoria
+
+    medidor = Medidor(usar_tracemalloc)
+    cliente = GeminiClient()
+
+    with medidor.etapa('leer_datos'):
+        datos = cargar_datos_auditoria(data, 'DATA.xlsx')
+        datos_estaticos, datos_ia, normas = datos.estaticos, datos.prompts_ia, datos.normas
+
+    with medidor.etapa('contexto'):
+        contexto_sistema = generar_contexto_base(normas, datos_estaticos, None, "")
+
+    cargadas = []
+    with medidor.etapa('parseo'):
+        for nombre, contenido in plantillas:
+            if nombre.endswith('.xlsx'):
+                cargadas.append((nombre, openpyxl.load_workbook(io.BytesIO(contenido))))
+            else:
+                cargadas.append((nombre, Document(io.BytesIO(contenido))))
+
+    with medidor.etapa('escaneo'):
+        indices = [compilar_excel(doc) if nombre.endswith('.xlsx') else compilar_word(doc) for nombre, doc in cargadas]
+        pendientes = resolver_etiquetas_ia(recolectar_etiquetas_ia(indices, datos_ia))
+
+    with medidor.etapa('llm'):
+        respuestas_ia = generar_respuestas_ia(cliente, pendientes, datos_ia, datos_estaticos, contexto_sistema)
+
+    generados = []
+    with medidor.etapa('escritura'):
+        for (nombre, doc), indice in zip(cargadas, indices):
+            procesar = procesar_plantilla_excel_memoria if nombre.endswith('.xlsx') else procesar_plantilla_word_memoria
+            doc_generado, _ = procesar(doc, indice, datos_estaticos, datos_ia, cliente, contexto_sistema, None, respuestas_ia)
+            generados.append(doc_generado)
+
+    with medidor.etapa('guardado'):
+        for doc_generado in generados:
+            doc_generado.save(io.BytesIO())
+
+    return {
+        'ubicaciones': sum(len(indice['ubicaciones']) for indice in indices),
+        'llamadas_ia': len(pendientes),
+        'etapas': medidor.etapas,
+    }
+
+
+def medir_e2e(plantillas, data):
+    """Tiempo total de procesar_documentos_streamlit (caché de plantillas en frío)."""
+    from procesador_streamlit import procesar_documentos_streamlit
+
+    inicio = time.perf_counter()
+    procesar_documentos_streamlit(
+        ArchivoMemoria('DATA.xlsx', data),
+        [ArchivoMemoria(nombre, contenido) for nombre, contenido in plantillas]
+    )
+    return round(time.perf_counter() - inicio, 4)
+
+
+def commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def resultado_anterior(parametros, excluir):
+    """
+    Devuelve (ruta, resultado) del último resultado guardado con los mismos
+    parámetros (distinto de `excluir`), o (None, None).
+    """
+    archivos = sorted(glob.glob(os.path.join(DIRECTORIO_RESULTADOS, 'pipeline_*.json')), reverse=True)
+    for ruta in archivos:
+        if os.path.abspath(ruta) == os.path.abspath(excluir):
+            continue
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                resultado = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if resultado.get('parametros') == parametros:
+            return ruta, resultado
+    return None, None
+
+
+def imprimir_escenario(escenario):
+    print(f"\n{'Etapa':<12}{'Tiempo (s)':>12}{'RSS pico (MB)':>16}{'Asignado pico (MB)':>21}")
+    print("-" * 61)
+    for nombre in ETAPAS:
+        etapa = escenario['etapas'].get(nombre)
+        if not etapa:
+            continue
+        rss = etapa.get('rss_pico_mb')
+        asignado = etapa.get('asignado_pico_mb')
+        print(f"{nombre:<12}{etapa['segundos']:>12.3f}"
+              f"{(f'{rss:.1f}' if rss is not None else '-'):>16}"
+              f"{(f'{asignado:.1f}' if asignado is not None else '-'):>21}")
+    if escenario.get('e2e_segundos') is not None:
+        print(f"{'e2e':<12}{escenario['e2e_segundos']:>12.3f}")
+
+
+def comparar(actual, anterior, ruta_anterior):
+    """Imprime la variación de tiempos por etapa frente al resultado anterior."""
+    previos = {e['escala']: e for e in anterior.get('escenarios', [])}
+    print(f"\n📊 Comparación con {os.path.basename(ruta_anterior)} (commit {anterior.get('commit')})")
+
+    for escenario in actual['escenarios']:
+        previo = previos.get(escenario['escala'])
+        if not previo:
+            continue
+        print(f"\n   Escala {escenario['escala']}×")
+        nombres = ETAPAS + ['e2e']
+        for nombre in nombres:
+            if nombre == 'e2e':
+                ahora, antes = escenario.get('e2e_segundos'), previo.get('e2e_segundos')
+            else:
+                ahora = escenario['etapas'].get(nombre, {}).get('segundos')
+                antes = previo['etapas'].get(nombre, {}).get('segundos')
+            if not ahora or not antes:
+                continue
+            variacion = (ahora - antes) / antes
+            marca = "⚠️ " if variacion > UMBRAL_REGRESION else "   "
+            print(f"   {marca}{nombre:<12}{antes:>9.3f}s → {ahora:>9.3f}s  ({variacion:+.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de generación de documentos")
+    parser.add_argument('--escalas', default='1,10,100', help="Factores de escala separados por comas")
+    parser.add_argument('--latencia', type=float, default=0.02, help="Latencia media del LLM simulado (s)")
+    parser.add_argument('--ia', type=int, default=5, help="Etiquetas IA inyectadas por plantilla")
+    parser.add_argument('--plantillas', default=None, help="Filtra las plantillas cuyo nombre contenga este texto")
+    parser.add_argument('--tracemalloc', action='store_true', help="Mide la memoria asignada por etapa (más lento)")
+    parser.add_argument('--sin-e2e', action='store_true', help="No ejecuta procesar_documentos_streamlit completo")
+    args = parser.parse_args()
+
+    directorio_cache = tempfile.mkdtemp(prefix='bench_cache_')
+    configurar_entorno(args.latencia, directorio_cache)
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+
+    rutas = sorted(
+        r for r in glob.glob(os.path.join(DIRECTORIO_PLANTILLAS, '*'))
+        if r.endswith(('.docx', '.xlsx')) and not os.path.basename(r).startswith('~$')
+    )
+    if args.plantillas:
+        rutas = [r for r in rutas if args.plantillas in os.path.basename(r)]
+    if not rutas:
+        print(f"❌ No hay plantillas en {DIRECTORIO_PLANTILLAS}")
+        return
+
+    escalas = [int(e) for e in args.escalas.split(',') if e.strip()]
+
+    print("=" * 61)
+    print("BENCHMARK DEL PIPELINE DE GENERACIÓN")
+    print("=" * 61)
+    print(f"Plantillas: {len(rutas)} | Escalas: {escalas} | LLM simulado: {args.latencia}s | IA/plantilla: {args.ia}")
+
+    usar_tracemalloc = args.tracemalloc
+    if usar_tracemalloc:
+        tracemalloc.start()
+
+    resultado = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'parametros': {
+            'latencia': args.latencia,
+            'ia_por_plantilla': args.ia,
+            'plantillas': [os.path.basename(r) for r in rutas],
+            'tracemalloc': usar_tracemalloc,
+        },
+        'escenarios': [],
+    }
+
+    try:
+        for escala in escalas:
+            print(f"\n🔧 Escala {escala}×: preparando plantillas y DATA sintéticos...")
+            plantillas, estaticas, etiquetas_ia = preparar_plantillas(rutas, escala, args.ia)
+            data, campos = preparar_data(estaticas, etiquetas_ia, escala)
+
+            escenario = {'escala': escala, 'campos_data': campos}
+            escenario.update(medir_escenario(plantillas, data, usar_tracemalloc))
+            escenario['e2e_segundos'] = None if args.sin_e2e else medir_e2e(plantillas, data)
+
+            print(f"   Ubicaciones: {escenario['ubicaciones']} | Llamadas IA: {escenario['llamadas_ia']} | Campos DATA: {campos}")
+            imprimir_escenario(escenario)
+            resultado['escenarios'].append(escenario)
+    finally:
+        if usar_tracemalloc:
+            tracemalloc.stop()
+        shutil.rmtree(directorio_cache, ignore_errors=True)
+
+    os.makedirs(DIRECTORIO_RESULTADOS, exist_ok=True)
+    nombre = f"pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{resultado['commit'] or 'sin-commit'}.json"
+    ruta = os.path.join(DIRECTORIO_RESULTADOS, nombre)
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Resultados guardados en {ruta}")
+
+    ruta_anterior, anterior = resultado_anterior(resultado['parametros'], ruta)
+    if anterior:
+        comparar(resultado, anterior, ruta_anterior)
+
+
+if __name__ == "__main__":
+    main()
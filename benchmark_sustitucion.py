@@ -0,0 +1,88 @@
+"""
+Micro-benchmark de sustitución de etiquetas estáticas.
+
+Compara el bucle anterior (un `etiqueta in texto` + replace por cada campo
+de DATA.xlsx en cada celda) contra sustituir_estaticas (una sola pasada
+de expresión regular con búsqueda en diccionario) sobre una plantilla
+sintética grande.
+
+Uso:
+    python benchmark_sustitucion.py [num_campos] [num_celdas]
+"""
+
+import random
+import sys
+import time
+
+from plantillas import sustituir_estaticas
+
+
+def sustituir_bucle(texto, datos_estaticos):
+    """Implementación anterior: recorre todos los campos por cada texto."""
+    cambios = False
+    for campo, valor in datos_estaticos.items():
+        etiqueta = f"{{{{{campo}}}}}"
+        if etiqueta in texto:
+            texto = texto.replace(etiqueta, str(valor))
+            cambios = True
+    return texto, cambios
+
+
+def generar_datos(num_campos):
+    """Genera un DATA.xlsx sintético con prefijos reales (DOC_, PROCESO_, SERVICIO_...)."""
+    prefijos = ['DOC_', 'PROCESO_', 'SERVICIO_', 'RESPONSABLE_PROC', 'NOMBRE_RESP', 'CAMPO_']
+    datos = {'EMPRESA': 'INVERSIONES ACME S.A.C.', 'RUC': '20613997025'}
+    for i in range(num_campos):
+        datos[f"{prefijos[i % len(prefijos)]}{i}"] = f"Valor de prueba número {i}"
+    return datos
+
+
+def generar_textos(datos, num_celdas, proporcion_etiquetadas=0.1, semilla=42):
+    """Genera textos de celdas: la mayoría sin etiquetas, algunas con 1-3 etiquetas."""
+    rnd = random.Random(semilla)
+    campos = list(datos)
+    textos = []
+    for i in range(num_celdas):
+        if rnd.random() < proporcion_etiquetadas:
+            etiquetas = " y ".join(f"{{{{{rnd.choice(campos)}}}}}" for _ in range(rnd.randint(1, 3)))
+            textos.append(f"Texto de la celda {i}: {etiquetas}.")
+        else:
+            textos.append(f"Texto fijo de la celda {i} sin etiquetas")
+    return textos
+
+
+def medir(funcion, textos, datos, repeticiones=3):
+    """Devuelve el mejor tiempo (segundos) de varias repeticiones y el resultado."""
+    mejor = None
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = [funcion(texto, datos)[0] for texto in textos]
+        duracion = time.perf_counter() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor, resultado
+
+
+def main():
+    num_campos = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    num_celdas = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    print("=" * 60)
+    print("BENCHMARK DE SUSTITUCIÓN DE ETIQUETAS ESTÁTICAS")
+    print("=" * 60)
+
+    datos = generar_datos(num_campos)
+    textos = generar_textos(datos, num_celdas)
+    print(f"Campos en DATA: {len(datos)} | Celdas: {len(textos)}")
+
+    t_bucle, r_bucle = medir(sustituir_bucle, textos, datos)
+    t_regex, r_regex = medir(sustituir_estaticas, textos, datos)
+
+    print(f"\nBucle por campo:      {t_bucle * 1000:9.1f} ms")
+    print(f"Una pasada (regex):   {t_regex * 1000:9.1f} ms")
+    print(f"Aceleración:          {t_bucle / t_regex:9.1f}x")
+    print(f"Resultados idénticos: {'✅ Sí' if r_bucle == r_regex else '❌ No'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark de memoria de un trabajo de Streamlit: salida en memoria vs. en disco.
+
+Ejecuta trabajos completos de GestorTrabajos (procesar_documentos_streamlit
+y el guardado de los documentos y el ZIP en la carpeta del trabajo) sobre
+las plantillas reales escaladas (como benchmark_pipeline.py) con el backend
+LLM simulado, en dos modos:
+
+- memoria: SALIDA_MEMORIA_MAX_MB=0, los documentos generados se quedan en
+  memoria hasta que termina el trabajo (como antes de usar SpooledTemporaryFile)
+- spool: cada documento pasa a un archivo temporal al superar
+  SALIDA_MEMORIA_MAX_MB (--umbral)
+
+Cada modo se ejecuta en un proceso nuevo y reporta el tiempo y el aumento
+del pico de RSS, en total y por trabajo (con --trabajos N se ejecutan N
+trabajos a la vez, como N usuarios en la instancia de 1 GB).
+
+Uso:
+    python benchmark_trabajo.py [--escala 10] [--ia 5] [--trabajos 2] [--umbral 2]
+                                [--plantillas "ICO-FO-06"]
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark_pipeline import DIRECTORIO_PLANTILLAS, configurar_entorno, preparar_data, preparar_plantillas
+
+MODOS = ('memoria', 'spool')
+
+
+def preparar_entradas(directorio, escala, ia, filtro):
+    """
+    Escribe en `directorio` el DATA.xlsx y las plantillas escaladas del trabajo.
+
+    Returns:
+        Número de plantillas
+    """
+    rutas = sorted(
+        r for r in glob.glob(os.path.join(DIRECTORIO_PLANTILLAS, '*'))
+        if r.endswith(('.docx', '.xlsx')) and not os.path.basename(r).startswith('~$')
+    )
+    if filtro:
+        rutas = [r for r in rutas if filtro in os.path.basename(r)]
+
+    plantillas, estaticas, etiquetas_ia = preparar_plantillas(rutas, escala, ia)
+    data, _ = preparar_data(estaticas, etiquetas_ia, escala)
+
+    os.makedirs(os.path.join(directorio, 'plantillas'))
+    with open(os.path.join(directorio, 'DATA.xlsx'), 'wb') as f:
+        f.write(data)
+    for nombre, contenido in plantillas:
+        with open(os.path.join(directorio, 'plantillas', nombre), 'wb') as f:
+            f.write(contenido)
+    return len(plantillas)
+
+
+def medir_en_hijo(modo, directorio, trabajos, umbral):
+    """Ejecuta los trabajos de un modo en un proceso nuevo y devuelve su resultado."""
+    entorno = dict(os.environ, SALIDA_MEMORIA_MAX_MB='0' if modo == 'memoria' else str(umbral))
+    salida = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--hijo', modo, directorio, str(trabajos)],
+        capture_output=True, text=True, check=True, env=entorno
+    ).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def ejecutar_hijo(modo, directorio, trabajos):
+    # Cada modo con su caché vacía; los módulos del proyecto leen AGENTE_CACHE_DIR al importarse
+    configurar_entorno(0, os.path.join(directorio, f'cache_{modo}'))
+    from benchmark_excel import pico_rss_kb
+    from trabajos import ArchivoEntrada, COMPLETADO, TERMINADOS, GestorTrabajos
+
+    carpeta_plantillas = os.path.join(directorio, 'plantillas')
+    gestor = GestorTrabajos(os.path.join(directorio, f'trabajos_{modo}'), workers=trabajos)
+
+    base = pico_rss_kb()
+    inicio = time.perf_counter()
+    ids = [
+        gestor.enviar(f'usuario{i}', ArchivoEntrada(os.path.join(directorio, 'DATA.xlsx')),
+                      [ArchivoEntrada(os.path.join(carpeta_plantillas, n)) for n in sorted(os.listdir(carpeta_plantillas))])
+        for i in range(trabajos)
+    ]
+    while not all(gestor.estado(i)['estado'] in TERMINADOS for i in ids):
+        time.sleep(0.05)
+    duracion = time.perf_counter() - inicio
+    pico = pico_rss_kb()
+
+    errores = [gestor.estado(i)['error'] for i in ids if gestor.estado(i)['estado'] != COMPLETADO]
+    resultado = gestor.resultado(ids[0]) or {'documentos': [], 'paquete': {'bytes': 0}}
+    print(json.dumps({
+        'segundos': duracion,
+        'rss_mb': (pico - base) / 1024,
+        'salida_mb': sum(d['bytes'] for d in resultado['documentos'] if d['tipo'] == 'documento') / (1024 * 1024),
+        'zip_mb': resultado['paquete']['bytes'] / (1024 * 1024),
+        'errores': errores,
+    }))
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--hijo':
+        ejecutar_hijo(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        return
+
+    parser = argparse.ArgumentParser(description="Memoria de un trabajo de Streamlit: salida en memoria vs. en disco")
+    parser.add_argument('--escala', type=int, default=10, help="Factor de escala de las plantillas y DATA")
+    parser.add_argument('--ia', type=int, default=5, help="Etiquetas IA inyectadas por plantilla")
+    parser.add_argument('--trabajos', type=int, default=1, help="Trabajos simultáneos")
+    parser.add_argument('--umbral', type=float, default=2, help="SALIDA_MEMORIA_MAX_MB del modo spool")
+    parser.add_argument('--plantillas', default=None, help="Filtra las plantillas cuyo nombre contenga este texto")
+    args = parser.parse_args()
+
+    print("=" * 78)
+    print("BENCHMARK DE MEMORIA: TRABAJO CON SALIDA EN MEMORIA VS. EN DISCO")
+    print("=" * 78)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configurar_entorno(0, os.path.join(tmp, 'cache_preparacion'))
+        num_plantillas = preparar_entradas(tmp, args.escala, args.ia, args.plantillas)
+        if not num_plantillas:
+            print(f"❌ No hay plantillas en {DIRECTORIO_PLANTILLAS}")
+            sys.exit(1)
+        print(f"Plantillas: {num_plantillas} | Escala: {args.escala}× | Trabajos simultáneos: {args.trabajos} | "
+              f"Umbral spool: {args.umbral} MB")
+
+        print(f"\n{'Modo':<10}{'Segundos':>10}{'RSS MB':>10}{'MB/trabajo':>12}{'Salida MB':>11}{'ZIP MB':>9}")
+        for modo in MODOS:
+            r = medir_en_hijo(modo, tmp, args.trabajos, args.umbral)
+            if r['errores']:
+                print(f"❌ Errores en modo {modo}: {r['errores']}")
+                sys.exit(1)
+            print(f"{modo:<10}{r['segundos']:>10.2f}{r['rss_mb']:>10.1f}{r['rss_mb'] / args.trabajos:>12.1f}"
+                  f"{r['salida_mb']:>11.1f}{r['zip_mb']:>9.1f}")
+
+    print("\nRSS MB: aumento del pico de memoria residente del proceso durante los trabajos.")
+
+
+if __name__ == "__main__":
+    main()
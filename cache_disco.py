@@ -0,0 +1,173 @@
+"""
+Caché persistente en disco, direccionada por contenido.
+
+Cada entrada se guarda como un archivo pickle dentro de un directorio
+fragmentado por los dos primeros caracteres de la clave (ab/abcdef...pkl).
+La fecha de modificación del archivo se usa como marca de último acceso,
+lo que permite una política de desalojo LRU limitada por tamaño total.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIO_CACHE = os.getenv('AGENTE_CACHE_DIR', os.path.join(BASE_DIR, '.cache'))
+
+def hash_bytes(*partes):
+    """
+    Calcula el SHA-256 de una o varias partes (bytes o str).
+
+    Returns:
+        String hexadecimal de 64 caracteres
+    """
+    h = hashlib.sha256()
+    for parte in partes:
+        if isinstance(parte, str):
+            parte = parte.encode('utf-8')
+        h.update(parte)
+        h.update(b'\x00')
+    return h.hexdigest()
+
+def hash_archivo(ruta, tam_bloque=1024 * 1024):
+    """Calcula el SHA-256 del contenido de un archivo sin cargarlo entero en memoria."""
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(tam_bloque), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def hash_flujo(flujo, *partes, tam_bloque=1024 * 1024):
+    """
+    Calcula el SHA-256 de un flujo binario (leído por bloques desde su
+    posición actual) seguido de las partes; coincide con
+    hash_bytes(contenido, *partes).
+    """
+    h = hashlib.sha256()
+    for bloque in iter(lambda: flujo.read(tam_bloque), b''):
+        h.update(bloque)
+    h.update(b'\x00')
+    for parte in partes:
+        if isinstance(parte, str):
+            parte = parte.encode('utf-8')
+        h.update(parte)
+        h.update(b'\x00')
+    return h.hexdigest()
+
+class CacheDisco:
+    """
+    Almacén clave → objeto en disco con desalojo LRU por tamaño.
+
+    Funcionalidades:
+    - Escritura atómica (archivo temporal + os.replace)
+    - Límite de tamaño total en bytes (desaloja las entradas menos usadas)
+    - Caducidad opcional (ttl en segundos)
+    - Contadores de aciertos y fallos
+    """
+
+    def __init__(self, directorio, max_bytes, ttl=None):
+        """
+        Args:
+            directorio: Carpeta donde se guardan las entradas
+            max_bytes: Tamaño máximo total de la caché
+            ttl: Segundos de validez de cada entrada (None = sin caducidad)
+        """
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        # Tamaño total aproximado; se calcula recorriendo el directorio la primera vez
+        self._total = None
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], f"{clave}.pkl")
+
+    def obtener(self, clave):
+        """
+        Devuelve el objeto guardado para la clave, o None si no existe o caducó.
+        """
+        ruta = self._ruta(clave)
+        try:
+            # La fecha de creación se guarda junto al valor
+            with open(ruta, 'rb') as f:
+                creado, valor = pickle.load(f)
+            if self.ttl is not None and time.time() - creado > self.ttl:
+                self._eliminar(ruta)
+                valor = None
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError, ImportError):
+            valor = None
+
+        with self._lock:
+            if valor is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+
+        # Marca de último acceso para el desalojo LRU
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass
+        return valor
+
+    def guardar(self, clave, valor):
+        """
+        Guarda un objeto en la caché y desaloja entradas si se supera el límite.
+        Los errores de escritura se ignoran: la caché nunca debe romper el proceso.
+        """
+        ruta = self._ruta(clave)
+        try:
+            anterior = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            fd, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((time.time(), valor), f, protocol=pickle.HIGHEST_PROTOCOL)
+            nuevo = os.path.getsize(temporal)
+            os.replace(temporal, ruta)
+        except Exception:
+            return
+
+        with self._lock:
+            if self._total is not None:
+                self._total += nuevo - anterior
+                if self._total <= self.max_bytes:
+                    return
+
+        self.desalojar()
+
+    def desalojar(self):
+        """Elimina las entradas menos usadas hasta quedar por debajo del límite."""
+        with self._lock:
+            entradas = []
+            total = 0
+            for raiz, _, archivos in os.walk(self.directorio):
+                for nombre in archivos:
+                    if not nombre.endswith('.pkl'):
+                        continue
+                    ruta = os.path.join(raiz, nombre)
+                    try:
+                        st = os.stat(ruta)
+                    except OSError:
+                        continue
+                    entradas.append((st.st_mtime, st.st_size, ruta))
+                    total += st.st_size
+
+            if total > self.max_bytes:
+                for _, tam, ruta in sorted(entradas):
+                    self._eliminar(ruta)
+                    total -= tam
+                    if total <= self.max_bytes:
+                        break
+
+            self._total = total
+
+    def _eliminar(self, ruta):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
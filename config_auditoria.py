@@ -4,18 +4,14 @@ Define el contexto base que se aplica a TODAS las generaciones de IA.
 """
 
 import os
+import threading
 
-def cargar_prompt_sistema():
-    """Lee el prompt del sistema desde el archivo prompt.txt"""
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    ruta_prompt = os.path.join(base_dir, 'prompt.txt')
-    
-    try:
-        with open(ruta_prompt, 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        print("⚠️  Archivo prompt.txt no encontrado, usando prompt por defecto")
-        return """
+from datos_auditoria import recolectar_documentos_sig, recolectar_procesos
+from trazas import medido
+
+RUTA_PROMPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompt.txt')
+
+PROMPT_POR_DEFECTO = """
 Eres un auditor experto en sistemas de gestión ISO.
 
 NORMAS AUDITADAS: {NORMAS_AUDITADAS}
@@ -25,7 +21,39 @@ RUC: {RUC}
 Genera contenido profesional y específico para auditorías.
 """
 
-CONTEXTO_SISTEMA = cargar_prompt_sistema()
+# Último prompt leído y la firma (fecha de modificación, tamaño) de prompt.txt al leerlo
+_prompt_sistema = {'firma': None, 'texto': None}
+_lock_prompt = threading.Lock()
+
+def cargar_prompt_sistema():
+    """
+    Lee el prompt del sistema desde el archivo prompt.txt.
+    
+    El texto se guarda en memoria y solo se vuelve a leer cuando cambia la
+    fecha de modificación o el tamaño del archivo: los cambios en prompt.txt
+    se aplican en la siguiente ejecución sin reiniciar la app.
+    """
+    try:
+        estado = os.stat(RUTA_PROMPT)
+        firma = (estado.st_mtime_ns, estado.st_size)
+    except FileNotFoundError:
+        firma = None
+    
+    with _lock_prompt:
+        if _prompt_sistema['texto'] is not None and _prompt_sistema['firma'] == firma:
+            return _prompt_sistema['texto']
+        
+        try:
+            with open(RUTA_PROMPT, 'r', encoding='utf-8') as f:
+                texto = f.read()
+            if _prompt_sistema['texto'] is not None:
+                print("🔄 prompt.txt modificado: se usa el nuevo prompt del sistema")
+        except FileNotFoundError:
+            print("⚠️  Archivo prompt.txt no encontrado, usando prompt por defecto")
+            texto = PROMPT_POR_DEFECTO
+        
+        _prompt_sistema.update(firma=firma, texto=texto)
+        return texto
 
 def formatear_procesos(datos_estaticos):
     """
@@ -37,49 +65,31 @@ def formatear_procesos(datos_estaticos):
     Returns:
         String formateado con la lista de procesos y personal
     """
-    procesos_texto = "\n\n═══════════════════════════════════════════════════════════════════════\n"
-    procesos_texto += "PERSONAL DE LA EMPRESA (USAR ESTOS NOMBRES REALES):\n\n"
-    procesos_texto += "IMPORTANTE: SOLO usa estos nombres reales en las entrevistas. NO inventes nombres.\n\n"
-    
-    num_proceso = 1
-    procesos_encontrados = []
-    
-    while f'PROCESO_{num_proceso}' in datos_estaticos:
-        proceso = datos_estaticos.get(f'PROCESO_{num_proceso}', '')
-        responsable = datos_estaticos.get(f'RESPONSABLE_PROC{num_proceso}', '')
-        nombre = datos_estaticos.get(f'NOMBRE_RESP{num_proceso}', '')
-        tipo = datos_estaticos.get(f'TIPOPROC_{num_proceso}', '')
-        cantidad = datos_estaticos.get(f'CANTPROC_{num_proceso}', '')
-        
-        if proceso or responsable or nombre:
-            procesos_encontrados.append({
-                'num': num_proceso,
-                'proceso': proceso,
-                'responsable': responsable,
-                'nombre': nombre,
-                'tipo': tipo,
-                'cantidad': cantidad
-            })
-        
-        num_proceso += 1
+    return "".join(iterar_procesos(datos_estaticos))
+
+def iterar_procesos(datos_estaticos):
+    """Genera por fragmentos el texto de formatear_procesos (nada si no hay procesos)."""
+    procesos_encontrados = recolectar_procesos(datos_estaticos)
+    if not procesos_encontrados:
+        return
+    
+    yield "\n\n═══════════════════════════════════════════════════════════════════════\n"
+    yield "PERSONAL DE LA EMPRESA (USAR ESTOS NOMBRES REALES):\n\n"
+    yield "IMPORTANTE: SOLO usa estos nombres reales en las entrevistas. NO inventes nombres.\n\n"
     
     for proc in procesos_encontrados:
-        procesos_texto += f"{proc['num']}. {proc['proceso']}\n"
+        yield f"{proc['num']}. {proc['proceso']}\n"
         if proc['responsable']:
-            procesos_texto += f"   - Cargo: {proc['responsable']}\n"
+            yield f"   - Cargo: {proc['responsable']}\n"
         if proc['nombre']:
-            procesos_texto += f"   - Nombre: {proc['nombre']}\n"
+            yield f"   - Nombre: {proc['nombre']}\n"
         if proc['tipo']:
-            procesos_texto += f"   - Tipo: {proc['tipo']}\n"
+            yield f"   - Tipo: {proc['tipo']}\n"
         if proc['cantidad']:
-            procesos_texto += f"   - Personal: {proc['cantidad']} persona(s)\n"
-        procesos_texto += "\n"
+            yield f"   - Personal: {proc['cantidad']} persona(s)\n"
+        yield "\n"
     
-    if procesos_encontrados:
-        procesos_texto += "═══════════════════════════════════════════════════════════════════════\n"
-        return procesos_texto
-    else:
-        return ""
+    yield "═══════════════════════════════════════════════════════════════════════\n"
 
 def extraer_catalogo_documentos_sig(datos_estaticos):
     """
@@ -91,32 +101,29 @@ def extraer_catalogo_documentos_sig(datos_estaticos):
     Returns:
         String con catálogo formateado de documentos del SIG
     """
-    documentos_sig = []
-    
-    # Extraer solo campos que empiezan con DOC_ y tienen valor
-    for campo, valor in sorted(datos_estaticos.items()):
-        if campo.startswith('DOC_') and valor and str(valor).strip():
-            documentos_sig.append(str(valor).strip())
-    
+    return "".join(iterar_catalogo_documentos_sig(datos_estaticos))
+
+def iterar_catalogo_documentos_sig(datos_estaticos):
+    """Genera por fragmentos el texto de extraer_catalogo_documentos_sig (nada si no hay DOC_*)."""
+    documentos_sig = recolectar_documentos_sig(datos_estaticos)
     if not documentos_sig:
-        return ""
+        return
     
     # Formatear catálogo destacado
-    catalogo = "\n\n" + "="*70 + "\n"
-    catalogo += "📋 DOCUMENTOS DEL SIG DISPONIBLES PARA CITAR\n"
-    catalogo += "="*70 + "\n\n"
-    catalogo += f"Total de documentos registrados: {len(documentos_sig)}\n\n"
+    yield "\n\n" + "="*70 + "\n"
+    yield "📋 DOCUMENTOS DEL SIG DISPONIBLES PARA CITAR\n"
+    yield "="*70 + "\n\n"
+    yield f"Total de documentos registrados: {len(documentos_sig)}\n\n"
     
     for i, doc in enumerate(documentos_sig, 1):
-        catalogo += f"{i}. {doc}\n"
+        yield f"{i}. {doc}\n"
     
-    catalogo += "\n" + "="*70 + "\n"
-    catalogo += "⚠️  IMPORTANTE: Cita estos documentos con su código y versión exacta\n"
-    catalogo += "cuando generes evidencias de auditoría.\n"
-    catalogo += "="*70 + "\n"
-    
-    return catalogo
+    yield "\n" + "="*70 + "\n"
+    yield "⚠️  IMPORTANTE: Cita estos documentos con su código y versión exacta\n"
+    yield "cuando generes evidencias de auditoría.\n"
+    yield "="*70 + "\n"
 
+@medido('generar_contexto_base', lambda contexto: {'caracteres': len(contexto), 'tokens': len(contexto) // 4})
 def generar_contexto_base(normas, datos_estaticos, catalogo_documentos=None, contexto_empresa=None):
     """
     Genera el contexto base personalizado para esta ejecución.
@@ -130,53 +137,47 @@ def generar_contexto_base(normas, datos_estaticos, catalogo_documentos=None, con
     Returns:
         String con el contexto formateado
     """
+    return "".join(iterar_contexto_base(normas, datos_estaticos, contexto_empresa))
+
+def iterar_contexto_base(normas, datos_estaticos, contexto_empresa=None):
+    """
+    Genera el contexto base por secciones, en el orden de generar_contexto_base.
+    Permite escribirlo por partes (p. ej. a CONTEXTO_IA.txt) sin concatenarlo.
+    """
     normas_texto = "\n   - ".join(normas) if normas else "No especificadas"
     
     # 1. Template base con normas
-    contexto = CONTEXTO_SISTEMA.format(
+    yield cargar_prompt_sistema().format(
         NORMAS_AUDITADAS=normas_texto,
         EMPRESA=datos_estaticos.get('EMPRESA', 'No especificada'),
         RUC=datos_estaticos.get('RUC', 'No especificado')
     )
     
     # 2. Catálogo de documentos del SIG (destacado)
-    catalogo_sig = extraer_catalogo_documentos_sig(datos_estaticos)
-    if catalogo_sig:
-        contexto += catalogo_sig
+    yield from iterar_catalogo_documentos_sig(datos_estaticos)
     
     # 3. Alcance del SIG (destacado - MUY IMPORTANTE)
-    alcance_texto = extraer_alcance(datos_estaticos)
-    if alcance_texto:
-        contexto += alcance_texto
+    yield extraer_alcance(datos_estaticos)
     
     # 4. Personal y Procesos (destacado)
-    procesos_info = formatear_procesos(datos_estaticos)
-    if procesos_info:
-        contexto += procesos_info
+    yield from iterar_procesos(datos_estaticos)
     
     # 4.5. Función de Cumplimiento (SOLO si se audita ISO 37001)
-    funcion_cumplimiento = extraer_funcion_cumplimiento(datos_estaticos, normas)
-    if funcion_cumplimiento:
-        contexto += funcion_cumplimiento
+    yield extraer_funcion_cumplimiento(datos_estaticos, normas)
     
     # 5. Servicio/Proyecto principal (destacado - foco de muestreo)
-    servicio_principal = extraer_servicio_principal(datos_estaticos)
-    if servicio_principal:
-        contexto += servicio_principal
+    yield extraer_servicio_principal(datos_estaticos)
     
     # 6. Datos básicos de la empresa (limpios, sin DOC_* ni etiquetas)
-    datos_limpios = formatear_datos_empresa_limpios(datos_estaticos)
-    if datos_limpios:
-        contexto += datos_limpios
+    yield formatear_datos_empresa_limpios(datos_estaticos)
     
     # 7. Contexto empresa (RAG) si existe
     if contexto_empresa:
-        contexto += "\n\n" + "="*70 + "\n"
-        contexto += "📄 INFORMACIÓN ADICIONAL DE DOCUMENTOS EMPRESA\n"
-        contexto += "="*70 + "\n"
-        contexto += contexto_empresa
-    
-    return contexto
+        yield "\n\n" + "="*70 + "\n"
+        yield "📄 INFORMACIÓN ADICIONAL DE DOCUMENTOS EMPRESA\n"
+        yield "="*70 + "\n"
+        yield contexto_empresa
+
 def extraer_alcance(datos_estaticos):
     """
     Extrae y destaca el ALCANCE del sistema de gestión.
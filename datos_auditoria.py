@@ -0,0 +1,222 @@
+"""
+Datos de la auditoría (DATA.xlsx): un único lector para todos los scripts.
+
+DATA.xlsx tiene tres columnas:
+- Columna A: Campo (nombre de la variable)
+- Columna B: Valor (dato estático O prompt si es IA)
+- Columna C: Campo Generado (etiqueta)
+
+Si Campo Generado empieza con {{IA: el valor es un prompt; si no, es un
+dato estático. A partir de los datos estáticos se derivan las normas, los
+procesos con su personal, los servicios y el catálogo de documentos DOC_*.
+
+El resultado es un objeto DatosAuditoria inmutable, memorizado por el
+SHA-256 del archivo: en memoria (la misma ejecución o sesión de Streamlit
+comparte un solo objeto) y en disco (.cache/datos/), de modo que inyectar_word,
+inyectar_excel y generar_contexto.py sobre el mismo DATA.xlsx lo parsean
+una sola vez.
+
+Ejemplo:
+    >>> datos = leer_datos_auditoria('1. Data')
+    >>> datos.estaticos['EMPRESA'], datos.normas
+"""
+
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Tuple
+
+from cache_disco import CacheDisco, DIRECTORIO_CACHE, hash_archivo, hash_bytes
+from lector_excel import iterar_filas
+from trazas import medir
+
+# Cambiar al modificar parsear_data: invalida la caché de datos
+VERSION_LECTOR_DATOS = 2
+MAX_DATOS_EN_MEMORIA = 8
+
+_cache_datos = CacheDisco(os.path.join(DIRECTORIO_CACHE, 'datos'), max_bytes=16 * 1024 * 1024)
+_memoria = OrderedDict()
+_lock = threading.Lock()
+
+@dataclass(frozen=True)
+class DatosAuditoria:
+    """
+    Datos de una auditoría leídos de DATA.xlsx (inmutables).
+
+    Attributes:
+        estaticos: {campo: valor} de los datos estáticos
+        prompts_ia: {campo: prompt} de las etiquetas {{IA:...}}
+        normas: Normas auditadas (campos NORMA*, sin *_RESUMEN)
+        procesos: Procesos con personal (ver recolectar_procesos)
+        servicios: SERVICIO_1..SERVICIO_6 con valor, en orden
+        documentos_sig: Documentos del SIG (campos DOC_* con valor, por nombre de campo)
+        archivo: Nombre del archivo de origen
+        huella: SHA-256 del archivo de origen
+    """
+    estaticos: Mapping[str, Any]
+    prompts_ia: Mapping[str, Any]
+    normas: Tuple[str, ...]
+    procesos: Tuple[Mapping[str, Any], ...]
+    servicios: Tuple[str, ...]
+    documentos_sig: Tuple[str, ...]
+    archivo: str = ""
+    huella: str = ""
+
+    @classmethod
+    def desde_campos(cls, estaticos, prompts_ia, archivo="", huella=""):
+        """Construye el objeto a partir de los diccionarios de campos, derivando el resto."""
+        return cls(
+            estaticos=MappingProxyType(dict(estaticos)),
+            prompts_ia=MappingProxyType(dict(prompts_ia)),
+            normas=tuple(detectar_normas(estaticos)),
+            procesos=tuple(MappingProxyType(p) for p in recolectar_procesos(estaticos)),
+            servicios=tuple(recolectar_servicios(estaticos)),
+            documentos_sig=tuple(recolectar_documentos_sig(estaticos)),
+            archivo=archivo,
+            huella=huella,
+        )
+
+def detectar_normas(datos_estaticos):
+    """Valores de los campos NORMA* (excepto *_RESUMEN) con valor."""
+    return [
+        str(valor) for campo, valor in datos_estaticos.items()
+        if 'NORMA' in campo.upper() and valor and not campo.endswith('_RESUMEN')
+    ]
+
+def recolectar_procesos(datos_estaticos):
+    """
+    Procesos PROCESO_1, PROCESO_2... (hasta el primer número que falte) con
+    su responsable y personal.
+
+    Returns:
+        Lista de diccionarios {'num', 'proceso', 'responsable', 'nombre', 'tipo', 'cantidad'}
+    """
+    procesos = []
+    num_proceso = 1
+    while f'PROCESO_{num_proceso}' in datos_estaticos:
+        proceso = datos_estaticos.get(f'PROCESO_{num_proceso}', '')
+        responsable = datos_estaticos.get(f'RESPONSABLE_PROC{num_proceso}', '')
+        nombre = datos_estaticos.get(f'NOMBRE_RESP{num_proceso}', '')
+        if proceso or responsable or nombre:
+            procesos.append({
+                'num': num_proceso,
+                'proceso': proceso,
+                'responsable': responsable,
+                'nombre': nombre,
+                'tipo': datos_estaticos.get(f'TIPOPROC_{num_proceso}', ''),
+                'cantidad': datos_estaticos.get(f'CANTPROC_{num_proceso}', '')
+            })
+        num_proceso += 1
+    return procesos
+
+def recolectar_servicios(datos_estaticos):
+    """Valores de SERVICIO_1..SERVICIO_6 no vacíos, en orden."""
+    servicios = []
+    for i in range(1, 7):
+        servicio = datos_estaticos.get(f'SERVICIO_{i}', '')
+        if servicio and str(servicio).strip():
+            servicios.append(str(servicio))
+    return servicios
+
+def recolectar_documentos_sig(datos_estaticos):
+    """Valores de los campos DOC_* no vacíos, ordenados por nombre de campo."""
+    return [
+        str(valor).strip() for campo, valor in sorted(datos_estaticos.items())
+        if campo.startswith('DOC_') and valor and str(valor).strip()
+    ]
+
+def parsear_data(origen):
+    """
+    Lee las filas de DATA.xlsx en streaming.
+
+    Args:
+        origen: Ruta o bytes del libro
+
+    Returns:
+        Tupla (datos_estaticos, datos_ia) como diccionarios
+    """
+    datos_estaticos = {}
+    datos_ia = {}
+    for _, row in iterar_filas(origen, min_fila=2, max_columnas=3):
+        if not row[0]:
+            continue
+        campo = str(row[0]).strip()
+        valor = row[1] if row[1] is not None else ""
+        campo_generado = str(row[2]).strip() if row[2] else ""
+        if campo_generado.startswith("{{IA:"):
+            datos_ia[campo] = valor
+        else:
+            datos_estaticos[campo] = valor
+    return datos_estaticos, datos_ia
+
+def cargar_datos_auditoria(origen, nombre=None):
+    """
+    Devuelve los datos de auditoría de un DATA.xlsx, parseándolo solo si
+    no está memorizado (en memoria o en la caché en disco).
+
+    Args:
+        origen: Ruta o bytes del libro
+        nombre: Nombre a mostrar (por defecto, el nombre del archivo)
+
+    Returns:
+        DatosAuditoria
+    """
+    if isinstance(origen, (bytes, bytearray)):
+        huella = hashlib.sha256(origen).hexdigest()  # igual que hash_archivo
+        nombre = nombre or "DATA.xlsx"
+    else:
+        huella = hash_archivo(origen)
+        nombre = nombre or os.path.basename(origen)
+    clave = hash_bytes(huella, f"datos-v{VERSION_LECTOR_DATOS}")
+
+    with medir('leer_datos_excel', archivo=nombre) as evento:
+        with _lock:
+            datos = _memoria.get(clave)
+            if datos is not None:
+                _memoria.move_to_end(clave)
+        if datos is not None:
+            evento['cache'] = 'acierto'
+        else:
+            campos = _cache_datos.obtener(clave)
+            evento['cache'] = 'acierto' if campos is not None else 'fallo'
+            if campos is None:
+                campos = parsear_data(origen)
+                _cache_datos.guardar(clave, campos)
+            datos = DatosAuditoria.desde_campos(*campos, archivo=nombre, huella=huella)
+            with _lock:
+                _memoria[clave] = datos
+                while len(_memoria) > MAX_DATOS_EN_MEMORIA:
+                    _memoria.popitem(last=False)
+
+        evento['estaticos'] = len(datos.estaticos)
+        evento['ia'] = len(datos.prompts_ia)
+    return datos
+
+def buscar_data(directorio):
+    """Primer .xlsx de la carpeta de datos (sin archivos temporales ~$), o None."""
+    archivos = sorted(
+        a for a in glob.glob(os.path.join(directorio, '*.xlsx'))
+        if not os.path.basename(a).startswith('~$')
+    )
+    return archivos[0] if archivos else None
+
+def leer_datos_auditoria(directorio) -> Optional[DatosAuditoria]:
+    """
+    Busca el DATA.xlsx de la carpeta de datos y devuelve sus datos.
+
+    Returns:
+        DatosAuditoria, o None si la carpeta no tiene ningún Excel
+    """
+    archivo_excel = buscar_data(directorio)
+    if archivo_excel is None:
+        print(f"❌ No se encontró ningún archivo Excel en la carpeta '{directorio}'")
+        return None
+
+    print(f"📄 Leyendo datos desde: {os.path.basename(archivo_excel)}")
+    datos = cargar_datos_auditoria(archivo_excel)
+    print(f"   {len(datos.estaticos)} campos estáticos, {len(datos.prompts_ia)} prompts de IA")
+    return datos
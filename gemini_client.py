@@ -3,9 +3,28 @@ Cliente para interactuar con Gemini API.
 Maneja la generación de texto mediante IA.
 """
 
-import google.generativeai as genai
-from dotenv import load_dotenv
 import os
+import threading
+import time
+
+from plantillas import sustituir_estaticas
+from cache_disco import CacheDisco, DIRECTORIO_CACHE, hash_bytes
+from limitador import (GeneracionCancelada, LimitadorTasa, PresupuestoErrores,
+                       ejecutar_con_reintentos)
+from backends_llm import componer_prompt, crear_backend, estimar_tokens
+from trazas import medir
+from recuperacion import anexar_fragmentos
+
+# Caché persistente de respuestas (GEMINI_CACHE=0 la desactiva)
+CACHE_RESPUESTAS_ACTIVA = os.getenv('GEMINI_CACHE', '1') != '0'
+CACHE_RESPUESTAS_TTL_HORAS = float(os.getenv('GEMINI_CACHE_TTL_HORAS', '168'))
+CACHE_RESPUESTAS_MAX_MB = int(os.getenv('GEMINI_CACHE_MAX_MB', '64'))
+
+# Límites de tráfico, reintentos y errores tolerados por ejecución
+GEMINI_RPM = int(os.getenv('GEMINI_RPM', '60'))
+GEMINI_TPM = int(os.getenv('GEMINI_TPM', '1000000'))
+GEMINI_MAX_REINTENTOS = int(os.getenv('GEMINI_MAX_REINTENTOS', '4'))
+GEMINI_PRESUPUESTO_ERRORES = int(os.getenv('GEMINI_PRESUPUESTO_ERRORES', '3'))
 
 class GeminiClient:
     """
@@ -15,36 +34,154 @@ class GeminiClient:
     - Configuración automática desde archivo .env
     - Generación de texto con contexto dinámico
     - Manejo de errores
+    - Seguro para uso desde varios hilos (generación concurrente)
+    - Caché persistente de respuestas (modelo + prompt + contexto)
+    - Limitador de tasa, reintentos con backoff y presupuesto de errores
+    - Contexto del sistema subido una sola vez por ejecución (caché de contexto)
+    - Backend intercambiable (LLM_BACKEND=simulado para pruebas sin red)
+    - Fragmentos relevantes de los documentos de la empresa en cada prompt
+    - Generación en streaming con el texto parcial en un callback
+    - Creación inmediata: la configuración, el modelo y las conexiones de
+      Gemini se comparten en el proceso; cada instancia guarda solo el estado
+      de su ejecución (contexto, documentos, limitador, errores)
     """
     
-    def __init__(self):
+    _lock_debug = threading.Lock()
+    
+    def __init__(self, usar_cache=None, ignorar_cache=None, limitador=None, presupuesto_errores=None, backend=None):
         """
         Inicializa el cliente Gemini.
-        Lee la API key desde el archivo .env
+        Con el backend Gemini lee la API key desde el archivo .env
+        
+        Args:
+            usar_cache: Activa la caché de respuestas (por defecto GEMINI_CACHE)
+            ignorar_cache: No lee la caché pero guarda las respuestas nuevas,
+                          útil para forzar variación (por defecto GEMINI_CACHE_BYPASS)
+            limitador: LimitadorTasa compartido (por defecto GEMINI_RPM / GEMINI_TPM)
+            presupuesto_errores: Fallos definitivos tolerados antes de abortar
+                                (por defecto GEMINI_PRESUPUESTO_ERRORES)
+            backend: BackendLLM a usar, o su nombre ('gemini', 'simulado');
+                    por defecto el indicado en LLM_BACKEND
         """
-        api_key = None
-        try:
-            import streamlit as st
-            if hasattr(st, 'secrets') and 'GEMINI_API_KEY' in st.secrets:
-                api_key = st.secrets['GEMINI_API_KEY']
-        except:
-            pass
+        if backend is None or isinstance(backend, str):
+            backend = crear_backend(backend)
+        
+        self.backend = backend
+        self.nombre_modelo = backend.nombre_modelo
         
-        if not api_key:
-            load_dotenv()
-            api_key = os.getenv('GEMINI_API_KEY')
+        if usar_cache is None:
+            usar_cache = CACHE_RESPUESTAS_ACTIVA
+        if ignorar_cache is None:
+            ignorar_cache = os.getenv('GEMINI_CACHE_BYPASS', '0') == '1'
         
-        if not api_key:
-            raise ValueError(
-                "GEMINI_API_KEY no encontrada. "
-                "Configúrala en .env o en Streamlit secrets"
+        self.ignorar_cache = ignorar_cache
+        self.cache = None
+        if usar_cache:
+            self.cache = CacheDisco(
+                os.path.join(DIRECTORIO_CACHE, 'respuestas'),
+                max_bytes=CACHE_RESPUESTAS_MAX_MB * 1024 * 1024,
+                ttl=CACHE_RESPUESTAS_TTL_HORAS * 3600
             )
         
-        genai.configure(api_key=api_key)
+        self.limitador = limitador or LimitadorTasa(GEMINI_RPM, GEMINI_TPM)
+        self.presupuesto_errores = PresupuestoErrores(
+            GEMINI_PRESUPUESTO_ERRORES if presupuesto_errores is None else presupuesto_errores
+        )
+        self.reintentos = 0
+        self._lock_contadores = threading.Lock()
+        
+        # Índice de documentos de la empresa (ver usar_documentos)
+        self.indice_documentos = None
+    
+    def _contar_reintento(self, intento, error, espera):
+        with self._lock_contadores:
+            self.reintentos += 1
+        print(f"      🔁 Reintento {intento} en {espera:.1f}s: {str(error)[:80]}")
+    
+    def _llamar_modelo(self, prompt, contexto_sistema, tokens_estimados, evento=None, al_fragmento=None):
+        """
+        Llama al backend respetando el limitador y reintentando errores transitorios.
+        Si se pasa `evento` (diccionario de traza), anota reintentos y espera del limitador.
+        Con `al_fragmento` la respuesta se pide en streaming (ver generar_texto).
+        """
+        if evento is None:
+            evento = {}
+        evento['reintentos'] = 0
+        evento['espera_limitador_s'] = 0.0
+        
+        def _intento():
+            evento['espera_limitador_s'] += self.limitador.adquirir(tokens_estimados)
+            if al_fragmento is None:
+                return self.backend.generar(prompt, contexto_sistema)
+            
+            # Cada intento empieza de cero: el callback recibe siempre el texto acumulado
+            inicio = time.perf_counter()
+            texto = ""
+            for fragmento in self.backend.generar_stream(prompt, contexto_sistema):
+                if not texto:
+                    evento['primer_fragmento_s'] = round(time.perf_counter() - inicio, 4)
+                texto += fragmento
+                al_fragmento(texto)
+            return texto
+        
+        def _al_reintentar(intento, error, espera):
+            evento['reintentos'] = intento
+            self._contar_reintento(intento, error, espera)
+        
+        return ejecutar_con_reintentos(
+            _intento,
+            max_reintentos=GEMINI_MAX_REINTENTOS,
+            al_reintentar=_al_reintentar
+        )
+    
+    @property
+    def modo_contexto(self):
+        return self.backend.modo_contexto
+    
+    def preparar_contexto(self, contexto_sistema):
+        """
+        Sube el contexto del sistema una sola vez para reutilizarlo en todas
+        las llamadas de la ejecución (ver BackendGemini.preparar_contexto).
+        
+        Las llamadas a generar_texto con exactamente este contexto_sistema usan
+        el contexto preparado; cualquier otro contexto se envía en línea.
+        
+        Returns:
+            Modo utilizado ('cache', 'system_instruction' o 'inline')
+        """
+        return self.backend.preparar_contexto(contexto_sistema)
+    
+    def liberar_contexto(self):
+        """Libera el contexto preparado y vuelve al modo en línea."""
+        self.backend.liberar_contexto()
+    
+    def usar_documentos(self, indice_documentos):
+        """
+        Activa la recuperación de información de la empresa para la ejecución:
+        cada prompt recibe sus fragmentos más relevantes (None la desactiva).
         
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        Args:
+            indice_documentos: IndiceBM25 de recuperacion.construir_indice_documentos
+        """
+        self.indice_documentos = indice_documentos
     
-    def generar_texto(self, prompt: str, contexto: dict = None, contexto_sistema: str = None) -> str:
+    def contar_tokens(self, texto):
+        """Cuenta los tokens de un texto según el backend."""
+        return self.backend.contar_tokens(texto)
+    
+    def estadisticas_cache(self):
+        """
+        Devuelve los contadores de la caché de respuestas.
+        
+        Returns:
+            Diccionario {'aciertos': int, 'fallos': int, 'activa': bool}
+        """
+        if self.cache is None:
+            return {'aciertos': 0, 'fallos': 0, 'activa': False}
+        return {'aciertos': self.cache.aciertos, 'fallos': self.cache.fallos, 'activa': True}
+    
+    def generar_texto(self, prompt: str, contexto: dict = None, contexto_sistema: str = None,
+                      al_fragmento=None, ignorar_cache: bool = None) -> str:
         """
         Genera texto usando Gemini API con contexto global de auditoría.
         
@@ -54,6 +191,12 @@ class GeminiClient:
                      Ejemplo: {'EMPRESA': 'Acme Corp', 'RUC': '12345'}
             contexto_sistema: Contexto base que se añade a TODOS los prompts
                             (instrucciones globales, normas, restricciones)
+            al_fragmento: Callback(texto_parcial) opcional: genera en streaming y
+                         recibe el texto acumulado con cada fragmento (con la
+                         respuesta completa si sale de la caché). Si lanza
+                         GeneracionCancelada, la llamada se interrumpe
+            ignorar_cache: Fuerza una respuesta nueva en esta llamada (sin leer
+                          la caché); por defecto, el valor del cliente
         
         Returns:
             Texto generado por la IA
@@ -66,43 +209,82 @@ class GeminiClient:
             >>> print(resultado)
             "Buenos días, Acme Corp..."
         """
+        with medir('generar_texto', modelo=self.nombre_modelo) as evento:
+            return self._generar_texto(prompt, contexto, contexto_sistema, evento, al_fragmento, ignorar_cache)
+    
+    def _generar_texto(self, prompt, contexto, contexto_sistema, evento, al_fragmento=None, ignorar_cache=None):
+        """Implementación de generar_texto; anota en `evento` los datos de la traza."""
         if contexto:
-            for key, value in contexto.items():
-                placeholder = f"{{{{{key}}}}}"
-                prompt = prompt.replace(placeholder, str(value))
+            prompt, _ = sustituir_estaticas(prompt, contexto)
+        
+        indice_documentos = self.indice_documentos
+        if indice_documentos is not None:
+            fragmentos = indice_documentos.seleccionar(prompt)
+            prompt = anexar_fragmentos(prompt, fragmentos)
+            evento['fragmentos'] = len(fragmentos)
+            evento['fragmentos_tokens'] = sum(f['tokens'] for f in fragmentos)
         
-        if contexto_sistema:
-            prompt_completo = f"{contexto_sistema}\n\n---\n\nTAREA ESPECÍFICA:\n{prompt}"
-        else:
-            prompt_completo = prompt
+        prompt_completo = componer_prompt(prompt, contexto_sistema)
+        evento['prompt_caracteres'] = len(prompt_completo)
+        evento['prompt_tokens'] = estimar_tokens(prompt_completo)
+        evento['modo_contexto'] = self.modo_contexto
+        evento['streaming'] = al_fragmento is not None
         
         # DEBUG: Guardar prompt completo para inspección
         try:
-            import os
             debug_dir = os.path.join(os.path.dirname(__file__), "3. Inyectado", "DEBUG_PROMPTS")
             os.makedirs(debug_dir, exist_ok=True)
             
-            # Contador para múltiples prompts
-            contador = len([f for f in os.listdir(debug_dir) if f.startswith("prompt_")]) + 1
-            
-            debug_file = os.path.join(debug_dir, f"prompt_{contador:03d}.txt")
-            with open(debug_file, 'w', encoding='utf-8') as f:
-                f.write("="*80 + "\n")
-                f.write(f"PROMPT COMPLETO #{contador}\n")
-                f.write("="*80 + "\n\n")
-                f.write(prompt_completo)
-                f.write("\n\n" + "="*80 + "\n")
-                f.write(f"Total caracteres: {len(prompt_completo)}\n")
-                f.write("="*80 + "\n")
+            # Contador para múltiples prompts (protegido: varias llamadas pueden ser concurrentes)
+            with self._lock_debug:
+                contador = len([f for f in os.listdir(debug_dir) if f.startswith("prompt_")]) + 1
+                
+                debug_file = os.path.join(debug_dir, f"prompt_{contador:03d}.txt")
+                with open(debug_file, 'w', encoding='utf-8') as f:
+                    f.write("="*80 + "\n")
+                    f.write(f"PROMPT COMPLETO #{contador}\n")
+                    f.write("="*80 + "\n\n")
+                    f.write(prompt_completo)
+                    f.write("\n\n" + "="*80 + "\n")
+                    f.write(f"Total caracteres: {len(prompt_completo)}\n")
+                    f.write("="*80 + "\n")
         except:
             pass  # No fallar si hay error guardando debug
         
+        clave_cache = None
+        evento['cache'] = 'desactivada'
+        if self.cache is not None:
+            clave_cache = hash_bytes(self.nombre_modelo, prompt, contexto_sistema or "")
+            evento['cache'] = 'ignorada'
+            if not (self.ignorar_cache if ignorar_cache is None else ignorar_cache):
+                respuesta_cache = self.cache.obtener(clave_cache)
+                if respuesta_cache is not None:
+                    evento['cache'] = 'acierto'
+                    evento['respuesta_tokens'] = estimar_tokens(respuesta_cache)
+                    if al_fragmento is not None:
+                        al_fragmento(respuesta_cache)
+                    return respuesta_cache
+                evento['cache'] = 'fallo'
+        
         try:
-            response = self.model.generate_content(prompt_completo)
-            return response.text
+            texto = self._llamar_modelo(prompt, contexto_sistema, evento['prompt_tokens'], evento, al_fragmento)
+        
+        except GeneracionCancelada:
+            evento['cancelada'] = True
+            raise
         
         except Exception as e:
+            evento['error'] = str(e)[:200]
+            # Si se agota el presupuesto se lanza PresupuestoErroresAgotado
+            self.presupuesto_errores.registrar(e)
             return f"[ERROR IA: {str(e)}]"
+        
+        evento['respuesta_tokens'] = estimar_tokens(texto)
+        
+        if clave_cache is not None:
+            self.cache.guardar(clave_cache, texto)
+        
+        return texto
 
 if __name__ == "__main__":
     print("Probando GeminiClient...")
@@ -0,0 +1,211 @@
+"""
+Motor de generación concurrente de contenido IA.
+
+Trabaja en tres fases:
+1. Recolección: se buscan todas las etiquetas {{IA:NOMBRE}} de todas las
+   plantillas (párrafos, celdas de tablas y hojas Excel).
+2. Resolución: cada etiqueta distinta se genera una sola vez por ejecución
+   y su respuesta se reutiliza en todas sus apariciones (varias plantillas,
+   celdas combinadas). Las etiquetas de IA_REGENERAR_POR_APARICION se
+   generan una vez por aparición (las repetidas, sin leer la caché de
+   respuestas).
+3. Generación: las llamadas a Gemini se despachan en paralelo con un pool
+   de hilos acotado. Las respuestas quedan en una tabla que luego consumen
+   los procesadores de párrafos/celdas al escribir el documento. Con
+   al_parcial las respuestas se piden en streaming y se informa el texto
+   parcial de cada llamada; con cancelar (threading.Event) la ejecución
+   se puede interrumpir a mitad de la generación.
+
+Las respuestas pre-generadas son independientes entre sí: cada llamada
+recibe solo el contexto del sistema compartido, no las respuestas previas
+("RESPUESTAS GENERADAS PREVIAMENTE", últimas 15). Esa memoria solo se usa
+cuando una etiqueta se genera en línea al escribir el documento.
+"""
+
+import contextlib
+import contextvars
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from plantillas import etiquetas_ia_indice
+from limitador import GeneracionCancelada, PresupuestoErroresAgotado
+from trazas import medir
+
+# Número máximo de llamadas simultáneas a la IA (configurable por entorno)
+MAX_CONCURRENCIA_IA = int(os.getenv('IA_MAX_CONCURRENCIA', '4'))
+
+# Etiquetas IA que se generan en cada aparición (separadas por comas; '*' = todas)
+IA_REGENERAR_POR_APARICION = frozenset(
+    nombre.strip() for nombre in os.getenv('IA_REGENERAR_POR_APARICION', '').split(',') if nombre.strip()
+)
+
+def recolectar_etiquetas_ia(indices, datos_ia):
+    """
+    Recolecta las etiquetas IA de los índices de plantillas compiladas.
+
+    Se devuelve una entrada por cada aparición (no por nombre único); ver
+    resolver_etiquetas_ia para obtener las llamadas a realizar.
+
+    Args:
+        indices: Iterable de índices (salida de compilar_word / compilar_excel)
+        datos_ia: Diccionario {nombre_prompt: prompt}
+
+    Returns:
+        Lista de nombres de prompt en orden de aparición
+    """
+    return [
+        nombre_prompt
+        for indice in indices
+        for nombre_prompt in etiquetas_ia_indice(indice)
+        if nombre_prompt in datos_ia
+    ]
+
+def regenerar_por_aparicion(nombre_prompt, regenerar=None):
+    """Indica si la etiqueta se genera en cada aparición en lugar de una vez por ejecución."""
+    regenerar = IA_REGENERAR_POR_APARICION if regenerar is None else regenerar
+    return '*' in regenerar or nombre_prompt in regenerar
+
+def resolver_etiquetas_ia(apariciones, regenerar=None):
+    """
+    Tabla de resolución de la ejecución: una llamada por etiqueta distinta
+    (su respuesta se reutiliza en todas sus apariciones), salvo las etiquetas
+    marcadas para regenerarse, que conservan una llamada por aparición.
+
+    Args:
+        apariciones: Salida de recolectar_etiquetas_ia
+        regenerar: Nombres a regenerar en cada aparición (por defecto IA_REGENERAR_POR_APARICION)
+
+    Returns:
+        Lista de nombres de prompt a generar, en orden de primera aparición
+    """
+    with medir('resolver_etiquetas_ia', apariciones=len(apariciones)) as evento:
+        vistas = set()
+        pendientes = []
+        for nombre_prompt in apariciones:
+            if nombre_prompt in vistas and not regenerar_por_aparicion(nombre_prompt, regenerar):
+                continue
+            vistas.add(nombre_prompt)
+            pendientes.append(nombre_prompt)
+        evento['etiquetas'] = len(vistas)
+        evento['llamadas_ahorradas'] = len(apariciones) - len(pendientes)
+    return pendientes
+
+def _comprobar_cancelacion(cancelar):
+    if cancelar is not None and cancelar.is_set():
+        raise GeneracionCancelada("Generación IA cancelada")
+
+def _generar_con_cupo(semaforo, cliente_gemini, prompt, datos_estaticos, contexto_sistema,
+                      al_fragmento=None, cancelar=None, ignorar_cache=False):
+    """
+    Llama a generar_texto ocupando un cupo del semáforo compartido (si lo hay).
+    Si la ejecución ya se canceló al obtener el cupo, no se hace la llamada.
+    Con ignorar_cache la respuesta es nueva aunque el mismo prompt ya esté en
+    la caché (apariciones repetidas de una etiqueta regenerada).
+    """
+    opciones = {}
+    if al_fragmento is not None:
+        opciones['al_fragmento'] = al_fragmento
+    if ignorar_cache:
+        opciones['ignorar_cache'] = True
+    with semaforo if semaforo is not None else contextlib.nullcontext():
+        _comprobar_cancelacion(cancelar)
+        return cliente_gemini.generar_texto(prompt, datos_estaticos, contexto_sistema, **opciones)
+
+def generar_respuestas_ia(cliente_gemini, pendientes, datos_ia, datos_estaticos, contexto_sistema,
+                          max_concurrencia=None, progress_callback=None, semaforo=None,
+                          al_parcial=None, cancelar=None):
+    """
+    Genera en paralelo las respuestas de todas las etiquetas recolectadas.
+
+    Args:
+        cliente_gemini: Cliente con método generar_texto(prompt, contexto, contexto_sistema)
+        pendientes: Lista de nombres de prompt (salida de recolectar_etiquetas_ia)
+        datos_ia: Diccionario {nombre_prompt: prompt}
+        datos_estaticos: Diccionario con variables para el prompt
+        contexto_sistema: Contexto base compartido por todas las llamadas
+        max_concurrencia: Límite de llamadas simultáneas (por defecto MAX_CONCURRENCIA_IA)
+        progress_callback: Función callback(completadas, total) opcional
+        semaforo: Semáforo compartido con otras ejecuciones simultáneas (p. ej.
+                  los trabajos de Streamlit): limita las llamadas en curso entre todas
+        al_parcial: Callback(i, texto, terminada) opcional, con i la posición en
+                    pendientes: activa el streaming y recibe el texto acumulado de
+                    cada llamada y, al final, su respuesta. Se llama desde varios hilos
+        cancelar: threading.Event opcional; al activarse no se hacen más llamadas
+                  y las respuestas en streaming se interrumpen
+
+    Returns:
+        Diccionario {nombre_prompt: deque de respuestas} en orden de aparición
+        (ver tomar_respuesta)
+
+    Raises:
+        PresupuestoErroresAgotado: si el cliente supera su presupuesto de errores
+        GeneracionCancelada: si se activó `cancelar`
+    """
+    total = len(pendientes)
+    resultados = [None] * total
+    max_concurrencia = max(1, max_concurrencia or MAX_CONCURRENCIA_IA)
+
+    def _al_fragmento(i):
+        if al_parcial is None:
+            return None
+        def al_fragmento(texto):
+            _comprobar_cancelacion(cancelar)
+            al_parcial(i, texto, False)
+        return al_fragmento
+
+    # Apariciones repetidas (etiquetas regeneradas): misma clave de caché que la
+    # primera, así que se piden sin leer la caché para obtener respuestas distintas
+    vistas = set()
+    repetidas = []
+    for nombre in pendientes:
+        repetidas.append(nombre in vistas)
+        vistas.add(nombre)
+
+    if total:
+        with medir('generacion_ia', llamadas=total, concurrencia=min(max_concurrencia, total)), \
+                ThreadPoolExecutor(max_workers=min(max_concurrencia, total)) as pool:
+            # Cada tarea se ejecuta con una copia del contexto (traza activa)
+            futuros = {
+                pool.submit(contextvars.copy_context().run, _generar_con_cupo,
+                            semaforo, cliente_gemini, datos_ia[nombre], datos_estaticos, contexto_sistema,
+                            _al_fragmento(i), cancelar, repetidas[i]): i
+                for i, nombre in enumerate(pendientes)
+            }
+            for completadas, futuro in enumerate(as_completed(futuros), 1):
+                i = futuros[futuro]
+                try:
+                    resultados[i] = futuro.result()
+                except (PresupuestoErroresAgotado, GeneracionCancelada):
+                    # Abortar: no tiene sentido seguir gastando llamadas
+                    for pendiente in futuros:
+                        pendiente.cancel()
+                    raise
+                except Exception as e:
+                    resultados[i] = f"[ERROR IA: {str(e)}]"
+                if al_parcial:
+                    al_parcial(i, resultados[i], True)
+                if progress_callback:
+                    progress_callback(completadas, total)
+
+    respuestas_ia = {}
+    for nombre, respuesta in zip(pendientes, resultados):
+        respuestas_ia.setdefault(nombre, deque()).append(respuesta)
+    return respuestas_ia
+
+def tomar_respuesta(respuestas_ia, nombre_prompt):
+    """
+    Consume la siguiente respuesta pre-generada para una etiqueta. La última
+    respuesta de cada etiqueta no se consume: se reutiliza en las apariciones
+    siguientes (etiquetas resueltas una sola vez por ejecución).
+
+    Returns:
+        Texto de la respuesta, o None si no hay respuestas pendientes
+        (en ese caso el llamador debe generar en línea).
+    """
+    if not respuestas_ia:
+        return None
+    cola = respuestas_ia.get(nombre_prompt)
+    if not cola:
+        return None
+    return cola.popleft() if len(cola) > 1 else cola[0]
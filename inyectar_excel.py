@@ -6,77 +6,25 @@ y guarda resultados en '3. Inyectado/'.
 
 import os
 import glob
-import openpyxl
 import re
 from datetime import datetime
 from gemini_client import GeminiClient
 from config_auditoria import generar_contexto_base
-from lector_informacion import leer_informacion_empresa
+from datos_auditoria import cargar_datos_auditoria, leer_datos_auditoria
+from lector_informacion import leer_documentos_empresa
+from recuperacion import preparar_informacion_empresa
+from plantillas import cargar_plantilla_compilada, celdas_indexadas, estadisticas_cache_plantillas, sustituir_estaticas
+from generacion_ia import recolectar_etiquetas_ia, resolver_etiquetas_ia, generar_respuestas_ia, tomar_respuesta
+from limitador import PresupuestoErroresAgotado
+from trazas import medir, ejecucion_trazada
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, '1. Data')
 PLANTILLA_DIR = os.path.join(BASE_DIR, '2. Plantilla')
 INYECTADO_DIR = os.path.join(BASE_DIR, '3. Inyectado')
+CARPETA_EMPRESA = "4. INFORMACION EMPRESA"
 
-def leer_datos_excel():
-    """
-    Busca el primer archivo Excel en '1. Data/' y lee las configuraciones.
-    
-    Estructura (3 columnas):
-    - Columna A: Campo (nombre de la variable)
-    - Columna B: Valor (dato estático O prompt si es IA)
-    - Columna C: Campo Generado (etiqueta)
-    
-    Detección automática:
-    - Si Campo Generado empieza con {{IA: → Valor contiene el prompt
-    - Si no → Valor contiene el dato estático
-    
-    Retorna dos diccionarios: datos_estaticos y datos_ia
-    """
-    archivos_excel = glob.glob(os.path.join(DATA_DIR, '*.xlsx'))
-    
-    if not archivos_excel:
-        print(f"❌ No se encontró ningún archivo Excel en la carpeta '{DATA_DIR}'")
-        return None, None, None
-    
-    archivo_excel = archivos_excel[0]
-    print(f"📄 Leyendo datos desde: {os.path.basename(archivo_excel)}")
-    
-    wb = openpyxl.load_workbook(archivo_excel, data_only=True)
-    ws = wb.active
-    
-    datos_estaticos = {}
-    datos_ia = {}
-    
-    print("   Leyendo filas...")
-    for i, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-        if not row[0]: continue
-        
-        campo = str(row[0]).strip()
-        valor = row[1] if row[1] is not None else ""
-        campo_generado = str(row[2]).strip() if len(row) > 2 and row[2] else ""
-        
-        if campo_generado.startswith("{{IA:"):
-            datos_ia[campo] = valor
-            print(f"   - Fila {i}: {campo} [IA] → Prompt configurado")
-        else:
-            datos_estaticos[campo] = valor
-            print(f"   - Fila {i}: {campo} [STATIC] → {str(valor)[:50]}...")
-    
-    normas = []
-    for campo, valor in datos_estaticos.items():
-        if 'NORMA' in campo.upper() and valor and not campo.endswith('_RESUMEN'):
-            normas.append(str(valor))
-    
-    wb.close()
-    
-    print(f"\n✅ Datos cargados: {len(datos_estaticos)} estáticos, {len(datos_ia)} IA")
-    if normas:
-        print(f"📋 Normas detectadas: {', '.join(normas)}")
-    
-    return datos_estaticos, datos_ia, normas
-
-def procesar_celda(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas):
+def procesar_celda(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas, respuestas_ia=None):
     """
     Procesa una celda individual de Excel, reemplazando etiquetas.
     
@@ -87,28 +35,25 @@ def procesar_celda(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_si
         cliente_gemini: Cliente de Gemini API
         contexto_sistema: Contexto base del sistema
         memoria_respuestas: Lista con respuestas previas de IA
+        respuestas_ia: Respuestas pre-generadas en paralelo (opcional)
     """
     if celda.value is None or not isinstance(celda.value, str):
         return
     
     texto = str(celda.value)
-    cambios = False
-    
-    for campo, valor in datos_estaticos.items():
-        etiqueta = f"{{{{{campo}}}}}"
-        if etiqueta in texto:
-            texto = texto.replace(etiqueta, str(valor))
-            cambios = True
+    texto, cambios = sustituir_estaticas(texto, datos_estaticos)
     
     etiquetas_ia = re.findall(r'\{\{IA:([^}]+)\}\}', texto)
     
     for nombre_prompt in etiquetas_ia:
         if nombre_prompt in datos_ia:
-            prompt = datos_ia[nombre_prompt]
-            
-            print(f"   🤖 Generando contenido IA para: {nombre_prompt}")
-            
-            respuesta = cliente_gemini.generar_texto(prompt, datos_estaticos, contexto_sistema)
+            respuesta = tomar_respuesta(respuestas_ia, nombre_prompt)
+            if respuesta is None:
+                prompt = datos_ia[nombre_prompt]
+                
+                print(f"   🤖 Generando contenido IA para: {nombre_prompt}")
+                
+                respuesta = cliente_gemini.generar_texto(prompt, datos_estaticos, contexto_sistema)
             
             memoria_respuestas.append(f"[{nombre_prompt}]\n{respuesta}")
             
@@ -125,27 +70,106 @@ def procesar_celda(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_si
         
         celda.value = texto.strip()
 
-def procesar_excel():
+def cargar_plantillas_excel(plantillas):
+    """
+    Fase 1: abre y compila las plantillas Excel (índice de etiquetas, con caché en disco).
+    
+    Args:
+        plantillas: Rutas de las plantillas .xlsx
+    
+    Returns:
+        Lista de tuplas (nombre_plantilla, wb, indice) de las plantillas que se pudieron abrir
+    """
+    libros = []
+    for plantilla_path in plantillas:
+        nombre_plantilla = os.path.basename(plantilla_path)
+        try:
+            with open(plantilla_path, 'rb') as f, medir('cargar_plantilla', plantilla=nombre_plantilla):
+                wb, indice = cargar_plantilla_compilada(f.read(), nombre_plantilla)
+            print(f"   🔎 {nombre_plantilla}: {len(indice['ubicaciones'])} celdas con etiquetas")
+            libros.append((nombre_plantilla, wb, indice))
+        except Exception as e:
+            print(f"   ❌ Error abriendo {nombre_plantilla}: {e}")
+    return libros
+
+def guardar_plantillas_excel(libros, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, respuestas_ia, directorio_salida):
+    """
+    Fase 3: escribe los datos y las respuestas IA en cada libro y lo guarda
+    en directorio_salida (con su MEMORIA_*.txt).
+    
+    Returns:
+        Número de libros guardados
+    """
+    guardados = 0
+    for idx, (nombre_plantilla, wb, indice) in enumerate(libros, 1):
+        print(f"\n[{idx}/{len(libros)}] Procesando: {nombre_plantilla}")
+        print("-" * 60)
+        
+        try:
+            memoria_respuestas = []
+            
+            with medir('render_plantilla', plantilla=nombre_plantilla, ubicaciones=len(indice['ubicaciones'])):
+                for celda in celdas_indexadas(wb, indice):
+                    procesar_celda(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas, respuestas_ia)
+            
+            nombre_salida = nombre_plantilla.lstrip('_')
+            ruta_salida = os.path.join(directorio_salida, nombre_salida)
+            
+            with medir('guardar', plantilla=nombre_salida):
+                wb.save(ruta_salida)
+            guardados += 1
+            print(f"\n   ✅ Guardado: {nombre_salida}")
+            
+            if memoria_respuestas:
+                nombre_memoria = f"MEMORIA_{nombre_salida.replace('.xlsx', '.txt')}"
+                ruta_memoria = os.path.join(directorio_salida, nombre_memoria)
+                with open(ruta_memoria, 'w', encoding='utf-8') as f:
+                    f.write("="*80 + "\n")
+                    f.write(f"MEMORIA DE RESPUESTAS IA - {nombre_plantilla}\n")
+                    f.write(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
+                    f.write("="*80 + "\n\n")
+                    f.write("\n\n".join(memoria_respuestas))
+                print(f"   💾 Memoria guardada: {nombre_memoria}")
+            
+        except Exception as e:
+            print(f"   ❌ Error procesando {nombre_plantilla}: {e}")
+            continue
+    
+    return guardados
+
+def procesar_excel(ruta_data=None, directorio_salida=INYECTADO_DIR, carpeta_empresa=CARPETA_EMPRESA, limitador=None):
     """
     Función principal que procesa todas las plantillas Excel.
+    
+    Args:
+        ruta_data: DATA.xlsx de la auditoría (None = el primero de '1. Data/')
+        directorio_salida: Carpeta de los documentos generados
+        carpeta_empresa: Carpeta con los documentos de la empresa (None = sin documentos)
+        limitador: LimitadorTasa compartido (por defecto, uno propio del cliente)
+    
+    Returns:
+        Diccionario {'documentos': guardados, 'prompts': llamadas IA, 'ahorradas': llamadas evitadas},
+        o None si se abortó
     """
     print("\n" + "="*80)
     print("🚀 INICIANDO PROCESAMIENTO DE PLANTILLAS EXCEL")
     print("="*80 + "\n")
     
-    os.makedirs(INYECTADO_DIR, exist_ok=True)
+    os.makedirs(directorio_salida, exist_ok=True)
     
-    datos_estaticos, datos_ia, normas = leer_datos_excel()
+    datos = cargar_datos_auditoria(ruta_data) if ruta_data else leer_datos_auditoria(DATA_DIR)
     
-    if datos_estaticos is None:
+    if datos is None:
         print("❌ No se pudieron cargar datos. Verifica la carpeta '1. Data'")
         return
+    datos_estaticos, datos_ia, normas = datos.estaticos, datos.prompts_ia, datos.normas
     
-    contexto_empresa = leer_informacion_empresa()
+    documentos_empresa = leer_documentos_empresa(carpeta_empresa) if carpeta_empresa else []
+    contexto_empresa, indice_documentos = preparar_informacion_empresa(documentos_empresa)
     
     contexto_sistema = generar_contexto_base(normas, datos_estaticos, None, contexto_empresa)
     
-    ruta_contexto = os.path.join(INYECTADO_DIR, 'CONTEXTO_IA_EXCEL.txt')
+    ruta_contexto = os.path.join(directorio_salida, 'CONTEXTO_IA_EXCEL.txt')
     try:
         with open(ruta_contexto, 'w', encoding='utf-8') as f:
             f.write("="*80 + "\n")
@@ -169,7 +193,7 @@ def procesar_excel():
     
     if not plantillas:
         print(f"❌ No se encontraron plantillas .xlsx en '{PLANTILLA_DIR}'")
-        return
+        return {'documentos': 0, 'prompts': 0, 'ahorradas': 0}
     
     print(f"\n📁 Plantillas encontradas: {len(plantillas)}")
     for p in plantillas:
@@ -177,7 +201,8 @@ def procesar_excel():
     
     print("\n🤖 Inicializando cliente Gemini...")
     try:
-        cliente_gemini = GeminiClient()
+        cliente_gemini = GeminiClient(limitador=limitador)
+        cliente_gemini.usar_documentos(indice_documentos)
         print("   ✅ Cliente Gemini listo")
     except Exception as e:
         print(f"   ❌ Error al inicializar Gemini: {e}")
@@ -187,49 +212,49 @@ def procesar_excel():
     print("📝 PROCESANDO PLANTILLAS")
     print("="*80 + "\n")
     
-    for idx, plantilla_path in enumerate(plantillas, 1):
-        nombre_plantilla = os.path.basename(plantilla_path)
-        print(f"\n[{idx}/{len(plantillas)}] Procesando: {nombre_plantilla}")
-        print("-" * 60)
-        
+    # Fase 1: abrir y compilar todas las plantillas (índice de etiquetas, con caché en disco)
+    libros = cargar_plantillas_excel(plantillas)
+    
+    aciertos, fallos = estadisticas_cache_plantillas()
+    print(f"   💾 Caché de plantillas: {aciertos} aciertos, {fallos} compiladas")
+    
+    apariciones = recolectar_etiquetas_ia((indice for _, _, indice in libros), datos_ia)
+    pendientes = resolver_etiquetas_ia(apariciones)
+    if len(apariciones) > len(pendientes):
+        print(f"   ♻️  {len(apariciones)} etiquetas IA → {len(pendientes)} llamadas ({len(apariciones) - len(pendientes)} ahorradas: etiquetas repetidas)")
+    
+    # Fase 2: generar todas las respuestas IA en paralelo
+    respuestas_ia = None
+    if pendientes:
+        print(f"🤖 Generando {len(pendientes)} respuestas IA en paralelo...")
+        modo_contexto = cliente_gemini.preparar_contexto(contexto_sistema)
+        print(f"   📎 Contexto del sistema enviado en modo: {modo_contexto}")
         try:
-            wb = openpyxl.load_workbook(plantilla_path)
-            
-            memoria_respuestas = []
-            
-            for sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-                print(f"\n   📄 Hoja: {sheet_name}")
-                
-                for row in ws.iter_rows():
-                    for celda in row:
-                        procesar_celda(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas)
-            
-            nombre_salida = nombre_plantilla.lstrip('_')
-            ruta_salida = os.path.join(INYECTADO_DIR, nombre_salida)
-            
-            wb.save(ruta_salida)
-            print(f"\n   ✅ Guardado: {nombre_salida}")
-            
-            if memoria_respuestas:
-                nombre_memoria = f"MEMORIA_{nombre_salida.replace('.xlsx', '.txt')}"
-                ruta_memoria = os.path.join(INYECTADO_DIR, nombre_memoria)
-                with open(ruta_memoria, 'w', encoding='utf-8') as f:
-                    f.write("="*80 + "\n")
-                    f.write(f"MEMORIA DE RESPUESTAS IA - {nombre_plantilla}\n")
-                    f.write(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
-                    f.write("="*80 + "\n\n")
-                    f.write("\n\n".join(memoria_respuestas))
-                print(f"   💾 Memoria guardada: {nombre_memoria}")
-            
-        except Exception as e:
-            print(f"   ❌ Error procesando {nombre_plantilla}: {e}")
-            continue
+            respuestas_ia = generar_respuestas_ia(
+                cliente_gemini, pendientes, datos_ia, datos_estaticos, contexto_sistema,
+                progress_callback=lambda hechas, total: print(f"   ✅ {hechas}/{total} respuestas IA")
+            )
+        except PresupuestoErroresAgotado as e:
+            print(f"❌ {e}")
+            print("   No se guardan documentos incompletos. Revisa la cuota de la API y vuelve a ejecutar.")
+            return
+        finally:
+            cliente_gemini.liberar_contexto()
+    
+    # Fase 3: escribir resultados en cada plantilla
+    guardados = guardar_plantillas_excel(libros, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, respuestas_ia, directorio_salida)
     
     print("\n" + "="*80)
     print("✅ PROCESAMIENTO COMPLETADO")
     print("="*80)
-    print(f"\n📂 Documentos generados en: {INYECTADO_DIR}")
+    print(f"\n📂 Documentos generados en: {directorio_salida}")
+    
+    cache = cliente_gemini.estadisticas_cache()
+    if cache['activa']:
+        print(f"💾 Caché de respuestas IA: {cache['aciertos']} aciertos, {cache['fallos']} fallos")
+    
+    return {'documentos': guardados, 'prompts': len(pendientes), 'ahorradas': len(apariciones) - len(pendientes)}
 
 if __name__ == "__main__":
-    procesar_excel()
+    with ejecucion_trazada('excel', INYECTADO_DIR):
+        procesar_excel()
@@ -0,0 +1,243 @@
+"""
+Script para generar el paquete completo de una auditoría (plantillas Word y Excel) en una sola pasada.
+
+inyectar_word.py e inyectar_excel.py preparan cada uno sus entradas. Aquí
+DATA.xlsx, los documentos de la empresa, el contexto del sistema, el
+cliente Gemini y CONTEXTO_IA.txt se preparan una sola vez para ambos
+tipos de plantilla. Las etiquetas IA de todas las plantillas se generan en
+una única fase (un solo contexto subido a Gemini; cada etiqueta repetida
+en varias plantillas se genera una vez) y luego las plantillas
+Word y Excel se escriben y guardan en paralelo, en dos hilos. La salida de
+consola de cada hilo se acumula y se imprime entera al terminar su tipo,
+para que las líneas de Word y Excel no se mezclen (ni en el LOG.txt de los lotes).
+
+Uso:
+    python inyectar_todo.py
+"""
+
+import contextvars
+import glob
+import io
+import os
+import sys
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from config_auditoria import generar_contexto_base
+from datos_auditoria import cargar_datos_auditoria, leer_datos_auditoria
+from gemini_client import GeminiClient
+from generacion_ia import (generar_respuestas_ia, recolectar_etiquetas_ia, regenerar_por_aparicion,
+                           resolver_etiquetas_ia)
+from inyectar_excel import cargar_plantillas_excel, guardar_plantillas_excel
+from inyectar_word import cargar_plantillas_word, guardar_plantillas_word
+from lector_informacion import leer_documentos_empresa
+from limitador import PresupuestoErroresAgotado
+from plantillas import estadisticas_cache_plantillas
+from recuperacion import preparar_informacion_empresa
+from trazas import ejecucion_trazada
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, '1. Data')
+PLANTILLA_DIR = os.path.join(BASE_DIR, '2. Plantilla')
+INYECTADO_DIR = os.path.join(BASE_DIR, '3. Inyectado')
+CARPETA_EMPRESA = "4. INFORMACION EMPRESA"
+
+# Tipo de plantilla: (extensión, fase 1, fase 3)
+TIPOS_PLANTILLA = {
+    'word': ('.docx', cargar_plantillas_word, guardar_plantillas_word),
+    'excel': ('.xlsx', cargar_plantillas_excel, guardar_plantillas_excel),
+}
+
+# Búfer de consola del tipo de plantilla que se escribe en el hilo actual (fase 3)
+_bufer_consola = contextvars.ContextVar('bufer_consola', default=None)
+
+class ConsolaPorTipo:
+    """
+    Sustituye a sys.stdout durante la fase 3: lo que imprime el hilo de un
+    tipo de plantilla va a su búfer; el resto, a la salida original.
+    """
+
+    def __init__(self, original):
+        self.original = original
+
+    def write(self, texto):
+        return (_bufer_consola.get() or self.original).write(texto)
+
+    def flush(self):
+        self.original.flush()
+
+    def __getattr__(self, nombre):
+        return getattr(self.original, nombre)
+
+def guardar_tipo(tipo, bufer, *args):
+    """Fase 3 de un tipo de plantilla, con su salida de consola en `bufer`."""
+    _bufer_consola.set(bufer)
+    return TIPOS_PLANTILLA[tipo][2](*args)
+
+def buscar_plantillas(extension):
+    """Plantillas de '2. Plantilla/' con la extensión dada (sin archivos temporales ~$)."""
+    return sorted(
+        p for p in glob.glob(os.path.join(PLANTILLA_DIR, f'*{extension}'))
+        if not os.path.basename(p).startswith('~$')
+    )
+
+def repartir_respuestas(respuestas_ia, apariciones_por_tipo):
+    """
+    Reparte las respuestas generadas en una sola fase entre los tipos de
+    plantilla. Las etiquetas resueltas una vez comparten su respuesta; las
+    que se regeneran por aparición se reparten en el orden de la recolección,
+    para que cada tipo consuma siempre las mismas aunque se escriban en paralelo.
+
+    Args:
+        respuestas_ia: Salida de generar_respuestas_ia sobre todos los pendientes
+        apariciones_por_tipo: {tipo: apariciones}, en el orden de la recolección
+
+    Returns:
+        Diccionario {tipo: {nombre_prompt: deque de respuestas}}
+    """
+    repartidas = {}
+    for tipo, apariciones in apariciones_por_tipo.items():
+        propias = {}
+        for nombre, cantidad in Counter(apariciones).items():
+            cola = respuestas_ia[nombre]
+            if regenerar_por_aparicion(nombre):
+                propias[nombre] = deque(cola.popleft() for _ in range(cantidad))
+            else:
+                propias[nombre] = cola
+        repartidas[tipo] = propias
+    return repartidas
+
+def procesar_todo(ruta_data=None, directorio_salida=INYECTADO_DIR, carpeta_empresa=CARPETA_EMPRESA,
+                  limitador=None, tipos=tuple(TIPOS_PLANTILLA)):
+    """
+    Procesa las plantillas Word y Excel de una auditoría compartiendo la preparación.
+
+    Args:
+        ruta_data: DATA.xlsx de la auditoría (None = el primero de '1. Data/')
+        directorio_salida: Carpeta de los documentos generados
+        carpeta_empresa: Carpeta con los documentos de la empresa (None = sin documentos)
+        limitador: LimitadorTasa compartido (por defecto, uno propio del cliente)
+        tipos: Tipos de plantilla a generar ('word', 'excel')
+
+    Returns:
+        Diccionario {'documentos': guardados, 'prompts': llamadas IA, 'ahorradas': llamadas evitadas},
+        o None si se abortó
+    """
+    print("="*80)
+    print(f"🚀 PAQUETE DE AUDITORÍA: plantillas {', '.join(tipos)}")
+    print("="*80)
+
+    try:
+        cliente_gemini = GeminiClient(limitador=limitador)
+        print("✅ Cliente Gemini listo")
+    except Exception as e:
+        print(f"❌ Error al iniciar Gemini: {e}")
+        return
+
+    datos = cargar_datos_auditoria(ruta_data) if ruta_data else leer_datos_auditoria(DATA_DIR)
+    if datos is None or not datos.estaticos:
+        print("❌ No se pudieron cargar datos. Verifica la carpeta '1. Data'")
+        return
+    datos_estaticos, datos_ia, normas = datos.estaticos, datos.prompts_ia, datos.normas
+
+    documentos_empresa = leer_documentos_empresa(carpeta_empresa) if carpeta_empresa else []
+    contexto_empresa, indice_documentos = preparar_informacion_empresa(documentos_empresa)
+    cliente_gemini.usar_documentos(indice_documentos)
+
+    contexto_sistema = generar_contexto_base(normas, datos_estaticos, None, contexto_empresa)
+
+    os.makedirs(directorio_salida, exist_ok=True)
+    ruta_contexto = os.path.join(directorio_salida, 'CONTEXTO_IA.txt')
+    try:
+        with open(ruta_contexto, 'w', encoding='utf-8') as f:
+            f.write("="*80 + "\n")
+            f.write("CONTEXTO COMPLETO ENVIADO A LA IA\n")
+            f.write(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
+            f.write("="*80 + "\n\n")
+            f.write(contexto_sistema)
+        print(f"💾 Contexto guardado en: {os.path.basename(ruta_contexto)}")
+    except Exception as e:
+        print(f"⚠️  No se pudo guardar contexto: {e}")
+
+    if normas:
+        print(f"📋 Normas detectadas para auditoría: {', '.join(normas)}")
+    else:
+        print("⚠️  No se detectaron normas en el Excel (campos NORMA1, NORMA2, etc.)")
+    print(f"📊 Datos cargados: {len(datos_estaticos)} variables estáticas, {len(datos_ia)} prompts de IA")
+
+    # Fase 1: abrir y compilar las plantillas de todos los tipos
+    cargadas = {}
+    for tipo in tipos:
+        extension, cargar, _ = TIPOS_PLANTILLA[tipo]
+        plantillas = buscar_plantillas(extension)
+        print(f"\n📁 Plantillas {tipo} ({extension}): {len(plantillas)}")
+        cargadas[tipo] = cargar(plantillas)
+
+    aciertos, fallos = estadisticas_cache_plantillas()
+    print(f"   💾 Caché de plantillas: {aciertos} aciertos, {fallos} compiladas")
+
+    apariciones_por_tipo = {
+        tipo: recolectar_etiquetas_ia((indice for _, _, indice in plantillas), datos_ia)
+        for tipo, plantillas in cargadas.items()
+    }
+    apariciones = [nombre for lista in apariciones_por_tipo.values() for nombre in lista]
+    pendientes = resolver_etiquetas_ia(apariciones)
+    if len(apariciones) > len(pendientes):
+        print(f"   ♻️  {len(apariciones)} etiquetas IA → {len(pendientes)} llamadas ({len(apariciones) - len(pendientes)} ahorradas: etiquetas repetidas)")
+
+    # Fase 2: generar las respuestas IA de todas las plantillas con un solo contexto
+    respuestas_por_tipo = {tipo: None for tipo in cargadas}
+    if pendientes:
+        print(f"\n🤖 Generando {len(pendientes)} respuestas IA en paralelo...")
+        modo_contexto = cliente_gemini.preparar_contexto(contexto_sistema)
+        print(f"   📎 Contexto del sistema enviado en modo: {modo_contexto}")
+        try:
+            respuestas_ia = generar_respuestas_ia(
+                cliente_gemini, pendientes, datos_ia, datos_estaticos, contexto_sistema,
+                progress_callback=lambda hechas, total: print(f"   ✅ {hechas}/{total} respuestas IA")
+            )
+        except PresupuestoErroresAgotado as e:
+            print(f"❌ {e}")
+            print("   No se guardan documentos incompletos. Revisa la cuota de la API y vuelve a ejecutar.")
+            return
+        finally:
+            cliente_gemini.liberar_contexto()
+        respuestas_por_tipo = repartir_respuestas(respuestas_ia, apariciones_por_tipo)
+
+    # Fase 3: escribir y guardar Word y Excel en paralelo (cada hilo con la traza activa).
+    # La consola de cada tipo se imprime entera cuando ese tipo termina
+    bufers = {tipo: io.StringIO() for tipo in cargadas}
+    consola = sys.stdout
+    sys.stdout = ConsolaPorTipo(consola)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(cargadas))) as pool:
+            futuros = {
+                pool.submit(contextvars.copy_context().run, guardar_tipo, tipo, bufers[tipo],
+                            plantillas, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema,
+                            respuestas_por_tipo[tipo], directorio_salida): tipo
+                for tipo, plantillas in cargadas.items()
+            }
+            for futuro in as_completed(futuros):
+                tipo = futuros[futuro]
+                print(f"\n📝 Plantillas {tipo}:", end="")
+                print(bufers[tipo].getvalue(), end="", flush=True)
+    finally:
+        sys.stdout = consola
+    guardados = {tipo: futuro.result() for futuro, tipo in futuros.items()}
+
+    print("\n" + "="*80)
+    print("✅ PAQUETE COMPLETADO: " + ", ".join(f"{n} {tipo}" for tipo, n in guardados.items()))
+    print("="*80)
+    print(f"📂 Documentos generados en: {directorio_salida}")
+
+    cache = cliente_gemini.estadisticas_cache()
+    if cache['activa']:
+        print(f"💾 Caché de respuestas IA: {cache['aciertos']} aciertos, {cache['fallos']} fallos")
+
+    return {'documentos': sum(guardados.values()), 'prompts': len(pendientes),
+            'ahorradas': len(apariciones) - len(pendientes)}
+
+if __name__ == "__main__":
+    with ejecucion_trazada('todo', INYECTADO_DIR):
+        procesar_todo()
@@ -6,78 +6,33 @@ y guarda resultados en '3. Inyectado/'.
 
 import os
 import glob
-from docx import Document
-import openpyxl
 import re
 from datetime import datetime
 from gemini_client import GeminiClient
 from config_auditoria import generar_contexto_base
-from lector_informacion import leer_informacion_empresa
+from datos_auditoria import cargar_datos_auditoria, leer_datos_auditoria
+from lector_informacion import leer_documentos_empresa
+from recuperacion import preparar_informacion_empresa
+from plantillas import cargar_plantilla_compilada, parrafos_indexados, estadisticas_cache_plantillas, sustituir_estaticas
+from generacion_ia import recolectar_etiquetas_ia, resolver_etiquetas_ia, generar_respuestas_ia, tomar_respuesta
+from limitador import PresupuestoErroresAgotado
+from trazas import medir, ejecucion_trazada
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, '1. Data')
 PLANTILLA_DIR = os.path.join(BASE_DIR, '2. Plantilla')
 INYECTADO_DIR = os.path.join(BASE_DIR, '3. Inyectado')
 IMAGENES_DIR = os.path.join(BASE_DIR, '5. IMAGENES')
+CARPETA_EMPRESA = "4. INFORMACION EMPRESA"
 
-def leer_datos_excel():
-    """
-    Busca el primer archivo Excel en '1. Data/' y lee las configuraciones.
-    
-    Nueva estructura simplificada (3 columnas):
-    - Columna A: Campo (nombre de la variable)
-    - Columna B: Valor (dato estático O prompt si es IA)
-    - Columna C: Campo Generado (etiqueta)
-    
-    Detección automática:
-    - Si Campo Generado empieza con {{IA: → Valor contiene el prompt
-    - Si no → Valor contiene el dato estático
-    
-    Retorna dos diccionarios: datos_estaticos y datos_ia
-    """
-    archivos_excel = glob.glob(os.path.join(DATA_DIR, '*.xlsx'))
-    
-    if not archivos_excel:
-        print(f"❌ No se encontró ningún archivo Excel en la carpeta '{DATA_DIR}'")
-        return None, None
-    
-    archivo_excel = archivos_excel[0]
-    print(f"📄 Leyendo datos desde: {os.path.basename(archivo_excel)}")
-    
-    wb = openpyxl.load_workbook(archivo_excel, data_only=True)
-    ws = wb.active
-    
-    datos_estaticos = {}
-    datos_ia = {}
-    
-    print("   Leyendo filas...")
-    for i, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-        if not row[0]: continue
-        
-        campo = str(row[0]).strip()
-        valor = row[1] if row[1] is not None else ""
-        campo_generado = str(row[2]).strip() if len(row) > 2 and row[2] else ""
-        
-        if campo_generado.startswith("{{IA:"):
-            datos_ia[campo] = valor
-            print(f"   - Fila {i}: {campo} [IA] → Prompt configurado")
-        else:
-            datos_estaticos[campo] = valor
-            print(f"   - Fila {i}: {campo} [STATIC] → {str(valor)[:50]}...")
-    
-    normas = []
-    for campo, valor in datos_estaticos.items():
-        if 'NORMA' in campo.upper() and valor and not campo.endswith('_RESUMEN'):
-            normas.append(str(valor))
-    
-    wb.close()
-    return datos_estaticos, datos_ia, normas
-
-def procesar_parrafo(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas):
+def procesar_parrafo(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas, respuestas_ia=None):
     """
     Reemplaza etiquetas en un párrafo de Word.
     Soporta {{ETIQUETA}} (estáticas), {{IA:NOMBRE}} (IA) y {{IMG:CAMPO}} (imágenes)
     Incluye memoria de respuestas previas para coherencia.
+    
+    Si se entrega respuestas_ia (generadas en paralelo por generacion_ia),
+    se usan esas respuestas en lugar de llamar a Gemini en línea.
     """
     from docx.shared import Inches
     texto = parrafo.text
@@ -87,10 +42,12 @@ def procesar_parrafo(parrafo, datos_estaticos, datos_ia, cliente_gemini, context
     
     for nombre_prompt in etiquetas_ia:
         if nombre_prompt in datos_ia:
-            print(f"   🤖 Generando contenido IA para: {nombre_prompt}...")
-            prompt = datos_ia[nombre_prompt]
-            
-            respuesta = cliente_gemini.generar_texto(prompt, datos_estaticos, contexto_sistema)
+            respuesta = tomar_respuesta(respuestas_ia, nombre_prompt)
+            if respuesta is None:
+                print(f"   🤖 Generando contenido IA para: {nombre_prompt}...")
+                prompt = datos_ia[nombre_prompt]
+                
+                respuesta = cliente_gemini.generar_texto(prompt, datos_estaticos, contexto_sistema)
             
             if respuesta.startswith("[ERROR"):
                 print(f"      ⚠️ {respuesta}")
@@ -102,15 +59,8 @@ def procesar_parrafo(parrafo, datos_estaticos, datos_ia, cliente_gemini, context
                 texto = texto.replace(marcador, respuesta)
                 cambios = True
     
-    etiquetas_estaticas = re.findall(r'\{\{(?!IA:)([^}]+)\}\}', texto)
-    
-    for etiqueta in etiquetas_estaticas:
-        if etiqueta in datos_estaticos:
-            valor = str(datos_estaticos[etiqueta])
-            marcador = f"{{{{{etiqueta}}}}}"
-            if marcador in texto:
-                texto = texto.replace(marcador, valor)
-                cambios = True
+    texto, cambios_estaticos = sustituir_estaticas(texto, datos_estaticos)
+    cambios = cambios or cambios_estaticos
     
     if cambios:
         
@@ -124,28 +74,115 @@ def procesar_parrafo(parrafo, datos_estaticos, datos_ia, cliente_gemini, context
         
         parrafo.text = texto
 
-def procesar_word():
+def cargar_plantillas_word(plantillas):
+    """
+    Fase 1: abre y compila las plantillas Word (índice de etiquetas, con caché en disco).
+    
+    Args:
+        plantillas: Rutas de las plantillas .docx
+    
+    Returns:
+        Lista de tuplas (nombre_archivo, doc, indice) de las plantillas que se pudieron abrir
+    """
+    documentos = []
+    for ruta_plantilla in plantillas:
+        nombre_archivo = os.path.basename(ruta_plantilla)
+        try:
+            with open(ruta_plantilla, 'rb') as f, medir('cargar_plantilla', plantilla=nombre_archivo):
+                doc, indice = cargar_plantilla_compilada(f.read(), nombre_archivo)
+            print(f"   🔎 {nombre_archivo}: {len(indice['ubicaciones'])} ubicaciones con etiquetas")
+            documentos.append((nombre_archivo, doc, indice))
+        except Exception as e:
+            print(f"❌ Error abriendo {nombre_archivo}: {str(e)}")
+    return documentos
+
+def guardar_plantillas_word(documentos, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, respuestas_ia, directorio_salida):
+    """
+    Fase 3: escribe los datos y las respuestas IA en cada plantilla y la guarda
+    en directorio_salida (con su MEMORIA_*.txt).
+    
+    Returns:
+        Número de documentos guardados
+    """
+    guardados = 0
+    for nombre_archivo, doc, indice in documentos:
+        print(f"\n🔄 Procesando plantilla: {nombre_archivo}")
+        
+        memoria_respuestas = []
+        
+        try:
+            with medir('render_plantilla', plantilla=nombre_archivo, ubicaciones=len(indice['ubicaciones'])):
+                for parrafo in parrafos_indexados(doc, indice):
+                    procesar_parrafo(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas, respuestas_ia)
+            
+            nombre_base = os.path.splitext(nombre_archivo)[0]
+            if nombre_base.startswith('_'):
+                nombre_base = nombre_base[1:]
+            
+            nombre_salida = f"{nombre_base}.docx"
+            ruta_salida = os.path.join(directorio_salida, nombre_salida)
+            with medir('guardar', plantilla=nombre_salida):
+                doc.save(ruta_salida)
+            guardados += 1
+            print(f"✅ Documento guardado exitosamente en: {os.path.basename(directorio_salida)}/{nombre_salida}")
+            
+            if memoria_respuestas:
+                memoria_file = os.path.join(directorio_salida, f'MEMORIA_{nombre_salida.replace(".docx", ".txt")}')
+                try:
+                    with open(memoria_file, 'w', encoding='utf-8') as f:
+                        f.write("MEMORIA COMPLETA DE GENERACIONES IA\n")
+                        f.write("="*80 + "\n\n")
+                        for i, resp in enumerate(memoria_respuestas, 1):
+                            f.write(f"\n{i}. {resp}\n")
+                            f.write("-"*80 + "\n")
+                    print(f"💾 Memoria guardada en: MEMORIA_{nombre_salida.replace('.docx', '.txt')}")
+                except Exception as e:
+                    print(f"⚠️  No se pudo guardar memoria: {e}")
+            
+        except Exception as e:
+            print(f"❌ Error procesando {nombre_archivo}: {str(e)}")
+    
+    return guardados
+
+def procesar_word(ruta_data=None, directorio_salida=INYECTADO_DIR, carpeta_empresa=CARPETA_EMPRESA, limitador=None):
+    """
+    Procesa todas las plantillas Word con los datos de una auditoría.
+    
+    Args:
+        ruta_data: DATA.xlsx de la auditoría (None = el primero de '1. Data/')
+        directorio_salida: Carpeta de los documentos generados
+        carpeta_empresa: Carpeta con los documentos de la empresa (None = sin documentos)
+        limitador: LimitadorTasa compartido (por defecto, uno propio del cliente)
+    
+    Returns:
+        Diccionario {'documentos': guardados, 'prompts': llamadas IA, 'ahorradas': llamadas evitadas},
+        o None si se abortó
+    """
     print("="*60)
     print("INYECTOR DE WORD CON IA - INICIANDO v1.0")
     print("="*60)
 
     try:
-        cliente_gemini = GeminiClient()
+        cliente_gemini = GeminiClient(limitador=limitador)
         print("✅ Cliente Gemini correecto")
     except Exception as e:
         print(f"❌ Error al iniciar Gemini: {e}")
         return
 
-    datos_estaticos, datos_ia, normas = leer_datos_excel()
-    if not datos_estaticos:
+    datos = cargar_datos_auditoria(ruta_data) if ruta_data else leer_datos_auditoria(DATA_DIR)
+    if datos is None or not datos.estaticos:
         print("❌ No se pudieron cargar datos. Verifica la carpeta '1. Data'")
         return
+    datos_estaticos, datos_ia, normas = datos.estaticos, datos.prompts_ia, datos.normas
     
-    contexto_empresa = leer_informacion_empresa()
+    documentos_empresa = leer_documentos_empresa(carpeta_empresa) if carpeta_empresa else []
+    contexto_empresa, indice_documentos = preparar_informacion_empresa(documentos_empresa)
+    cliente_gemini.usar_documentos(indice_documentos)
     
     contexto_sistema = generar_contexto_base(normas, datos_estaticos, None, contexto_empresa)
     
-    ruta_contexto = os.path.join(INYECTADO_DIR, 'CONTEXTO_IA.txt')
+    os.makedirs(directorio_salida, exist_ok=True)
+    ruta_contexto = os.path.join(directorio_salida, 'CONTEXTO_IA.txt')
     try:
         with open(ruta_contexto, 'w', encoding='utf-8') as f:
             f.write("="*80 + "\n")
@@ -169,59 +206,52 @@ def procesar_word():
     
     if not plantillas:
         print(f"❌ No se encontraron plantillas .docx en '{PLANTILLA_DIR}'")
-        return
+        return {'documentos': 0, 'prompts': 0, 'ahorradas': 0}
         
     print(f"📂 Se encontraron {len(plantillas)} plantillas.")
     
-    for ruta_plantilla in plantillas:
-        nombre_archivo = os.path.basename(ruta_plantilla)
-        print(f"\n🔄 Procesando plantilla: {nombre_archivo}")
-        
-        memoria_respuestas = []
-        
+    # Fase 1: abrir y compilar todas las plantillas (índice de etiquetas, con caché en disco)
+    documentos = cargar_plantillas_word(plantillas)
+    
+    aciertos, fallos = estadisticas_cache_plantillas()
+    print(f"   💾 Caché de plantillas: {aciertos} aciertos, {fallos} compiladas")
+    
+    apariciones = recolectar_etiquetas_ia((indice for _, _, indice in documentos), datos_ia)
+    pendientes = resolver_etiquetas_ia(apariciones)
+    if len(apariciones) > len(pendientes):
+        print(f"   ♻️  {len(apariciones)} etiquetas IA → {len(pendientes)} llamadas ({len(apariciones) - len(pendientes)} ahorradas: etiquetas repetidas)")
+    
+    # Fase 2: generar todas las respuestas IA en paralelo
+    respuestas_ia = None
+    if pendientes:
+        print(f"\n🤖 Generando {len(pendientes)} respuestas IA en paralelo...")
+        modo_contexto = cliente_gemini.preparar_contexto(contexto_sistema)
+        print(f"   📎 Contexto del sistema enviado en modo: {modo_contexto}")
         try:
-            doc = Document(ruta_plantilla)
-            
-            for parrafo in doc.paragraphs:
-                procesar_parrafo(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas)
-                
-            for tabla in doc.tables:
-                for fila in tabla.rows:
-                    for celda in fila.cells:
-                        for parrafo in celda.paragraphs:
-                            procesar_parrafo(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas)
-            
-            if not os.path.exists(INYECTADO_DIR):
-                os.makedirs(INYECTADO_DIR)
-            
-            nombre_base = os.path.splitext(nombre_archivo)[0]
-            if nombre_base.startswith('_'):
-                nombre_base = nombre_base[1:]
-            
-            nombre_salida = f"{nombre_base}.docx"
-            ruta_salida = os.path.join(INYECTADO_DIR, nombre_salida)
-            doc.save(ruta_salida)
-            print(f"✅ Documento guardado exitosamente en: 3. Inyectado/{nombre_salida}")
-            
-            if memoria_respuestas:
-                memoria_file = os.path.join(INYECTADO_DIR, f'MEMORIA_{nombre_salida.replace(".docx", ".txt")}')
-                try:
-                    with open(memoria_file, 'w', encoding='utf-8') as f:
-                        f.write("MEMORIA COMPLETA DE GENERACIONES IA\n")
-                        f.write("="*80 + "\n\n")
-                        for i, resp in enumerate(memoria_respuestas, 1):
-                            f.write(f"\n{i}. {resp}\n")
-                            f.write("-"*80 + "\n")
-                    print(f"💾 Memoria guardada en: MEMORIA_{nombre_salida.replace('.docx', '.txt')}")
-                except Exception as e:
-                    print(f"⚠️  No se pudo guardar memoria: {e}")
-            
-        except Exception as e:
-            print(f"❌ Error procesando {nombre_archivo}: {str(e)}")
+            respuestas_ia = generar_respuestas_ia(
+                cliente_gemini, pendientes, datos_ia, datos_estaticos, contexto_sistema,
+                progress_callback=lambda hechas, total: print(f"   ✅ {hechas}/{total} respuestas IA")
+            )
+        except PresupuestoErroresAgotado as e:
+            print(f"❌ {e}")
+            print("   No se guardan documentos incompletos. Revisa la cuota de la API y vuelve a ejecutar.")
+            return
+        finally:
+            cliente_gemini.liberar_contexto()
+    
+    # Fase 3: escribir resultados en cada plantilla
+    guardados = guardar_plantillas_word(documentos, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, respuestas_ia, directorio_salida)
 
     print("\n" + "="*60)
     print("PROCESO COMPLETADO")
     print("="*60)
+    
+    cache = cliente_gemini.estadisticas_cache()
+    if cache['activa']:
+        print(f"💾 Caché de respuestas IA: {cache['aciertos']} aciertos, {cache['fallos']} fallos")
+    
+    return {'documentos': guardados, 'prompts': len(pendientes), 'ahorradas': len(apariciones) - len(pendientes)}
 
 if __name__ == "__main__":
-    procesar_word()
\ No newline at end of file
+    with ejecucion_trazada('word', INYECTADO_DIR):
+        procesar_word()
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Lectura de libros Excel de entrada en modo streaming.
+
+openpyxl en modo normal construye un objeto por celda de todo el libro; con
+libros grandes (p. ej. una Lista Maestra de Documentos con el formato
+extendido a miles de filas vacías) eso dispara la RAM. Aquí los libros se
+abren en modo solo lectura (read_only=True, data_only=True): las filas se
+leen del XML a medida que se recorren y se exponen como un generador.
+
+Al extraer el texto de los Excel de la empresa (iterar_hojas), la lectura se
+detiene al final de la región de datos: tras EXCEL_FILAS_VACIAS_FIN filas
+vacías seguidas (por defecto 100) se considera que el resto de la hoja es
+formato sin contenido, y se avisa por consola si la hoja declaraba más filas.
+DATA.xlsx (iterar_filas) se lee siempre hasta el final: un campo después de
+un hueco largo no debe perderse.
+
+Se usa para los datos de auditoría (DATA.xlsx) y para extraer el texto de
+los Excel de la empresa. Las plantillas Excel se siguen abriendo en modo
+normal, porque se modifican y se guardan.
+
+Ejemplo:
+    >>> for numero, fila in iterar_filas('1. Data/DATA.xlsx', min_fila=2, max_columnas=3):
+    ...     print(numero, fila)
+"""
+
+import io
+import os
+from contextlib import contextmanager
+
+import openpyxl
+
+EXCEL_FILAS_VACIAS_FIN = int(os.getenv('EXCEL_FILAS_VACIAS_FIN', '100'))
+
+@contextmanager
+def abrir_libro(origen):
+    """
+    Abre un libro en modo solo lectura y lo cierra al salir del bloque
+    (en este modo openpyxl mantiene el archivo abierto mientras se lee).
+
+    Args:
+        origen: Ruta, bytes o archivo abierto en modo binario
+    """
+    if isinstance(origen, (bytes, bytearray)):
+        origen = io.BytesIO(origen)
+    wb = openpyxl.load_workbook(origen, read_only=True, data_only=True)
+    try:
+        yield wb
+    finally:
+        wb.close()
+
+def filas_con_datos(ws, min_fila=1, max_columnas=None, filas_vacias_fin=None):
+    """
+    Genera las filas de una hoja hasta el final de su región de datos.
+
+    Args:
+        ws: Hoja (normal o de solo lectura)
+        min_fila: Primera fila a leer (1 = encabezado incluido)
+        max_columnas: Columnas a leer (None = todas); las filas se rellenan con None hasta ese ancho
+        filas_vacias_fin: Filas vacías seguidas que cierran la región (None = leer hasta
+                          el final; las filas vacías finales no se generan)
+
+    Yields:
+        Tuplas (numero_fila, valores). Las filas vacías dentro de la región
+        también se generan, para que el llamador conserve la numeración.
+    """
+    vacias = []
+
+    for numero, valores in enumerate(ws.iter_rows(min_row=min_fila, max_col=max_columnas, values_only=True), start=min_fila):
+        if all(v is None for v in valores):
+            vacias.append((numero, valores))
+            if filas_vacias_fin is not None and len(vacias) >= filas_vacias_fin:
+                if ws.max_row and ws.max_row > numero:
+                    print(f"   ⚠️ Hoja '{ws.title}': lectura detenida en la fila {numero} tras "
+                          f"{filas_vacias_fin} filas vacías (la hoja declara {ws.max_row} filas)")
+                return
+            continue
+
+        # Las vacías acumuladas estaban dentro de la región: se entregan ahora
+        yield from vacias
+        vacias = []
+        yield numero, valores
+
+def iterar_filas(origen, hoja=None, min_fila=1, max_columnas=None, filas_vacias_fin=None):
+    """
+    Genera las filas de una hoja de un libro en modo streaming.
+
+    Args:
+        origen: Ruta, bytes o archivo abierto en modo binario
+        hoja: Nombre de la hoja (None = hoja activa)
+        min_fila, max_columnas, filas_vacias_fin: ver filas_con_datos (por defecto
+            se lee hasta el final)
+
+    Yields:
+        Tuplas (numero_fila, valores)
+    """
+    with abrir_libro(origen) as wb:
+        ws = wb[hoja] if hoja else wb.active
+        yield from filas_con_datos(ws, min_fila, max_columnas, filas_vacias_fin)
+
+def iterar_hojas(origen, excluir=(), filas_vacias_fin=None):
+    """
+    Genera, hoja por hoja, el nombre y las filas con datos de un libro.
+    Las filas de cada hoja deben consumirse antes de pasar a la siguiente.
+    Cada hoja se corta tras filas_vacias_fin filas vacías seguidas (por
+    defecto EXCEL_FILAS_VACIAS_FIN).
+
+    Yields:
+        Tuplas (nombre_hoja, generador de (numero_fila, valores))
+    """
+    if filas_vacias_fin is None:
+        filas_vacias_fin = EXCEL_FILAS_VACIAS_FIN
+    with abrir_libro(origen) as wb:
+        for nombre in wb.sheetnames:
+            if nombre in excluir:
+                continue
+            yield nombre, filas_con_datos(wb[nombre], filas_vacias_fin=filas_vacias_fin)
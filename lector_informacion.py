@@ -2,130 +2,313 @@
 Lector de Información de la Empresa
 Lee automáticamente documentos PDF, Word, Excel de la carpeta de información
 y extrae el texto para usarlo como contexto en las generaciones de IA.
+
+El texto extraído se guarda en una caché en disco (.cache/extraccion/) con
+clave SHA-256 del archivo + extensión + versión de los extractores, así que
+volver a ejecutar una auditoría o volver a subir el mismo archivo no lo
+vuelve a parsear.
+
+Los archivos que no están en caché se extraen en paralelo con un pool de
+procesos (PyPDF2 es CPU-bound): una tarea por archivo y, en los PDF largos,
+una tarea por rango de páginas. El resultado conserva el orden de entrada.
+
+Variables de entorno:
+- EXTRACCION_PROCESOS: procesos del pool en la CLI y los lotes (por defecto, núcleos
+  disponibles; 1 = secuencial). Streamlit usa STREAMLIT_EXTRACCION_PROCESOS (por defecto 1)
+- EXTRACCION_PAGINAS_POR_TAREA: páginas de PDF por tarea (por defecto 25)
 """
 
 import os
 import glob
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from PyPDF2 import PdfReader
 from docx import Document
-import openpyxl
+
+from cache_disco import CacheDisco, DIRECTORIO_CACHE, hash_archivo, hash_bytes
+from lector_excel import iterar_hojas
+from trazas import medido, traza_actual
+
+# Cambiar al modificar cualquier extractor: invalida la caché de extracción
+VERSION_EXTRACTORES = 2
+CACHE_EXTRACCION_MAX_MB = int(os.getenv('CACHE_EXTRACCION_MAX_MB', '128'))
+
+# Texto extraído y fragmentos para recuperación (ver recuperacion.py)
+cache_extraccion = CacheDisco(
+    os.path.join(DIRECTORIO_CACHE, 'extraccion'),
+    max_bytes=CACHE_EXTRACCION_MAX_MB * 1024 * 1024
+)
+
+EXTRACCION_PROCESOS = int(os.getenv('EXTRACCION_PROCESOS', str(os.cpu_count() or 1)))
+EXTRACCION_PAGINAS_POR_TAREA = int(os.getenv('EXTRACCION_PAGINAS_POR_TAREA', '25'))
+
+def extraer_paginas_pdf(ruta_archivo, inicio=0, fin=None):
+    """Texto de las páginas [inicio, fin) de un PDF, sin recortar (lanza excepción si falla)"""
+    paginas = PdfReader(ruta_archivo).pages
+    fin = len(paginas) if fin is None else min(fin, len(paginas))
+    return "".join(paginas[i].extract_text() + "\n" for i in range(inicio, fin))
+
+def leer_texto_pdf(ruta_archivo):
+    """Texto de un archivo PDF (lanza excepción si falla)"""
+    return extraer_paginas_pdf(ruta_archivo).strip()
 
 def extraer_texto_pdf(ruta_archivo):
     """Extrae texto de un archivo PDF"""
     try:
-        reader = PdfReader(ruta_archivo)
-        texto = ""
-        for pagina in reader.pages:
-            texto += pagina.extract_text() + "\n"
-        return texto.strip()
+        return leer_texto_pdf(ruta_archivo)
     except Exception as e:
         return f"[Error leyendo PDF: {e}]"
 
+def leer_texto_word(ruta_archivo):
+    """Texto de un archivo Word .docx (lanza excepción si falla)"""
+    doc = Document(ruta_archivo)
+    return "\n".join(parrafo.text for parrafo in doc.paragraphs).strip()
+
 def extraer_texto_word(ruta_archivo):
     """Extrae texto de un archivo Word (.docx)"""
     try:
-        doc = Document(ruta_archivo)
-        texto = ""
-        for parrafo in doc.paragraphs:
-            texto += parrafo.text + "\n"
-        return texto.strip()
+        return leer_texto_word(ruta_archivo)
     except Exception as e:
         return f"[Error leyendo Word: {e}]"
 
+# Hojas a excluir (contienen prompts IA, no documentación)
+HOJAS_EXCLUIR = ['Hoja1', 'Sheet1', 'PROMPTS', 'CLAUSULAS']
+
+def iterar_texto_excel(ruta_archivo):
+    """
+    Genera el texto de un libro Excel por fragmentos: un encabezado por hoja y
+    una línea por fila. El libro se lee en streaming (ver lector_excel.py).
+    """
+    # Saltar hojas de prompts IA
+    for hoja, filas in iterar_hojas(ruta_archivo, excluir=HOJAS_EXCLUIR):
+        yield f"\n--- Hoja: {hoja} ---\n"
+        for _, fila in filas:
+            valores = [str(v) for v in fila if v is not None]
+            if valores:
+                yield " | ".join(valores) + "\n"
+
+def leer_texto_excel(ruta_archivo):
+    """Texto de un archivo Excel .xlsx (lanza excepción si falla)"""
+    return "".join(iterar_texto_excel(ruta_archivo)).strip()
+
 def extraer_texto_excel(ruta_archivo):
     """Extrae texto de un archivo Excel (.xlsx)"""
     try:
-        wb = openpyxl.load_workbook(ruta_archivo, data_only=True)
-        texto = ""
-        
-        # Hojas a excluir (contienen prompts IA, no documentación)
-        hojas_excluir = ['Hoja1', 'Sheet1', 'PROMPTS', 'CLAUSULAS']
-        
-        for hoja in wb.sheetnames:
-            # Saltar hojas de prompts IA
-            if hoja in hojas_excluir:
-                continue
-                
-            ws = wb[hoja]
-            texto += f"\n--- Hoja: {hoja} ---\n"
-            
-            for fila in ws.iter_rows(values_only=True):
-                valores = [str(v) for v in fila if v is not None]
-                if valores:
-                    texto += " | ".join(valores) + "\n"
-        
-        wb.close()
-        return texto.strip()
+        return leer_texto_excel(ruta_archivo)
     except Exception as e:
         return f"[Error leyendo Excel: {e}]"
 
+def leer_texto_txt(ruta_archivo):
+    """Texto de un archivo de texto plano (lanza excepción si falla)"""
+    with open(ruta_archivo, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
 def extraer_texto_txt(ruta_archivo):
     """Extrae texto de un archivo de texto plano"""
     try:
-        with open(ruta_archivo, 'r', encoding='utf-8') as f:
-            return f.read().strip()
+        return leer_texto_txt(ruta_archivo)
     except Exception as e:
         return f"[Error leyendo TXT: {e}]"
 
-def leer_informacion_empresa(carpeta="4. INFORMACION EMPRESA"):
+# Lector (lanza excepción si falla), tipo e icono por extensión, en el orden en que se leen los archivos
+EXTRACTORES = {
+    '.pdf': leer_texto_pdf,
+    '.docx': leer_texto_word,
+    '.xlsx': leer_texto_excel,
+    '.txt': leer_texto_txt,
+}
+TIPOS = {'.pdf': 'PDF', '.docx': 'Word', '.xlsx': 'Excel', '.txt': 'TXT'}
+ICONOS = {'.pdf': '📄', '.docx': '📝', '.xlsx': '📊', '.txt': '📃'}
+
+def _ejecutar_tarea(ruta_archivo, extension, rango):
     """
-    Lee TODOS los archivos de la carpeta de información de la empresa
-    y extrae su contenido como texto.
+    Tarea del pool de extracción (se ejecuta en otro proceso).
+    
+    Returns:
+        Tupla (texto, segundos, error). Para un rango de páginas de PDF el
+        texto no se recorta; el error es None si la extracción fue correcta
+        (el texto puede contener cualquier cosa, incluso empezar por "[Error").
+    """
+    inicio = time.perf_counter()
+    try:
+        if rango is None:
+            texto = EXTRACTORES[extension](ruta_archivo)
+        else:
+            texto = extraer_paginas_pdf(ruta_archivo, *rango)
+        error = None
+    except Exception as e:
+        texto, error = "", f"[Error leyendo {TIPOS[extension]}: {e}]"
+    return texto, time.perf_counter() - inicio, error
+
+def _dividir_pdf(ruta_archivo):
+    """Rangos de páginas de un PDF (None si no conviene dividirlo o no se puede leer)"""
+    try:
+        total = len(PdfReader(ruta_archivo).pages)
+    except Exception:
+        return None
+    if total <= EXTRACCION_PAGINAS_POR_TAREA:
+        return None
+    return [(i, i + EXTRACCION_PAGINAS_POR_TAREA) for i in range(0, total, EXTRACCION_PAGINAS_POR_TAREA)]
+
+def _resolver_tareas(tareas, procesos):
+    """Ejecuta las tareas (ruta, extension, rango) y devuelve sus resultados en el mismo orden."""
+    if procesos > 1 and len(tareas) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(procesos, len(tareas))) as pool:
+                return list(pool.map(_ejecutar_tarea, *zip(*tareas)))
+        except (BrokenProcessPool, OSError) as e:
+            print(f"⚠️  Extracción en paralelo no disponible ({e}), se extrae en secuencia")
+    return [_ejecutar_tarea(*tarea) for tarea in tareas]
+
+def extraer_textos(rutas, procesos=None):
+    """
+    Extrae el texto de varios archivos, usando la caché en disco y un pool de
+    procesos para los que no están en caché. Los errores de extracción no se
+    guardan en caché. Registra un evento 'extraer_documento' por archivo.
+    
+    Args:
+        rutas: Lista de rutas de archivo
+        procesos: Procesos del pool (por defecto EXTRACCION_PROCESOS)
+    
+    Returns:
+        Lista de textos en el mismo orden que rutas (None si la extensión no está soportada)
+    """
+    procesos = EXTRACCION_PROCESOS if procesos is None else procesos
+    textos = [None] * len(rutas)
+    informes = [None] * len(rutas)
+    pendientes = []  # (posición, clave, número de tareas)
+    tareas = []
+    
+    for i, ruta in enumerate(rutas):
+        extension = os.path.splitext(ruta)[1].lower()
+        if extension not in EXTRACTORES:
+            continue
+        
+        clave = hash_bytes(hash_archivo(ruta), extension, f"extractor-v{VERSION_EXTRACTORES}")
+        inicio = time.perf_counter()
+        texto = cache_extraccion.obtener(clave)
+        if texto is not None:
+            textos[i] = texto
+            informes[i] = {'cache': 'acierto', 'duracion_s': time.perf_counter() - inicio}
+            continue
+        
+        rangos = _dividir_pdf(ruta) if extension == '.pdf' and procesos > 1 else None
+        if rangos:
+            tareas.extend((ruta, extension, rango) for rango in rangos)
+        else:
+            tareas.append((ruta, extension, None))
+        pendientes.append((i, clave, len(rangos) if rangos else 1))
+    
+    resultados = iter(_resolver_tareas(tareas, procesos))
+    for i, clave, n_tareas in pendientes:
+        partes = [next(resultados) for _ in range(n_tareas)]
+        error = next((e for _, _, e in partes if e), None)
+        if error:
+            textos[i] = error
+        else:
+            textos[i] = "".join(t for t, _, _ in partes)
+            if n_tareas > 1:
+                textos[i] = textos[i].strip()
+            cache_extraccion.guardar(clave, textos[i])
+        informes[i] = {'cache': 'fallo', 'duracion_s': sum(s for _, s, _ in partes), 'tareas': n_tareas}
+        if error:
+            informes[i]['error'] = error
+    
+    traza = traza_actual()
+    for ruta, informe in zip(rutas, informes):
+        if informe is None:
+            continue
+        if informe.get('error'):
+            print(f"   ❌ {os.path.basename(ruta)}: {informe['error']}")
+        if traza is not None:
+            informe['duracion_s'] = round(informe['duracion_s'], 4)
+            traza.registrar('extraer_documento', archivo=os.path.basename(ruta), **informe)
+    return textos
+
+def extraer_texto(ruta_archivo):
+    """
+    Extrae el texto de un archivo según su extensión, usando la caché en disco.
+    
+    Returns:
+        Texto extraído, o None si la extensión no está soportada
+    """
+    return extraer_textos([ruta_archivo], procesos=1)[0]
+
+@medido('leer_informacion_empresa', lambda documentos: {'documentos': len(documentos), 'caracteres': sum(len(t) for _, t in documentos)})
+def leer_documentos_empresa(carpeta="4. INFORMACION EMPRESA"):
+    """
+    Lee TODOS los archivos soportados de la carpeta de información de la empresa.
     
     Args:
         carpeta: Ruta a la carpeta con información
     
     Returns:
-        String con todo el contenido extraído, formateado
+        Lista de tuplas (nombre_archivo, texto) en orden PDF, Word, Excel, TXT
+        (lista vacía si la carpeta no existe o no tiene archivos)
     """
     if not os.path.exists(carpeta):
-        return None
+        return []
     
-    archivos_pdf = glob.glob(os.path.join(carpeta, "*.pdf"))
-    archivos_word = glob.glob(os.path.join(carpeta, "*.docx"))
-    archivos_excel = glob.glob(os.path.join(carpeta, "*.xlsx"))
-    archivos_txt = glob.glob(os.path.join(carpeta, "*.txt"))
+    archivos = []
+    for extension in EXTRACTORES:
+        archivos.extend(glob.glob(os.path.join(carpeta, f"*{extension}")))
     
-    total_archivos = len(archivos_pdf) + len(archivos_word) + len(archivos_excel) + len(archivos_txt)
+    if not archivos:
+        return []
     
-    if total_archivos == 0:
-        return None
+    print(f"📂 Leyendo {len(archivos)} documentos de información empresarial...")
     
-    print(f"📂 Leyendo {total_archivos} documentos de información empresarial...")
+    for archivo in archivos:
+        print(f"   {ICONOS[os.path.splitext(archivo)[1].lower()]} {os.path.basename(archivo)}")
     
-    contenido_total = "\n" + "="*80 + "\n"
-    contenido_total += "INFORMACIÓN ADICIONAL DE LA EMPRESA (usar para generar contenido realista)\n"
-    contenido_total += "="*80 + "\n\n"
+    aciertos_previos = cache_extraccion.aciertos
+    textos = extraer_textos(archivos)
+    documentos = [(os.path.basename(archivo), texto) for archivo, texto in zip(archivos, textos)]
     
-    for archivo in archivos_pdf:
-        nombre = os.path.basename(archivo)
-        print(f"   📄 {nombre}")
-        texto = extraer_texto_pdf(archivo)
-        contenido_total += f"\n--- Archivo: {nombre} ---\n{texto}\n\n"
+    en_cache = cache_extraccion.aciertos - aciertos_previos
+    print(f"✅ Información empresarial cargada ({len(archivos)} archivos, {en_cache} desde caché)")
     
-    for archivo in archivos_word:
-        nombre = os.path.basename(archivo)
-        print(f"   📝 {nombre}")
-        texto = extraer_texto_word(archivo)
-        contenido_total += f"\n--- Archivo: {nombre} ---\n{texto}\n\n"
+    return documentos
+
+def iterar_informacion_empresa(documentos):
+    """Genera el bloque de información de la empresa por fragmentos (ver formatear_informacion_empresa)"""
+    yield "\n" + "="*80 + "\n"
+    yield "INFORMACIÓN ADICIONAL DE LA EMPRESA (usar para generar contenido realista)\n"
+    yield "="*80 + "\n\n"
     
-    for archivo in archivos_excel:
-        nombre = os.path.basename(archivo)
-        print(f"   📊 {nombre}")
-        texto = extraer_texto_excel(archivo)
-        contenido_total += f"\n--- Archivo: {nombre} ---\n{texto}\n\n"
+    for nombre, texto in documentos:
+        yield f"\n--- Archivo: {nombre} ---\n{texto}\n\n"
     
-    for archivo in archivos_txt:
-        nombre = os.path.basename(archivo)
-        print(f"   📃 {nombre}")
-        texto = extraer_texto_txt(archivo)
-        contenido_total += f"\n--- Archivo: {nombre} ---\n{texto}\n\n"
+    yield "="*80 + "\n"
+
+def formatear_informacion_empresa(documentos):
+    """
+    Une el texto completo de los documentos en un solo bloque de contexto.
     
-    contenido_total += "="*80 + "\n"
+    Args:
+        documentos: Lista de tuplas (nombre_archivo, texto)
     
-    print(f"✅ Información empresarial cargada ({total_archivos} archivos)")
+    Returns:
+        String con todo el contenido, formateado
+    """
+    return "".join(iterar_informacion_empresa(documentos))
+
+def leer_informacion_empresa(carpeta="4. INFORMACION EMPRESA"):
+    """
+    Lee TODOS los archivos de la carpeta de información de la empresa
+    y extrae su contenido como texto.
+    
+    Args:
+        carpeta: Ruta a la carpeta con información
     
-    return contenido_total
+    Returns:
+        String con todo el contenido extraído, formateado (None si no hay archivos)
+    """
+    documentos = leer_documentos_empresa(carpeta)
+    if not documentos:
+        return None
+    return formatear_informacion_empresa(documentos)
 
 if __name__ == "__main__":
     info = leer_informacion_empresa()
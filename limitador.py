@@ -0,0 +1,254 @@
+"""
+Control de tráfico hacia la API de IA.
+
+- LimitadorTasa: token bucket doble (solicitudes/minuto y tokens/minuto)
+  compartido por todos los hilos que usan el mismo cliente.
+- LimitadorTasaCompartido: el mismo límite repartido entre varios procesos
+  (modo lote), con el estado de los cubos en memoria compartida.
+- ejecutar_con_reintentos: reintento con backoff exponencial y jitter para
+  errores transitorios (429, 500, 503, timeouts).
+- PresupuestoErrores: número máximo de fallos definitivos por ejecución;
+  al agotarse se aborta la ejecución en lugar de entregar documentos con
+  secciones "[ERROR IA: ...]".
+- GeneracionCancelada: el usuario canceló la ejecución; no cuenta como
+  error ni se reintenta.
+
+El reloj, la función de espera y el generador aleatorio son inyectables
+para poder probar la lógica sin red ni esperas reales.
+"""
+
+import multiprocessing
+import random
+import threading
+import time
+
+# Marcadores de errores transitorios en el mensaje (cuando no hay tipo específico)
+MARCADORES_REINTENTABLES = (
+    '429', '500', '502', '503', '504',
+    'RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'DEADLINE_EXCEEDED', 'INTERNAL',
+    'Too Many Requests', 'quota', 'timed out', 'Timeout',
+)
+
+class PresupuestoErroresAgotado(Exception):
+    """Se superó el número de errores de IA permitidos en una ejecución."""
+
+class GeneracionCancelada(Exception):
+    """La ejecución se canceló (p. ej. desde la interfaz) antes de terminar la generación."""
+
+class CuboTokens:
+    """Cubo de tokens con recarga continua."""
+
+    def __init__(self, capacidad, por_segundo, reloj=time.monotonic):
+        self.capacidad = float(capacidad)
+        self.por_segundo = float(por_segundo)
+        self.disponibles = float(capacidad)
+        self._reloj = reloj
+        self._ultimo = reloj()
+
+    def _recargar(self):
+        ahora = self._reloj()
+        self.disponibles = min(self.capacidad, self.disponibles + (ahora - self._ultimo) * self.por_segundo)
+        self._ultimo = ahora
+
+    def espera_necesaria(self, cantidad):
+        """Segundos hasta que haya `cantidad` tokens disponibles (0 si ya los hay)."""
+        self._recargar()
+        cantidad = min(cantidad, self.capacidad)
+        if self.disponibles >= cantidad:
+            return 0.0
+        return (cantidad - self.disponibles) / self.por_segundo
+
+    def consumir(self, cantidad):
+        self.disponibles -= min(cantidad, self.capacidad)
+
+class LimitadorTasa:
+    """
+    Limita las llamadas por solicitudes/minuto y tokens/minuto.
+
+    Ejemplo:
+        >>> limitador = LimitadorTasa(solicitudes_por_minuto=60, tokens_por_minuto=250000)
+        >>> limitador.adquirir(tokens=1200)   # bloquea hasta que haya cupo
+    """
+
+    def __init__(self, solicitudes_por_minuto, tokens_por_minuto=None, reloj=time.monotonic, dormir=time.sleep):
+        self._solicitudes = CuboTokens(solicitudes_por_minuto, solicitudes_por_minuto / 60.0, reloj)
+        self._tokens = None
+        if tokens_por_minuto:
+            self._tokens = CuboTokens(tokens_por_minuto, tokens_por_minuto / 60.0, reloj)
+        self._dormir = dormir
+        self._lock = threading.Lock()
+        self.tiempo_esperado = 0.0
+
+    def adquirir(self, tokens=0):
+        """
+        Bloquea hasta que haya cupo para una solicitud de `tokens` tokens.
+
+        Returns:
+            Segundos totales de espera
+        """
+        esperado = 0.0
+        while True:
+            with self._lock:
+                espera = self._solicitudes.espera_necesaria(1)
+                if self._tokens is not None:
+                    espera = max(espera, self._tokens.espera_necesaria(tokens))
+                if espera <= 0:
+                    self._solicitudes.consumir(1)
+                    if self._tokens is not None:
+                        self._tokens.consumir(tokens)
+                    self.tiempo_esperado += esperado
+                    return esperado
+            self._dormir(espera)
+            esperado += espera
+
+class CuboTokensCompartido(CuboTokens):
+    """
+    CuboTokens cuyo estado (tokens disponibles y última recarga) vive en un
+    multiprocessing.Array, a partir de la posición `posicion`.
+    time.monotonic es común a todos los procesos de la máquina.
+    """
+
+    def __init__(self, capacidad, por_segundo, estado, posicion, inicializar, reloj=time.monotonic):
+        self._estado = estado
+        self._posicion = posicion
+        if inicializar:
+            super().__init__(capacidad, por_segundo, reloj)
+        else:
+            self.capacidad = float(capacidad)
+            self.por_segundo = float(por_segundo)
+            self._reloj = reloj
+
+    @property
+    def disponibles(self):
+        return self._estado[self._posicion]
+
+    @disponibles.setter
+    def disponibles(self, valor):
+        self._estado[self._posicion] = valor
+
+    @property
+    def _ultimo(self):
+        return self._estado[self._posicion + 1]
+
+    @_ultimo.setter
+    def _ultimo(self, valor):
+        self._estado[self._posicion + 1] = valor
+
+class LimitadorTasaCompartido(LimitadorTasa):
+    """
+    LimitadorTasa compartido entre procesos: todos los procesos que usan el
+    mismo `estado` respetan un único límite global.
+
+    Ejemplo:
+        >>> limitador = LimitadorTasaCompartido(60, 1000000)        # proceso principal
+        >>> pool = ProcessPoolExecutor(initializer=iniciar, initargs=(limitador.estado,))
+        >>> # en cada proceso: LimitadorTasaCompartido(60, 1000000, estado=estado)
+    """
+
+    def __init__(self, solicitudes_por_minuto, tokens_por_minuto=None, estado=None, dormir=time.sleep):
+        """
+        Args:
+            estado: multiprocessing.Array creado por el limitador del proceso
+                    principal (None = crear uno nuevo e inicializarlo)
+        """
+        super().__init__(solicitudes_por_minuto, tokens_por_minuto, dormir=dormir)
+        inicializar = estado is None
+        if inicializar:
+            estado = multiprocessing.Array('d', 4)
+        self.estado = estado
+        self._lock = estado.get_lock()
+        self._solicitudes = CuboTokensCompartido(
+            solicitudes_por_minuto, solicitudes_por_minuto / 60.0, estado, 0, inicializar)
+        if tokens_por_minuto:
+            self._tokens = CuboTokensCompartido(
+                tokens_por_minuto, tokens_por_minuto / 60.0, estado, 2, inicializar)
+
+class PresupuestoErrores:
+    """Cuenta los fallos definitivos de una ejecución y aborta al superar el máximo."""
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self.errores = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, error):
+        """
+        Registra un fallo definitivo.
+
+        Raises:
+            PresupuestoErroresAgotado: si se supera el máximo permitido
+        """
+        with self._lock:
+            self.errores += 1
+            if self.errores > self.maximo:
+                raise PresupuestoErroresAgotado(
+                    f"Se superó el presupuesto de {self.maximo} errores de IA "
+                    f"(último error: {error})"
+                )
+
+def es_error_reintentable(error):
+    """
+    Indica si un error de la API es transitorio y vale la pena reintentar.
+    Reconoce las excepciones de google.api_core y, como respaldo, el mensaje.
+    """
+    if isinstance(error, GeneracionCancelada):
+        return False
+    try:
+        from google.api_core import exceptions as api_exceptions
+        transitorios = (
+            api_exceptions.TooManyRequests,
+            api_exceptions.ResourceExhausted,
+            api_exceptions.ServiceUnavailable,
+            api_exceptions.InternalServerError,
+            api_exceptions.DeadlineExceeded,
+            api_exceptions.GatewayTimeout,
+        )
+        if isinstance(error, transitorios):
+            return True
+        if isinstance(error, api_exceptions.GoogleAPICallError):
+            return False
+    except ImportError:
+        pass
+
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+
+    mensaje = str(error)
+    return any(marcador in mensaje for marcador in MARCADORES_REINTENTABLES)
+
+def ejecutar_con_reintentos(funcion, max_reintentos=4, espera_base=1.0, espera_maxima=30.0,
+                            es_reintentable=es_error_reintentable, al_reintentar=None,
+                            dormir=time.sleep, aleatorio=random.random):
+    """
+    Ejecuta `funcion()` reintentando errores transitorios con backoff exponencial.
+
+    La espera antes del intento n es aleatoria entre 0 y
+    min(espera_maxima, espera_base * 2**n) ("full jitter"), lo que evita que
+    varios hilos reintenten a la vez tras un 429.
+
+    Args:
+        funcion: Callable sin argumentos
+        max_reintentos: Reintentos adicionales tras el primer intento
+        espera_base: Segundos base del backoff
+        espera_maxima: Tope de espera por intento
+        es_reintentable: Función(error) -> bool
+        al_reintentar: Callback opcional (intento, error, espera)
+
+    Returns:
+        El resultado de `funcion()`
+
+    Raises:
+        La última excepción si no es reintentable o se agotan los reintentos
+    """
+    intento = 0
+    while True:
+        try:
+            return funcion()
+        except Exception as e:
+            if intento >= max_reintentos or not es_reintentable(e):
+                raise
+            espera = aleatorio() * min(espera_maxima, espera_base * (2 ** intento))
+            intento += 1
+            if al_reintentar:
+                al_reintentar(intento, e, espera)
+            dormir(espera)
@@ -0,0 +1,276 @@
+"""
+Utilidades compartidas para recorrer plantillas Word y Excel.
+Centraliza el orden de recorrido para que la recolección de etiquetas
+y la escritura de resultados visiten las mismas ubicaciones.
+
+Incluye un "compilador" de plantillas en dos pasos:
+1. compilar_word / compilar_excel: recorren la plantilla una sola vez y
+   generan un índice con la ubicación exacta de cada etiqueta
+   (ruta del párrafo o hoja+coordenada) clasificada en estáticas, IA e IMG.
+2. parrafos_indexados / celdas_indexadas: en el renderizado solo se visitan
+   las ubicaciones del índice, sin volver a escanear toda la plantilla.
+
+cargar_plantilla_compilada guarda el índice de la compilación en una
+caché en disco (clave: SHA-256 del archivo), de modo que las auditorías
+repetidas no vuelven a escanear las mismas plantillas.
+"""
+
+import io
+import os
+import re
+
+import openpyxl
+from docx import Document
+from docx.table import _Cell
+
+from cache_disco import CacheDisco, DIRECTORIO_CACHE, hash_flujo
+
+PATRON_ETIQUETA = re.compile(r'\{\{([^}]+)\}\}')
+PATRON_ESTATICA = re.compile(r'\{\{(?!IA:|IMG:)([^}]+)\}\}')
+
+# Cambiar si cambia el formato del índice: invalida las entradas anteriores
+# (3: ya no se guarda el libro de Excel, solo el índice)
+VERSION_INDICE = 3
+
+CACHE_PLANTILLAS_MAX_MB = int(os.getenv('CACHE_PLANTILLAS_MAX_MB', '256'))
+
+_cache_plantillas = CacheDisco(
+    os.path.join(DIRECTORIO_CACHE, 'plantillas'),
+    max_bytes=CACHE_PLANTILLAS_MAX_MB * 1024 * 1024
+)
+
+def celdas_fila(tabla, fila):
+    """
+    Celdas reales (<w:tc>) de una fila, cada una una sola vez.
+
+    fila.cells de python-docx devuelve una entrada por columna de la grilla:
+    una celda combinada horizontal o verticalmente aparece repetida. Aquí se
+    recorren los elementos <w:tc> de la fila; la continuación de una
+    combinación vertical es su propio <w:tc> (normalmente vacío).
+    """
+    return [_Cell(tc, tabla) for tc in fila._tr.tc_lst]
+
+def _iterar_rutas_tablas(tablas, prefijo):
+    """Párrafos de las celdas de las tablas (y de sus tablas anidadas), con su ruta."""
+    for ti, tabla in enumerate(tablas):
+        for fi, fila in enumerate(tabla.rows):
+            for ci, celda in enumerate(celdas_fila(tabla, fila)):
+                nivel = prefijo + [ti, fi, ci]
+                for pi, parrafo in enumerate(celda.paragraphs):
+                    yield nivel + [pi], parrafo
+                yield from _iterar_rutas_tablas(celda.tables, nivel)
+
+def iterar_rutas_word(doc):
+    """
+    Recorre los párrafos de un documento Word en el mismo orden en que
+    se procesan: primero el cuerpo, luego las celdas de cada tabla. Cada
+    celda real se visita una sola vez (ver celdas_fila) y, tras sus
+    párrafos, sus tablas anidadas.
+
+    La ruta identifica el párrafo dentro del documento:
+    - ['p', i]: párrafo i del cuerpo
+    - ['t', tabla, fila, celda, i]: párrafo i de una celda de tabla
+    - ['t', tabla, fila, celda, tabla, fila, celda, ..., i]: párrafo i de una
+      celda de una tabla anidada (un trío tabla, fila, celda por nivel)
+
+    Args:
+        doc: Objeto Document de python-docx
+
+    Yields:
+        Tuplas (ruta, Paragraph)
+    """
+    for i, parrafo in enumerate(doc.paragraphs):
+        yield ['p', i], parrafo
+
+    yield from _iterar_rutas_tablas(doc.tables, ['t'])
+
+def sustituir_estaticas(texto, datos_estaticos):
+    """
+    Reemplaza todas las etiquetas {{CAMPO}} de un texto en una sola pasada.
+
+    Usa una única expresión regular y búsqueda en diccionario, por lo que el
+    costo no depende del número de campos de DATA.xlsx. Las etiquetas sin
+    valor definido, {{IA:...}} e {{IMG:...}} se dejan intactas.
+
+    Args:
+        texto: Texto con etiquetas
+        datos_estaticos: Diccionario {campo: valor}
+
+    Returns:
+        Tupla (texto_resultante, hubo_cambios)
+    """
+    if not texto or '{{' not in texto:
+        return texto, False
+
+    cambios = False
+
+    def _reemplazar(coincidencia):
+        nonlocal cambios
+        campo = coincidencia.group(1)
+        if campo in datos_estaticos:
+            cambios = True
+            return str(datos_estaticos[campo])
+        return coincidencia.group(0)
+
+    return PATRON_ESTATICA.sub(_reemplazar, texto), cambios
+
+def clasificar_etiquetas(texto):
+    """
+    Clasifica las etiquetas de un texto en estáticas, IA e imágenes.
+
+    Returns:
+        Diccionario {'estaticas': [...], 'ia': [...], 'img': [...]} o None
+        si el texto no contiene etiquetas
+    """
+    if not texto or '{{' not in texto:
+        return None
+
+    etiquetas = PATRON_ETIQUETA.findall(texto)
+    if not etiquetas:
+        return None
+
+    clasificadas = {'estaticas': [], 'ia': [], 'img': []}
+    for etiqueta in etiquetas:
+        if etiqueta.startswith('IA:'):
+            clasificadas['ia'].append(etiqueta[3:])
+        elif etiqueta.startswith('IMG:'):
+            clasificadas['img'].append(etiqueta[4:])
+        else:
+            clasificadas['estaticas'].append(etiqueta)
+    return clasificadas
+
+def compilar_word(doc):
+    """
+    Genera el índice de etiquetas de un documento Word.
+
+    Args:
+        doc: Objeto Document de python-docx
+
+    Returns:
+        Diccionario {'tipo': 'word', 'ubicaciones': [...]} donde cada
+        ubicación contiene 'ruta' y las etiquetas clasificadas
+    """
+    ubicaciones = []
+    for ruta, parrafo in iterar_rutas_word(doc):
+        etiquetas = clasificar_etiquetas(parrafo.text)
+        if etiquetas:
+            etiquetas['ruta'] = ruta
+            ubicaciones.append(etiquetas)
+    return {'tipo': 'word', 'ubicaciones': ubicaciones}
+
+def compilar_excel(wb):
+    """
+    Genera el índice de etiquetas de un libro Excel.
+
+    Args:
+        wb: Objeto Workbook de openpyxl
+
+    Returns:
+        Diccionario {'tipo': 'excel', 'ubicaciones': [...]} donde cada
+        ubicación contiene 'hoja', 'celda' (coordenada) y las etiquetas
+    """
+    ubicaciones = []
+    for ws in wb.worksheets:
+        for row in ws.iter_rows():
+            for celda in row:
+                if not isinstance(celda.value, str):
+                    continue
+                etiquetas = clasificar_etiquetas(celda.value)
+                if etiquetas:
+                    etiquetas['hoja'] = ws.title
+                    etiquetas['celda'] = celda.coordinate
+                    ubicaciones.append(etiquetas)
+    return {'tipo': 'excel', 'ubicaciones': ubicaciones}
+
+def parrafos_indexados(doc, indice):
+    """
+    Devuelve los párrafos del documento que figuran en el índice.
+
+    Args:
+        doc: Objeto Document de python-docx
+        indice: Índice generado por compilar_word
+
+    Yields:
+        Objetos Paragraph, en el orden del índice
+    """
+    parrafos = None
+    tablas = {}
+    filas = {}
+
+    for ubicacion in indice['ubicaciones']:
+        ruta = ubicacion['ruta']
+        if ruta[0] == 'p':
+            if parrafos is None:
+                parrafos = doc.paragraphs
+            yield parrafos[ruta[1]]
+            continue
+
+        # Un trío (tabla, fila, celda) por nivel de anidamiento; las tablas
+        # y filas ya resueltas se reutilizan entre ubicaciones
+        celda = None
+        for nivel in range(1, len(ruta) - 1, 3):
+            ti, fi, ci = ruta[nivel:nivel + 3]
+            clave_tablas = tuple(ruta[1:nivel])
+            if clave_tablas not in tablas:
+                tablas[clave_tablas] = (celda or doc).tables
+            tabla = tablas[clave_tablas][ti]
+            clave_fila = tuple(ruta[1:nivel + 2])
+            if clave_fila not in filas:
+                filas[clave_fila] = celdas_fila(tabla, tabla.rows[fi])
+            celda = filas[clave_fila][ci]
+        yield celda.paragraphs[ruta[-1]]
+
+def celdas_indexadas(wb, indice):
+    """
+    Devuelve las celdas del libro que figuran en el índice.
+
+    Args:
+        wb: Objeto Workbook de openpyxl
+        indice: Índice generado por compilar_excel
+
+    Yields:
+        Objetos Cell, en el orden del índice
+    """
+    for ubicacion in indice['ubicaciones']:
+        yield wb[ubicacion['hoja']][ubicacion['celda']]
+
+def etiquetas_ia_indice(indice):
+    """Devuelve los nombres de las etiquetas IA del índice, en orden de aparición."""
+    return [nombre for ubicacion in indice['ubicaciones'] for nombre in ubicacion['ia']]
+
+def cargar_plantilla_compilada(contenido, nombre):
+    """
+    Abre y compila una plantilla, reutilizando la caché en disco si existe.
+
+    Solo se guarda el índice, no el documento: el libro de Excel en pickle
+    ocupa decenas de MB (ICO-FO-41: ~49 MB) y no se carga mucho más rápido
+    que volver a leer el .xlsx, y python-docx no admite pickle.
+
+    Args:
+        contenido: Bytes o flujo binario (con seek) del archivo de plantilla;
+            el flujo se lee por bloques, sin copiarlo entero a memoria
+        nombre: Nombre del archivo (se usa la extensión para el tipo)
+
+    Returns:
+        Tupla (documento, indice), donde documento es un Document o Workbook
+        nuevo e independiente en cada llamada
+    """
+    es_excel = nombre.endswith('.xlsx')
+    flujo = io.BytesIO(contenido) if isinstance(contenido, (bytes, bytearray)) else contenido
+    inicio = flujo.tell()
+    clave = hash_flujo(flujo, f"indice-v{VERSION_INDICE}")
+    flujo.seek(inicio)
+
+    doc = openpyxl.load_workbook(flujo) if es_excel else Document(flujo)
+
+    entrada = _cache_plantillas.obtener(clave)
+    if entrada is not None:
+        return doc, entrada['indice']
+
+    indice = compilar_excel(doc) if es_excel else compilar_word(doc)
+    _cache_plantillas.guardar(clave, {'indice': indice})
+    return doc, indice
+
+def estadisticas_cache_plantillas():
+    """Devuelve (aciertos, fallos) de la caché de plantillas en este proceso."""
+    return _cache_plantillas.aciertos, _cache_plantillas.fallos
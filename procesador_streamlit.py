@@ -1,21 +1,42 @@
 """
 Procesador adaptado para Streamlit - Trabaja con archivos en memoria
 Soporta Word (.docx) y Excel (.xlsx)
+
+Las plantillas de un trabajo se leen del disco por bloques (abrir_entrada) y
+cada documento generado se guarda en un SpooledTemporaryFile, que pasa a
+disco al superar SALIDA_MEMORIA_MAX_MB. Eso no baja el pico de memoria de un
+trabajo (~400 MB con las plantillas reales, casi todo el libro ICO-FO-41 en
+openpyxl; ver benchmark_trabajo.py), solo evita acumular las salidas.
 """
 
+import contextlib
 import io
 import tempfile
 import os
 import shutil
-from docx import Document
-import openpyxl
 from datetime import datetime
 import re
 
 from gemini_client import GeminiClient
 from config_auditoria import generar_contexto_base
+from plantillas import cargar_plantilla_compilada, parrafos_indexados, celdas_indexadas, sustituir_estaticas
+from generacion_ia import recolectar_etiquetas_ia, resolver_etiquetas_ia, generar_respuestas_ia, tomar_respuesta
+from limitador import GeneracionCancelada
+from trazas import Traza, activar_traza, medido, medir
+from datos_auditoria import cargar_datos_auditoria
+from lector_informacion import extraer_textos
+from recuperacion import preparar_informacion_empresa
+
+# Tamaño a partir del cual cada documento generado pasa de memoria a un archivo temporal (0 = siempre en memoria)
+SALIDA_MEMORIA_MAX_MB = float(os.getenv('SALIDA_MEMORIA_MAX_MB', '2'))
+
+# Procesos de extracción de los documentos de empresa por trabajo (1 = en el hilo del trabajo).
+# El pool de EXTRACCION_PROCESOS se reserva para la CLI y los lotes: en Streamlit
+# varios trabajos comparten la instancia y cada uno abriría un proceso por núcleo
+STREAMLIT_EXTRACCION_PROCESOS = int(os.getenv('STREAMLIT_EXTRACCION_PROCESOS', '1'))
 
-def procesar_documentos_streamlit(data_file, plantillas, docs_empresa=None, progress_callback=None):
+def procesar_documentos_streamlit(data_file, plantillas, docs_empresa=None, progress_callback=None,
+                                  limitador=None, semaforo_ia=None, vista_previa_callback=None, cancelar=None):
     """
     Procesa documentos usando archivos en memoria (UploadedFile de Streamlit).
     Soporta plantillas Word (.docx) y Excel (.xlsx).
@@ -25,9 +46,21 @@ def procesar_documentos_streamlit(data_file, plantillas, docs_empresa=None, prog
         plantillas: Lista de UploadedFile con plantillas .docx o .xlsx
         docs_empresa: Lista de UploadedFile con documentos empresa (opcional)
         progress_callback: Función callback(progress, mensaje) para actualizar UI
+        limitador: LimitadorTasa compartido entre ejecuciones (por defecto, uno propio)
+        semaforo_ia: Semáforo de llamadas IA simultáneas compartido entre ejecuciones
+        vista_previa_callback: Función callback(vista) opcional: recibe una vez la vista
+                               previa de las respuestas IA (ver crear_vista_previa), que
+                               se actualiza en streaming durante la generación
+        cancelar: threading.Event opcional para interrumpir el procesamiento
+                  durante la generación IA o entre plantillas al escribirlas
+                  (lanza GeneracionCancelada)
     
     Returns:
-        Lista de diccionarios {'nombre': str, 'contenido': bytes}
+        Lista de diccionarios {'nombre': str, 'contenido': archivo binario, 'tipo': str}.
+        'contenido' está al inicio y se lee con read() o shutil.copyfileobj; los
+        documentos son SpooledTemporaryFile (en disco a partir de
+        SALIDA_MEMORIA_MAX_MB). El elemento de tipo 'traza' contiene además
+        'resumen' (filas por etapa)
     """
     
     def update_progress(percent, message):
@@ -35,273 +68,315 @@ def procesar_documentos_streamlit(data_file, plantillas, docs_empresa=None, prog
             progress_callback(min(percent, 100), message)
     
     temp_dir = tempfile.mkdtemp()
+    traza = Traza()
     
     try:
-        update_progress(15, "Leyendo datos del Excel...")
-        
-        datos_estaticos, datos_ia, normas = leer_datos_excel_memoria(data_file)
-        
-        update_progress(25, "Inicializando cliente IA...")
-        
-        cliente_gemini = GeminiClient()
-        
-        update_progress(30, "Procesando información empresarial...")
-        
-        contexto_empresa = ""
-        if docs_empresa:
-            contexto_empresa = procesar_docs_empresa_memoria(docs_empresa, temp_dir)
-        
-        update_progress(35, "Generando contexto base...")
-        
-        contexto_sistema = generar_contexto_base(normas, datos_estaticos, None, contexto_empresa)
-        
-        documentos_generados = []
-        num_plantillas = len(plantillas)
-        
-        memoria_total = []
-        tiene_word = any(p.name.endswith('.docx') for p in plantillas)
-        tiene_excel = any(p.name.endswith('.xlsx') for p in plantillas)
-        
-        for idx, plantilla_file in enumerate(plantillas):
-            progress_inicio = 40 + (idx * 50 // num_plantillas)
-            progress_fin = 40 + ((idx + 1) * 50 // num_plantillas)
+        with activar_traza(traza):
+            update_progress(15, "Leyendo datos del Excel...")
+            
+            datos = cargar_datos_auditoria(data_file.read(), nombre=data_file.name)
+            datos_estaticos, datos_ia, normas = datos.estaticos, datos.prompts_ia, datos.normas
             
-            update_progress(progress_inicio, f"Procesando plantilla {idx+1}/{num_plantillas}: {plantilla_file.name}...")
+            update_progress(25, "Inicializando cliente IA...")
             
-            es_excel = plantilla_file.name.endswith('.xlsx')
+            cliente_gemini = GeminiClient(limitador=limitador)
             
-            if es_excel:
-                doc_generado, respuestas = procesar_plantilla_excel_memoria(
-                    plantilla_file,
-                    datos_estaticos,
-                    datos_ia,
-                    cliente_gemini,
-                    contexto_sistema,
-                    lambda p: update_progress(progress_inicio + int((progress_fin - progress_inicio) * p / 100), 
-                                             f"Procesando {plantilla_file.name}... {p}%")
+            update_progress(30, "Procesando información empresarial...")
+            
+            contexto_empresa = ""
+            if docs_empresa:
+                contexto_empresa, indice_documentos = preparar_informacion_empresa(
+                    leer_documentos_memoria(docs_empresa, temp_dir)
                 )
-                memoria_total.extend(respuestas)
-            else:
-                doc_generado, respuestas = procesar_plantilla_word_memoria(
-                    plantilla_file,
-                    datos_estaticos,
-                    datos_ia,
-                    cliente_gemini,
-                    contexto_sistema,
-                    lambda p: update_progress(progress_inicio + int((progress_fin - progress_inicio) * p / 100), 
-                                             f"Procesando {plantilla_file.name}... {p}%")
+                cliente_gemini.usar_documentos(indice_documentos)
+            
+            update_progress(35, "Generando contexto base...")
+            
+            contexto_sistema = generar_contexto_base(normas, datos_estaticos, None, contexto_empresa)
+            
+            documentos_generados = []
+            num_plantillas = len(plantillas)
+            
+            memoria_total = []
+            tiene_word = any(p.name.endswith('.docx') for p in plantillas)
+            tiene_excel = any(p.name.endswith('.xlsx') for p in plantillas)
+            
+            # Fase 1: cargar y compilar todas las plantillas (índice de etiquetas, con caché en disco)
+            cargadas = []
+            for plantilla_file in plantillas:
+                with medir('cargar_plantilla', plantilla=plantilla_file.name), abrir_entrada(plantilla_file) as flujo:
+                    doc, indice = cargar_plantilla_compilada(flujo, plantilla_file.name)
+                cargadas.append((plantilla_file, doc, indice))
+            
+            apariciones = recolectar_etiquetas_ia((indice for _, _, indice in cargadas), datos_ia)
+            pendientes = resolver_etiquetas_ia(apariciones)
+            
+            # Fase 2: generar todas las respuestas IA en paralelo
+            respuestas_ia = None
+            al_parcial = None
+            if pendientes and vista_previa_callback:
+                vista, al_parcial = crear_vista_previa(
+                    [(plantilla_file.name, indice) for plantilla_file, _, indice in cargadas], datos_ia, pendientes
                 )
-                memoria_total.extend(respuestas)
+                vista_previa_callback(vista)
             
-            nombre_salida = plantilla_file.name.replace('_', '').strip()
+            if pendientes:
+                update_progress(40, f"Generando {len(pendientes)} respuestas IA en paralelo...")
+                cliente_gemini.preparar_contexto(contexto_sistema)
+                try:
+                    respuestas_ia = generar_respuestas_ia(
+                        cliente_gemini, pendientes, datos_ia, datos_estaticos, contexto_sistema,
+                        progress_callback=lambda hechas, total: update_progress(
+                            40 + (hechas * 40 // total), f"Respuestas IA generadas: {hechas}/{total}"
+                        ),
+                        semaforo=semaforo_ia,
+                        al_parcial=al_parcial,
+                        cancelar=cancelar
+                    )
+                finally:
+                    cliente_gemini.liberar_contexto()
             
-            output_buffer = io.BytesIO()
-            doc_generado.save(output_buffer)
-            output_buffer.seek(0)
+            # Fase 3: escribir resultados en cada plantilla
+            for idx in range(num_plantillas):
+                if cancelar is not None and cancelar.is_set():
+                    raise GeneracionCancelada("Procesamiento cancelado")
+                plantilla_file, doc, indice = cargadas[idx]
+                # Se suelta la plantilla al terminarla: su documento no sigue en memoria mientras se procesan las demás
+                cargadas[idx] = None
+                progress_inicio = 80 + (idx * 10 // num_plantillas)
+                progress_fin = 80 + ((idx + 1) * 10 // num_plantillas)
+                
+                update_progress(progress_inicio, f"Procesando plantilla {idx+1}/{num_plantillas}: {plantilla_file.name}...")
+                
+                es_excel = plantilla_file.name.endswith('.xlsx')
+                
+                with medir('render_plantilla', plantilla=plantilla_file.name, ubicaciones=len(indice['ubicaciones'])):
+                    if es_excel:
+                        doc_generado, respuestas = procesar_plantilla_excel_memoria(
+                            doc,
+                            indice,
+                            datos_estaticos,
+                            datos_ia,
+                            cliente_gemini,
+                            contexto_sistema,
+                            lambda p: update_progress(progress_inicio + int((progress_fin - progress_inicio) * p / 100), 
+                                                     f"Procesando {plantilla_file.name}... {p}%"),
+                            respuestas_ia
+                        )
+                        memoria_total.extend(respuestas)
+                    else:
+                        doc_generado, respuestas = procesar_plantilla_word_memoria(
+                            doc,
+                            indice,
+                            datos_estaticos,
+                            datos_ia,
+                            cliente_gemini,
+                            contexto_sistema,
+                            lambda p: update_progress(progress_inicio + int((progress_fin - progress_inicio) * p / 100), 
+                                                     f"Procesando {plantilla_file.name}... {p}%"),
+                            respuestas_ia
+                        )
+                        memoria_total.extend(respuestas)
             
-            documentos_generados.append({
-                'nombre': nombre_salida,
-                'contenido': output_buffer.getvalue(),
-                'tipo': 'documento'
-            })
+                nombre_salida = plantilla_file.name.replace('_', '').strip()
+                
+                salida = tempfile.SpooledTemporaryFile(max_size=int(SALIDA_MEMORIA_MAX_MB * 1024 * 1024))
+                with medir('guardar', plantilla=nombre_salida) as evento:
+                    doc_generado.save(salida)
+                    evento['bytes'] = salida.tell()
+                salida.seek(0)
+                del doc, doc_generado
+                
+                documentos_generados.append({
+                    'nombre': nombre_salida,
+                    'contenido': salida,
+                    'tipo': 'documento'
+                })
+                
+                update_progress(progress_fin, f"Completado: {nombre_salida}")
             
-            update_progress(progress_fin, f"Completado: {nombre_salida}")
-        
-        update_progress(92, "Generando archivos de contexto...")
-        
-        if tiene_word:
-            documentos_generados.append({
-                'nombre': 'CONTEXTO_IA.txt',
-                'contenido': contexto_sistema.encode('utf-8'),
-                'tipo': 'contexto'
-            })
-        
-        if tiene_excel:
-            documentos_generados.append({
-                'nombre': 'CONTEXTO_IA_EXCEL.txt',
-                'contenido': contexto_sistema.encode('utf-8'),
-                'tipo': 'contexto'
-            })
-        
-        update_progress(95, "Generando archivo de memoria...")
-        
-        if memoria_total:
-            from datetime import datetime
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            memoria_txt = "\n\n".join(memoria_total)
+            update_progress(92, "Generando archivos de contexto...")
+            
+            if tiene_word:
+                documentos_generados.append({
+                    'nombre': 'CONTEXTO_IA.txt',
+                    'contenido': io.BytesIO(contexto_sistema.encode('utf-8')),
+                    'tipo': 'contexto'
+                })
+            
+            if tiene_excel:
+                documentos_generados.append({
+                    'nombre': 'CONTEXTO_IA_EXCEL.txt',
+                    'contenido': io.BytesIO(contexto_sistema.encode('utf-8')),
+                    'tipo': 'contexto'
+                })
             
-            if tiene_word and tiene_excel:
-                nombre_memoria = f"MEMORIA_WORD_EXCEL_{timestamp}.txt"
-            elif tiene_word:
-                nombre_memoria = f"MEMORIA_WORD_{timestamp}.txt"
-            else:
-                nombre_memoria = f"MEMORIA_EXCEL_{timestamp}.txt"
+            update_progress(95, "Generando archivo de memoria...")
+            
+            if memoria_total:
+                from datetime import datetime
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                memoria_txt = "\n\n".join(memoria_total)
+                
+                if tiene_word and tiene_excel:
+                    nombre_memoria = f"MEMORIA_WORD_EXCEL_{timestamp}.txt"
+                elif tiene_word:
+                    nombre_memoria = f"MEMORIA_WORD_{timestamp}.txt"
+                else:
+                    nombre_memoria = f"MEMORIA_EXCEL_{timestamp}.txt"
+                
+                documentos_generados.append({
+                    'nombre': nombre_memoria,
+                    'contenido': io.BytesIO(memoria_txt.encode('utf-8')),
+                    'tipo': 'memoria'
+                })
             
             documentos_generados.append({
-                'nombre': nombre_memoria,
-                'contenido': memoria_txt.encode('utf-8'),
-                'tipo': 'memoria'
+                'nombre': f"TRAZA_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl",
+                'contenido': io.BytesIO(traza.jsonl()),
+                'tipo': 'traza',
+                'resumen': traza.resumen()
             })
-        
-        update_progress(98, "Finalizando...")
-        
-        return documentos_generados
-        
+            
+            update_progress(98, "Finalizando...")
+            
+            return documentos_generados
+            
     finally:
         try:
             shutil.rmtree(temp_dir)
         except:
             pass
 
-def leer_datos_excel_memoria(excel_file):
-    """Lee datos del Excel desde un UploadedFile."""
-    
-    wb = openpyxl.load_workbook(io.BytesIO(excel_file.read()), data_only=True)
-    ws = wb.active
+def crear_vista_previa(plantillas, datos_ia, pendientes):
+    """
+    Vista previa de las respuestas IA de una ejecución: qué etiquetas tiene
+    cada plantilla y el estado y texto de cada etiqueta a medida que se generan.
     
-    datos_estaticos = {}
-    datos_ia = {}
+    Args:
+        plantillas: Lista de tuplas (nombre, indice compilado)
+        datos_ia: Diccionario {nombre_prompt: prompt}
+        pendientes: Llamadas de la ejecución (salida de resolver_etiquetas_ia)
     
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if not row[0]:
-            continue
-        
-        campo = str(row[0]).strip()
-        valor = row[1] if row[1] is not None else ""
-        campo_generado = str(row[2]).strip() if len(row) > 2 and row[2] else ""
-        
-        if campo_generado.startswith("{{IA:"):
-            datos_ia[campo] = valor
+    Returns:
+        Tupla (vista, al_parcial): vista es {'plantillas': [{'nombre', 'etiquetas'}],
+        'etiquetas': {nombre: {'estado', 'texto'}}}, con estado 'pendiente',
+        'generando', 'lista' o 'error'; al_parcial es el callback de
+        generar_respuestas_ia que la actualiza (con la primera llamada de cada etiqueta)
+    """
+    vista = {
+        'plantillas': [
+            {'nombre': nombre, 'etiquetas': list(dict.fromkeys(recolectar_etiquetas_ia([indice], datos_ia)))}
+            for nombre, indice in plantillas
+        ],
+        'etiquetas': {nombre: {'estado': 'pendiente', 'texto': ''} for nombre in pendientes},
+    }
+    primera_llamada = {}
+    for i, nombre in enumerate(pendientes):
+        primera_llamada.setdefault(nombre, i)
+    
+    def al_parcial(i, texto, terminada):
+        nombre = pendientes[i]
+        if primera_llamada[nombre] != i:
+            return
+        if not terminada:
+            estado = 'generando'
         else:
-            datos_estaticos[campo] = valor
+            estado = 'error' if texto.startswith('[ERROR IA') else 'lista'
+        # Se reemplaza la entrada entera: quien lee la vista desde otro hilo nunca ve una a medias
+        vista['etiquetas'][nombre] = {'estado': estado, 'texto': texto}
     
-    normas = []
-    for campo, valor in datos_estaticos.items():
-        if 'NORMA' in campo.upper() and valor and not campo.endswith('_RESUMEN'):
-            normas.append(str(valor))
-    
-    wb.close()
-    
-    return datos_estaticos, datos_ia, normas
+    return vista, al_parcial
 
-def procesar_docs_empresa_memoria(docs_files, temp_dir):
-    """Procesa documentos de empresa desde UploadedFiles."""
-    from PyPDF2 import PdfReader
-    import openpyxl
+def abrir_entrada(archivo):
+    """
+    Flujo binario de un archivo de entrada sin copiar su contenido: los que
+    están en disco (con método abrir, como ArchivoEntrada) se abren, y los
+    UploadedFile de Streamlit, que ya están en memoria, se rebobinan y se
+    usan tal cual.
+    """
+    if hasattr(archivo, 'abrir'):
+        return archivo.abrir()
+    archivo.seek(0)
+    return contextlib.nullcontext(archivo)
+
+@medido('leer_informacion_empresa', lambda documentos: {'documentos': len(documentos), 'caracteres': sum(len(t) for _, t in documentos)})
+def leer_documentos_memoria(docs_files, temp_dir):
+    """
+    Extrae el texto completo de los documentos de empresa subidos (UploadedFiles).
     
-    contexto = "\n\n═══════════════════════════════════════════════════════════════════════\n"
-    contexto += "INFORMACIÓN ADICIONAL DE LA EMPRESA:\n"
-    contexto += "═══════════════════════════════════════════════════════════════════════\n\n"
+    Returns:
+        Lista de tuplas (nombre_archivo, texto)
+    """
+    rutas = []
     
     for doc_file in docs_files:
         temp_path = os.path.join(temp_dir, doc_file.name)
-        with open(temp_path, 'wb') as f:
-            f.write(doc_file.read())
-        
-        try:
-            if doc_file.name.endswith('.txt'):
-                with open(temp_path, 'r', encoding='utf-8') as f:
-                    contenido = f.read()
-            elif doc_file.name.endswith('.docx'):
-                doc = Document(temp_path)
-                contenido = '\n'.join([p.text for p in doc.paragraphs])
-            elif doc_file.name.endswith('.pdf'):
-                reader = PdfReader(temp_path)
-                contenido = ""
-                for pagina in reader.pages:
-                    contenido += pagina.extract_text() + "\n"
-            elif doc_file.name.endswith('.xlsx'):
-                wb = openpyxl.load_workbook(temp_path, data_only=True)
-                contenido = ""
-                for hoja in wb.sheetnames:
-                    ws = wb[hoja]
-                    contenido += f"\n--- Hoja: {hoja} ---\n"
-                    for fila in ws.iter_rows(values_only=True):
-                        valores = [str(v) for v in fila if v is not None]
-                        if valores:
-                            contenido += " | ".join(valores) + "\n"
-                wb.close()
-            else:
-                contenido = f"[Documento: {doc_file.name}]"
-            
-            contexto += f"--- {doc_file.name} ---\n{contenido[:2000]}\n\n"
-        except Exception as e:
-            contexto += f"--- {doc_file.name} ---\n[Error procesando: {str(e)}]\n\n"
-    
-    return contexto
+        with abrir_entrada(doc_file) as flujo, open(temp_path, 'wb') as f:
+            shutil.copyfileobj(flujo, f)
+        rutas.append(temp_path)
+    
+    return [
+        (doc_file.name, contenido if contenido is not None else f"[Documento: {doc_file.name}]")
+        for doc_file, contenido in zip(docs_files, extraer_textos(rutas, procesos=STREAMLIT_EXTRACCION_PROCESOS))
+    ]
 
 
-def procesar_plantilla_word_memoria(plantilla_file, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, progress_callback=None):
-    """Procesa una plantilla Word desde UploadedFile."""
-    
-    doc = Document(io.BytesIO(plantilla_file.read()))
+def procesar_plantilla_word_memoria(doc, indice, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, progress_callback=None, respuestas_ia=None):
+    """Procesa una plantilla Word ya cargada y compilada (solo párrafos con etiquetas)."""
     
     memoria_respuestas = []
     
-    total_parrafos = len(doc.paragraphs)
+    total_parrafos = len(indice['ubicaciones'])
     
-    for idx, parrafo in enumerate(doc.paragraphs):
+    for idx, parrafo in enumerate(parrafos_indexados(doc, indice)):
         if progress_callback:
             progress_callback(int((idx / total_parrafos) * 100))
         
-        procesar_parrafo_streamlit(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas)
-    
-    for tabla in doc.tables:
-        for fila in tabla.rows:
-            for celda in fila.cells:
-                for parrafo in celda.paragraphs:
-                    procesar_parrafo_streamlit(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas)
+        procesar_parrafo_streamlit(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas, respuestas_ia)
     
     return doc, memoria_respuestas
 
-def procesar_plantilla_excel_memoria(plantilla_file, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, progress_callback=None):
-    """Procesa una plantilla Excel desde UploadedFile."""
-    
-    wb = openpyxl.load_workbook(io.BytesIO(plantilla_file.read()))
+def procesar_plantilla_excel_memoria(wb, indice, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, progress_callback=None, respuestas_ia=None):
+    """Procesa una plantilla Excel ya cargada y compilada (solo celdas con etiquetas)."""
     
     memoria_respuestas = []
     
-    total_celdas = sum(len(list(ws.iter_rows())) for ws in wb.worksheets)
+    total_celdas = len(indice['ubicaciones'])
     celdas_procesadas = 0
     
-    for sheet in wb.worksheets:
-        for row in sheet.iter_rows():
-            for celda in row:
-                procesar_celda_streamlit(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas)
-                
-                celdas_procesadas += 1
-                if progress_callback and total_celdas > 0:
-                    progress_callback(int((celdas_procesadas / total_celdas) * 100))
+    for celda in celdas_indexadas(wb, indice):
+        procesar_celda_streamlit(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas, respuestas_ia)
+        
+        celdas_procesadas += 1
+        if progress_callback and total_celdas > 0:
+            progress_callback(int((celdas_procesadas / total_celdas) * 100))
     
     return wb, memoria_respuestas
 
 
-def procesar_parrafo_streamlit(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas):
+def procesar_parrafo_streamlit(parrafo, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas, respuestas_ia=None):
     """Procesa un párrafo individual de Word."""
     
     texto = parrafo.text
-    cambios = False
-    
-    for campo, valor in datos_estaticos.items():
-        etiqueta = f"{{{{{campo}}}}}"
-        if etiqueta in texto:
-            texto = texto.replace(etiqueta, str(valor))
-            cambios = True
+    texto, cambios = sustituir_estaticas(texto, datos_estaticos)
     
     etiquetas_ia = re.findall(r'\{\{IA:([^}]+)\}\}', texto)
     
     for nombre_prompt in etiquetas_ia:
         if nombre_prompt in datos_ia:
-            prompt = datos_ia[nombre_prompt]
-            
-            contexto_sistema = contexto_sistema
-            if memoria_respuestas:
-                contexto_sistema += "\n\n" + "="*80 + "\n"
-                contexto_sistema += "RESPUESTAS GENERADAS PREVIAMENTE (mantén coherencia con estos datos):\n"
-                contexto_sistema += "="*80 + "\n\n"
-                contexto_sistema += "\n\n".join(memoria_respuestas[-15:])
-            
-            respuesta = cliente_gemini.generar_texto(prompt, datos_estaticos, contexto_sistema)
+            respuesta = tomar_respuesta(respuestas_ia, nombre_prompt)
+            if respuesta is None:
+                prompt = datos_ia[nombre_prompt]
+                
+                contexto_sistema = contexto_sistema
+                if memoria_respuestas:
+                    contexto_sistema += "\n\n" + "="*80 + "\n"
+                    contexto_sistema += "RESPUESTAS GENERADAS PREVIAMENTE (mantén coherencia con estos datos):\n"
+                    contexto_sistema += "="*80 + "\n\n"
+                    contexto_sistema += "\n\n".join(memoria_respuestas[-15:])
+                
+                respuesta = cliente_gemini.generar_texto(prompt, datos_estaticos, contexto_sistema)
             
             memoria_respuestas.append(f"[{nombre_prompt}]\n{respuesta}")
             
@@ -316,35 +391,31 @@ def procesar_parrafo_streamlit(parrafo, datos_estaticos, datos_ia, cliente_gemin
         
         parrafo.text = texto.strip()
 
-def procesar_celda_streamlit(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas):
+def procesar_celda_streamlit(celda, datos_estaticos, datos_ia, cliente_gemini, contexto_sistema, memoria_respuestas, respuestas_ia=None):
     """Procesa una celda individual de Excel."""
     
     if celda.value is None or not isinstance(celda.value, str):
         return
     
     texto = str(celda.value)
-    cambios = False
-    
-    for campo, valor in datos_estaticos.items():
-        etiqueta = f"{{{{{campo}}}}}"
-        if etiqueta in texto:
-            texto = texto.replace(etiqueta, str(valor))
-            cambios = True
+    texto, cambios = sustituir_estaticas(texto, datos_estaticos)
     
     etiquetas_ia = re.findall(r'\{\{IA:([^}]+)\}\}', texto)
     
     for nombre_prompt in etiquetas_ia:
         if nombre_prompt in datos_ia:
-            prompt = datos_ia[nombre_prompt]
-            
-            contexto_sistema = contexto_sistema
-            if memoria_respuestas:
-                contexto_sistema += "\n\n" + "="*80 + "\n"
-                contexto_sistema += "RESPUESTAS GENERADAS PREVIAMENTE (mantén coherencia con estos datos):\n"
-                contexto_sistema += "="*80 + "\n\n"
-                contexto_sistema += "\n\n".join(memoria_respuestas[-15:])
-            
-            respuesta = cliente_gemini.generar_texto(prompt, datos_estaticos, contexto_sistema)
+            respuesta = tomar_respuesta(respuestas_ia, nombre_prompt)
+            if respuesta is None:
+                prompt = datos_ia[nombre_prompt]
+                
+                contexto_sistema = contexto_sistema
+                if memoria_respuestas:
+                    contexto_sistema += "\n\n" + "="*80 + "\n"
+                    contexto_sistema += "RESPUESTAS GENERADAS PREVIAMENTE (mantén coherencia con estos datos):\n"
+                    contexto_sistema += "="*80 + "\n\n"
+                    contexto_sistema += "\n\n".join(memoria_respuestas[-15:])
+                
+                respuesta = cliente_gemini.generar_texto(prompt, datos_estaticos, contexto_sistema)
             
             memoria_respuestas.append(f"[{nombre_prompt}]\n{respuesta}")
             
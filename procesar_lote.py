@@ -0,0 +1,208 @@
+"""
+Modo lote: procesa muchas auditorías (un DATA.xlsx cada una) en una sola ejecución.
+
+Para cada DATA de la carpeta del lote se generan todas las plantillas Word
+y Excel (en una sola pasada, ver inyectar_todo.py) en su propia carpeta de salida (<salida>/<nombre del DATA>/), con su
+CONTEXTO_IA, memorias, traza y un LOG.txt con la salida de consola. Si junto
+al DATA existe una carpeta con el mismo nombre, se usa como información de
+la empresa de esa auditoría:
+
+    lote/
+    ├── EMPRESA_A.xlsx
+    ├── EMPRESA_A/          # documentos de la empresa (opcional)
+    └── EMPRESA_B.xlsx
+
+Las auditorías se reparten entre procesos (--procesos, por defecto
+LOTE_PROCESOS o 2) y todas comparten un único límite de GEMINI_RPM /
+GEMINI_TPM (LimitadorTasaCompartido), así el lote no supera la cuota de la
+API aunque haya varias auditorías en curso. Al terminar se imprime el
+rendimiento: auditorías/hora y prompts/segundo.
+
+Uso:
+    python procesar_lote.py carpeta_lote [--salida ruta] [--procesos 4] [--tipos word,excel]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from gemini_client import GEMINI_RPM, GEMINI_TPM
+from inyectar_todo import procesar_todo
+from limitador import LimitadorTasaCompartido
+from trazas import ejecucion_trazada
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INYECTADO_DIR = os.path.join(BASE_DIR, '3. Inyectado')
+LOTE_PROCESOS = int(os.getenv('LOTE_PROCESOS', '2'))
+TIPOS = ('word', 'excel')
+
+# Limitador del proceso de trabajo (creado por _iniciar_worker)
+_limitador = None
+
+def _iniciar_worker(estado, solicitudes_por_minuto, tokens_por_minuto):
+    """Inicializa cada proceso del pool con el limitador global compartido."""
+    global _limitador
+    _limitador = LimitadorTasaCompartido(solicitudes_por_minuto, tokens_por_minuto, estado=estado)
+
+def listar_auditorias(carpeta):
+    """
+    DATA.xlsx de la carpeta del lote (sin archivos temporales ~$), en orden.
+
+    Returns:
+        Lista de tuplas (nombre, ruta_data, carpeta_empresa o None)
+    """
+    auditorias = []
+    for archivo in sorted(os.listdir(carpeta)):
+        ruta = os.path.join(carpeta, archivo)
+        if not archivo.lower().endswith('.xlsx') or archivo.startswith('~$') or not os.path.isfile(ruta):
+            continue
+        nombre = os.path.splitext(archivo)[0]
+        empresa = os.path.join(carpeta, nombre)
+        auditorias.append((nombre, ruta, empresa if os.path.isdir(empresa) else None))
+    return auditorias
+
+def procesar_auditoria(nombre, ruta_data, carpeta_empresa, directorio_salida, tipos):
+    """
+    Genera las plantillas de una auditoría (en un proceso del pool).
+
+    Returns:
+        Diccionario con nombre, ok, segundos, documentos, prompts, ahorradas y error
+    """
+    resultado = {'nombre': nombre, 'ok': True, 'segundos': 0.0, 'documentos': 0, 'prompts': 0, 'ahorradas': 0,
+                 'error': None}
+    inicio = time.perf_counter()
+    os.makedirs(directorio_salida, exist_ok=True)
+
+    with open(os.path.join(directorio_salida, 'LOG.txt'), 'w', encoding='utf-8') as log, \
+            contextlib.redirect_stdout(log):
+        try:
+            with ejecucion_trazada(nombre, directorio_salida):
+                parcial = procesar_todo(
+                    ruta_data=ruta_data,
+                    directorio_salida=directorio_salida,
+                    carpeta_empresa=carpeta_empresa,
+                    limitador=_limitador,
+                    tipos=tipos,
+                )
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            parcial = None
+            resultado['error'] = str(e)
+
+    if parcial is None:
+        resultado['ok'] = False
+        resultado['error'] = resultado['error'] or "abortado (ver LOG.txt)"
+    else:
+        resultado['documentos'] = parcial['documentos']
+        resultado['prompts'] = parcial['prompts']
+        resultado['ahorradas'] = parcial['ahorradas']
+
+    resultado['segundos'] = time.perf_counter() - inicio
+    return resultado
+
+def imprimir_resumen(resultados, segundos):
+    """Tabla por auditoría y rendimiento global del lote."""
+    print("\n" + "="*80)
+    print("📊 RESUMEN DEL LOTE")
+    print("="*80)
+    print(f"{'Auditoría':<36}{'Estado':>8}{'Docs':>7}{'Prompts':>9}{'Segundos':>10}")
+    for r in sorted(resultados, key=lambda r: r['nombre']):
+        nombre = r['nombre'] if len(r['nombre']) <= 34 else r['nombre'][:31] + "..."
+        estado = "✅" if r['ok'] else "❌"
+        print(f"{nombre:<36}{estado:>8}{r['documentos']:>7}{r['prompts']:>9}{r['segundos']:>10.1f}")
+        if r['error']:
+            print(f"   ↳ {r['error']}")
+
+    completadas = sum(1 for r in resultados if r['ok'])
+    prompts = sum(r['prompts'] for r in resultados)
+    ahorradas = sum(r['ahorradas'] for r in resultados)
+    documentos = sum(r['documentos'] for r in resultados)
+    print("-"*70)
+    print(f"Auditorías: {completadas}/{len(resultados)} completadas, {documentos} documentos")
+    print(f"Tiempo total: {segundos:.1f} s")
+    if segundos > 0:
+        print(f"Rendimiento: {completadas * 3600 / segundos:.1f} auditorías/hora, "
+              f"{prompts / segundos:.2f} prompts/s ({prompts} prompts)")
+    if ahorradas:
+        print(f"Llamadas IA ahorradas (etiquetas repetidas): {ahorradas}")
+
+def procesar_lote(carpeta, directorio_salida=None, procesos=LOTE_PROCESOS, tipos=TIPOS):
+    """
+    Procesa todas las auditorías de una carpeta en paralelo.
+
+    Args:
+        carpeta: Carpeta con un DATA.xlsx por auditoría
+        directorio_salida: Carpeta raíz de salida (por defecto '3. Inyectado/LOTE_<fecha>')
+        procesos: Procesos de trabajo (auditorías simultáneas)
+        tipos: Plantillas a generar ('word', 'excel')
+
+    Returns:
+        Lista de resultados por auditoría (ver procesar_auditoria)
+    """
+    auditorias = listar_auditorias(carpeta)
+    if not auditorias:
+        print(f"❌ No se encontraron archivos DATA (.xlsx) en '{carpeta}'")
+        return []
+
+    if directorio_salida is None:
+        marca = datetime.now().strftime("%Y%m%d_%H%M%S")
+        directorio_salida = os.path.join(INYECTADO_DIR, f"LOTE_{marca}")
+    os.makedirs(directorio_salida, exist_ok=True)
+    procesos = max(1, min(procesos, len(auditorias)))
+
+    print("="*80)
+    print(f"🚀 LOTE: {len(auditorias)} auditorías, {procesos} procesos, plantillas: {', '.join(tipos)}")
+    print(f"   Límite global: {GEMINI_RPM} solicitudes/min, {GEMINI_TPM} tokens/min")
+    print(f"   Salida: {directorio_salida}")
+    print("="*80)
+
+    limitador = LimitadorTasaCompartido(GEMINI_RPM, GEMINI_TPM)
+    resultados = []
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_worker,
+                             initargs=(limitador.estado, GEMINI_RPM, GEMINI_TPM)) as pool:
+        futuros = {
+            pool.submit(procesar_auditoria, nombre, ruta, empresa,
+                        os.path.join(directorio_salida, nombre), tuple(tipos)): nombre
+            for nombre, ruta, empresa in auditorias
+        }
+        for futuro in as_completed(futuros):
+            nombre = futuros[futuro]
+            try:
+                r = futuro.result()
+            except Exception as e:
+                r = {'nombre': nombre, 'ok': False, 'segundos': 0.0, 'documentos': 0, 'prompts': 0, 'ahorradas': 0,
+                     'error': str(e)}
+            resultados.append(r)
+            estado = "✅" if r['ok'] else "❌"
+            print(f"{estado} [{len(resultados)}/{len(auditorias)}] {nombre}: "
+                  f"{r['documentos']} documentos, {r['prompts']} prompts, {r['segundos']:.1f} s")
+
+    imprimir_resumen(resultados, time.perf_counter() - inicio)
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description="Procesa un lote de auditorías (un DATA.xlsx por auditoría)")
+    parser.add_argument('carpeta', help="Carpeta con los DATA.xlsx del lote")
+    parser.add_argument('--salida', help="Carpeta de salida (por defecto '3. Inyectado/LOTE_<fecha>')")
+    parser.add_argument('--procesos', type=int, default=LOTE_PROCESOS, help="Auditorías simultáneas")
+    parser.add_argument('--tipos', default=",".join(TIPOS), help="Plantillas a generar: word, excel o word,excel")
+    args = parser.parse_args()
+
+    tipos = [t.strip() for t in args.tipos.split(',') if t.strip()]
+    desconocidos = [t for t in tipos if t not in TIPOS]
+    if not tipos or desconocidos:
+        parser.error(f"tipos no válidos: {', '.join(desconocidos) or '(ninguno)'}")
+    if not os.path.isdir(args.carpeta):
+        parser.error(f"no existe la carpeta '{args.carpeta}'")
+
+    resultados = procesar_lote(args.carpeta, args.salida, args.procesos, tipos)
+    if not resultados or not all(r['ok'] for r in resultados):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
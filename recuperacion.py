@@ -0,0 +1,234 @@
+"""
+Recuperación de información de la empresa por relevancia (BM25).
+
+En lugar de anteponer el texto completo de todos los documentos de la
+empresa a cada prompt, los documentos se dividen en fragmentos y se indexan
+una vez por ejecución. Cada etiqueta {{IA:...}} recibe solo los fragmentos
+más relevantes para su prompt, hasta un presupuesto de tokens.
+
+El índice es invertido (término → [(fragmento, frecuencia)]), así que una
+consulta solo recorre los fragmentos que comparten términos con el prompt.
+
+Variables de entorno:
+- RAG_ACTIVO=0: vuelve al comportamiento anterior (todo el texto en el contexto)
+- RAG_TOP_K: fragmentos máximos por prompt (por defecto 5)
+- RAG_PRESUPUESTO_TOKENS: tokens máximos de fragmentos por prompt (por defecto 1500)
+- RAG_PALABRAS_FRAGMENTO: tamaño aproximado de cada fragmento (por defecto 200)
+"""
+
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+
+from backends_llm import estimar_tokens
+from cache_disco import hash_bytes
+from lector_informacion import cache_extraccion, formatear_informacion_empresa
+from trazas import medido
+
+RAG_ACTIVO = os.getenv('RAG_ACTIVO', '1') != '0'
+RAG_TOP_K = int(os.getenv('RAG_TOP_K', '5'))
+RAG_PRESUPUESTO_TOKENS = int(os.getenv('RAG_PRESUPUESTO_TOKENS', '1500'))
+RAG_PALABRAS_FRAGMENTO = int(os.getenv('RAG_PALABRAS_FRAGMENTO', '200'))
+
+PATRON_PALABRA = re.compile(r'[a-z0-9]+')
+
+PALABRAS_VACIAS = frozenset("""
+a al algo ante como con contra cual cuando de del desde donde durante e el ella
+ellos en entre era es esa ese eso esta este esto estos fue ha hay la las le les
+lo los mas me mi muy no nos o para pero por que se ser si sin sobre su sus
+tambien te tiene todo tu un una uno unos y ya
+""".split())
+
+def normalizar(texto):
+    """Minúsculas y sin tildes (la búsqueda no distingue 'auditoría' de 'auditoria')."""
+    texto = unicodedata.normalize('NFD', texto.lower())
+    return ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
+
+def tokenizar(texto):
+    """Términos indexables de un texto (sin palabras vacías ni términos de una letra)."""
+    return [t for t in PATRON_PALABRA.findall(normalizar(texto)) if len(t) > 1 and t not in PALABRAS_VACIAS]
+
+def dividir_en_fragmentos(texto, origen, palabras_por_fragmento=None):
+    """
+    Divide un texto en fragmentos de ~palabras_por_fragmento palabras,
+    respetando los saltos de línea (filas de Excel, párrafos de Word).
+
+    Returns:
+        Lista de diccionarios {'origen': str, 'texto': str}
+    """
+    limite = palabras_por_fragmento or RAG_PALABRAS_FRAGMENTO
+    fragmentos = []
+    lineas_actuales = []
+    palabras_actuales = 0
+
+    for linea in (texto or "").splitlines():
+        palabras = linea.split()
+        if not palabras:
+            continue
+
+        # Cerrar el fragmento actual si la línea no cabe; las líneas muy
+        # largas (PDF sin saltos) se parten por palabras
+        while palabras and (palabras_actuales + len(palabras) > limite):
+            if lineas_actuales:
+                fragmentos.append({'origen': origen, 'texto': "\n".join(lineas_actuales)})
+                lineas_actuales = []
+                palabras_actuales = 0
+            else:
+                fragmentos.append({'origen': origen, 'texto': " ".join(palabras[:limite])})
+                palabras = palabras[limite:]
+
+        if palabras:
+            lineas_actuales.append(" ".join(palabras))
+            palabras_actuales += len(palabras)
+
+    if lineas_actuales:
+        fragmentos.append({'origen': origen, 'texto': "\n".join(lineas_actuales)})
+    return fragmentos
+
+def fragmentos_documento(texto, origen):
+    """
+    dividir_en_fragmentos con caché en disco (junto al texto extraído),
+    con clave SHA-256 del texto y del tamaño de fragmento.
+    """
+    clave = hash_bytes(texto or "", f"fragmentos-v1-{RAG_PALABRAS_FRAGMENTO}")
+    textos = cache_extraccion.obtener(clave)
+    if textos is None:
+        textos = [f['texto'] for f in dividir_en_fragmentos(texto, origen)]
+        cache_extraccion.guardar(clave, textos)
+    return [{'origen': origen, 'texto': t} for t in textos]
+
+class IndiceBM25:
+    """
+    Índice BM25 sobre fragmentos de texto.
+
+    Ejemplo:
+        >>> indice = IndiceBM25(dividir_en_fragmentos(texto, 'Ficha_RUC.pdf'))
+        >>> indice.seleccionar("Describe el proceso de compras", k=3)
+    """
+
+    def __init__(self, fragmentos, k1=1.5, b=0.75):
+        self.fragmentos = fragmentos
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.longitudes = []
+
+        for i, fragmento in enumerate(fragmentos):
+            fragmento['tokens'] = estimar_tokens(fragmento['texto'])
+            terminos = Counter(tokenizar(fragmento['texto']))
+            self.longitudes.append(sum(terminos.values()))
+            for termino, frecuencia in terminos.items():
+                self.postings.setdefault(termino, []).append((i, frecuencia))
+
+        total = len(fragmentos)
+        self.longitud_media = (sum(self.longitudes) / total) if total else 0.0
+        self.idf = {
+            termino: math.log(1 + (total - len(lista) + 0.5) / (len(lista) + 0.5))
+            for termino, lista in self.postings.items()
+        }
+
+    def buscar(self, consulta, k=None):
+        """
+        Devuelve los fragmentos más relevantes para la consulta.
+
+        Returns:
+            Lista de tuplas (puntuacion, fragmento) de mayor a menor puntuación
+        """
+        puntuaciones = {}
+        for termino in set(tokenizar(consulta)):
+            lista = self.postings.get(termino)
+            if not lista:
+                continue
+            idf = self.idf[termino]
+            for i, frecuencia in lista:
+                normalizacion = self.k1 * (1 - self.b + self.b * self.longitudes[i] / self.longitud_media)
+                puntuaciones[i] = puntuaciones.get(i, 0.0) + idf * frecuencia * (self.k1 + 1) / (frecuencia + normalizacion)
+
+        ordenados = sorted(puntuaciones.items(), key=lambda par: (-par[1], par[0]))
+        if k is not None:
+            ordenados = ordenados[:k]
+        return [(puntuacion, self.fragmentos[i]) for i, puntuacion in ordenados]
+
+    def seleccionar(self, consulta, k=None, presupuesto_tokens=None):
+        """
+        Fragmentos más relevantes que caben en el presupuesto de tokens.
+
+        Args:
+            consulta: Texto del prompt
+            k: Máximo de fragmentos (por defecto RAG_TOP_K)
+            presupuesto_tokens: Tokens máximos (por defecto RAG_PRESUPUESTO_TOKENS)
+
+        Returns:
+            Lista de fragmentos, de mayor a menor relevancia
+        """
+        k = RAG_TOP_K if k is None else k
+        presupuesto = RAG_PRESUPUESTO_TOKENS if presupuesto_tokens is None else presupuesto_tokens
+
+        seleccionados = []
+        usados = 0
+        for _, fragmento in self.buscar(consulta):
+            if len(seleccionados) >= k:
+                break
+            if usados + fragmento['tokens'] > presupuesto:
+                continue
+            seleccionados.append(fragmento)
+            usados += fragmento['tokens']
+        return seleccionados
+
+@medido('indexar_documentos', lambda indice: {'fragmentos': len(indice.fragmentos) if indice else 0})
+def construir_indice_documentos(documentos):
+    """
+    Construye el índice de recuperación de los documentos de la empresa.
+
+    Args:
+        documentos: Lista de tuplas (nombre_archivo, texto)
+
+    Returns:
+        IndiceBM25, o None si no hay texto que indexar
+    """
+    fragmentos = []
+    for nombre, texto in documentos:
+        fragmentos.extend(fragmentos_documento(texto, nombre))
+    if not fragmentos:
+        return None
+    return IndiceBM25(fragmentos)
+
+def anexar_fragmentos(prompt, fragmentos):
+    """Añade al prompt los fragmentos recuperados, indicando su documento de origen."""
+    if not fragmentos:
+        return prompt
+    bloques = "\n\n".join(f"--- {f['origen']} ---\n{f['texto']}" for f in fragmentos)
+    return f"{prompt}\n\nINFORMACIÓN RELEVANTE DE LOS DOCUMENTOS DE LA EMPRESA:\n{bloques}"
+
+def describir_documentos(documentos):
+    """Resumen para el contexto del sistema: qué documentos hay y cómo se usan."""
+    lineas = ["Documentos de la empresa disponibles:"]
+    lineas.extend(f"   - {nombre}" for nombre, _ in documentos)
+    lineas.append("Cada tarea incluye los fragmentos de estos documentos relevantes para ella; "
+                  "úsalos para generar contenido realista.")
+    return "\n".join(lineas) + "\n"
+
+def preparar_informacion_empresa(documentos):
+    """
+    Prepara la información de la empresa para una ejecución.
+
+    Returns:
+        Tupla (contexto_empresa, indice):
+        - con RAG_ACTIVO: una descripción breve para el contexto del sistema
+          y el índice para recuperar fragmentos por prompt
+        - sin RAG_ACTIVO: el texto completo para el contexto y None
+        - sin documentos: (None, None)
+    """
+    if not documentos:
+        return None, None
+    if not RAG_ACTIVO:
+        return formatear_informacion_empresa(documentos), None
+
+    indice = construir_indice_documentos(documentos)
+    if indice is None:
+        return None, None
+    print(f"🔎 Información empresarial indexada: {len(indice.fragmentos)} fragmentos "
+          f"(hasta {RAG_TOP_K} por prompt, {RAG_PRESUPUESTO_TOKENS} tokens)")
+    return describir_documentos(documentos), indice
@@ -0,0 +1,542 @@
+"""
+Trabajos en segundo plano para la aplicación Streamlit.
+
+El botón "Generar" ya no procesa dentro del hilo del script: envía un
+trabajo al GestorTrabajos del proceso, que lo ejecuta en un hilo de trabajo
+y devuelve un identificador. La interfaz consulta el estado del trabajo en
+cada recarga, así que el procesamiento sobrevive a los reruns de Streamlit,
+a recargar el navegador (el id va en la URL) y a reconexiones.
+
+Cada trabajo vive en su carpeta (.cache/trabajos/<id>/):
+- entrada/: DATA.xlsx, plantillas y documentos de la empresa subidos
+- estado.json: estado, progreso y mensaje (escritura atómica)
+- salida/: documentos generados y el ZIP con todos ellos, escritos una
+  sola vez al completarse el trabajo
+- resultado.json: referencias a esos archivos (nombre, tipo, tamaño), que
+  es lo único que la interfaz guarda en la sesión; los bytes se leen del
+  disco al pulsar cada descarga
+- vista_previa.json: respuestas IA generadas hasta el momento en que el
+  trabajo se canceló o falló
+
+Planificación:
+- TRABAJOS_WORKERS hilos de trabajo (por defecto 1) toman trabajos de una
+  cola con turno rotativo por usuario: un usuario con varios trabajos en
+  cola no bloquea a los demás. Un trabajo con las plantillas reales llega
+  a ~400 MB de pico (el libro ICO-FO-41 abierto con openpyxl), así que en
+  la instancia de 1 GB dos trabajos a la vez pueden agotar la memoria;
+  subirlo solo en instancias con más RAM (~400 MB por trabajo).
+- Todos los trabajos comparten un LimitadorTasa (GEMINI_RPM / GEMINI_TPM)
+  y un semáforo de IA_CONCURRENCIA_GLOBAL llamadas simultáneas (por defecto
+  8), que reparte la concurrencia hacia la IA entre los trabajos en curso.
+- Mientras se generan las respuestas IA, vista_previa() devuelve el texto
+  de cada etiqueta a medida que llega (streaming), y cancelar() detiene un
+  trabajo en cola o en curso sin esperar a que termine.
+- Un trabajo que llega a un estado final (completado, error, cancelado) ya
+  no cambia de estado.
+- Al reiniciar el proceso, los trabajos en cola vuelven a la cola (sus
+  entradas están en disco). Los que estaban en curso se reanudan una sola
+  vez (REANUDACIONES_MAX); si el proceso vuelve a caer con ellos, quedan en
+  error en lugar de reencolarse en cada arranque.
+- Los trabajos terminados con más de TRABAJOS_TTL_HORAS (por defecto 24) se
+  eliminan al arrancar y cada INTERVALO_LIMPIEZA_S mientras el proceso sigue vivo.
+
+Ejemplo:
+    >>> gestor = obtener_gestor()
+    >>> trabajo_id = gestor.enviar('usuario', data_file, plantillas, docs_empresa)
+    >>> gestor.estado(trabajo_id)['progreso']
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from cache_disco import DIRECTORIO_CACHE
+from gemini_client import GEMINI_RPM, GEMINI_TPM
+from limitador import GeneracionCancelada, LimitadorTasa
+
+TRABAJOS_DIR = os.path.join(DIRECTORIO_CACHE, 'trabajos')
+TRABAJOS_WORKERS = int(os.getenv('TRABAJOS_WORKERS', '1'))
+IA_CONCURRENCIA_GLOBAL = int(os.getenv('IA_CONCURRENCIA_GLOBAL', '8'))
+TRABAJOS_TTL_HORAS = float(os.getenv('TRABAJOS_TTL_HORAS', '24'))
+# Intervalo mínimo entre escrituras de progreso en estado.json (en memoria se actualiza siempre)
+INTERVALO_PROGRESO_S = 0.5
+# Cada cuánto se eliminan los trabajos caducados
+INTERVALO_LIMPIEZA_S = 600
+# Veces que un trabajo interrumpido por un reinicio vuelve a la cola
+REANUDACIONES_MAX = 1
+
+EN_COLA = 'en_cola'
+PROCESANDO = 'procesando'
+COMPLETADO = 'completado'
+ERROR = 'error'
+CANCELADO = 'cancelado'
+TERMINADOS = (COMPLETADO, ERROR, CANCELADO)
+
+class ArchivoEntrada:
+    """Archivo de entrada guardado en disco, con la interfaz de UploadedFile (name, read) y abrir()."""
+
+    def __init__(self, ruta, nombre=None):
+        self.ruta = ruta
+        self.name = nombre or os.path.basename(ruta)
+
+    def read(self):
+        with open(self.ruta, 'rb') as f:
+            return f.read()
+
+    def abrir(self):
+        """Abre el archivo para leerlo por partes, sin cargarlo entero en memoria."""
+        return open(self.ruta, 'rb')
+
+class ColaJusta:
+    """
+    Cola de trabajos con turno rotativo por usuario: se atiende un trabajo
+    de cada usuario por turno, en el orden en que llegaron los usuarios.
+    """
+
+    def __init__(self):
+        self._colas = OrderedDict()
+        self._condicion = threading.Condition()
+
+    def poner(self, usuario, trabajo_id):
+        with self._condicion:
+            self._colas.setdefault(usuario, deque()).append(trabajo_id)
+            self._condicion.notify()
+
+    def tomar(self, timeout=None):
+        """
+        Devuelve el siguiente trabajo (esperando si la cola está vacía).
+
+        Returns:
+            Id del trabajo, o None si se agotó el timeout
+        """
+        with self._condicion:
+            if not self._condicion.wait_for(lambda: self._colas, timeout):
+                return None
+            usuario, cola = next(iter(self._colas.items()))
+            trabajo_id = cola.popleft()
+            # El usuario pasa al final del turno (o sale si no le quedan trabajos)
+            del self._colas[usuario]
+            if cola:
+                self._colas[usuario] = cola
+            return trabajo_id
+
+    def quitar(self, trabajo_id):
+        """Saca un trabajo de la cola. Devuelve False si ya no estaba (p. ej. lo tomó un hilo)."""
+        with self._condicion:
+            for usuario, cola in self._colas.items():
+                if trabajo_id in cola:
+                    cola.remove(trabajo_id)
+                    if not cola:
+                        del self._colas[usuario]
+                    return True
+        return False
+
+    def posicion(self, trabajo_id):
+        """Posición (1 = el siguiente) del trabajo en el orden de atención, o None si no está en cola."""
+        with self._condicion:
+            colas = [list(cola) for cola in self._colas.values()]
+        posicion = 0
+        for turno in range(max((len(c) for c in colas), default=0)):
+            for cola in colas:
+                if turno < len(cola):
+                    posicion += 1
+                    if cola[turno] == trabajo_id:
+                        return posicion
+        return None
+
+class GestorTrabajos:
+    """Ejecuta los trabajos de procesamiento en hilos y persiste su estado en disco."""
+
+    def __init__(self, directorio=TRABAJOS_DIR, workers=TRABAJOS_WORKERS,
+                 concurrencia_ia=IA_CONCURRENCIA_GLOBAL, procesar=None):
+        """
+        Args:
+            directorio: Carpeta de los trabajos
+            workers: Hilos de trabajo (trabajos simultáneos)
+            concurrencia_ia: Llamadas simultáneas a la IA entre todos los trabajos
+            procesar: Función de procesamiento (por defecto procesar_documentos_streamlit)
+        """
+        self.directorio = directorio
+        self.limitador = LimitadorTasa(GEMINI_RPM, GEMINI_TPM)
+        self.semaforo_ia = threading.BoundedSemaphore(max(1, concurrencia_ia))
+        self._procesar = procesar
+        self._cola = ColaJusta()
+        self._estados = {}
+        self._persistido = {}
+        self._vistas = {}
+        self._cancelaciones = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(directorio, exist_ok=True)
+        self._recuperar()
+
+        self._hilos = [
+            threading.Thread(target=self._bucle_worker, name=f"trabajo-{i + 1}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        self._hilos.append(threading.Thread(target=self._bucle_limpieza, name="trabajos-limpieza", daemon=True))
+        for hilo in self._hilos:
+            hilo.start()
+
+    def _ruta(self, trabajo_id, *partes):
+        return os.path.join(self.directorio, trabajo_id, *partes)
+
+    @staticmethod
+    def _escribir_json(ruta, datos):
+        """Escribe un JSON de forma atómica (archivo temporal + os.replace)."""
+        fd, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, ensure_ascii=False, default=str)
+        os.replace(temporal, ruta)
+
+    def _guardar_estado(self, estado):
+        """Escribe estado.json y actualiza la copia en memoria."""
+        with self._lock:
+            self._escribir_json(self._ruta(estado['id'], 'estado.json'), estado)
+            self._estados[estado['id']] = estado
+
+    def _actualizar(self, trabajo_id, **cambios):
+        """
+        Aplica cambios al estado del trabajo (en memoria y en disco). La lectura,
+        la escritura y la comprobación se hacen bajo el mismo lock, así que
+        cancelar() y el hilo del trabajo no se pisan.
+
+        Returns:
+            False si el trabajo ya no existe o ya está en un estado final
+            (completado, error o cancelado): esos estados no se sobrescriben
+        """
+        with self._lock:
+            actual = self._estados.get(trabajo_id)
+            if actual is None or actual['estado'] in TERMINADOS:
+                return False
+            estado = dict(actual, **cambios)
+            self._escribir_json(self._ruta(trabajo_id, 'estado.json'), estado)
+            self._estados[trabajo_id] = estado
+            self._persistido[trabajo_id] = time.monotonic()
+        return True
+
+    def _progreso(self, trabajo_id, progreso, mensaje):
+        """Actualiza el progreso; a disco como mucho cada INTERVALO_PROGRESO_S."""
+        with self._lock:
+            actual = self._estados.get(trabajo_id)
+            if actual is None or actual['estado'] in TERMINADOS:
+                return
+            if time.monotonic() - self._persistido.get(trabajo_id, 0) < INTERVALO_PROGRESO_S:
+                self._estados[trabajo_id] = dict(actual, progreso=progreso, mensaje=mensaje)
+                return
+        self._actualizar(trabajo_id, progreso=progreso, mensaje=mensaje)
+
+    def _terminar(self, trabajo_id, estado, mensaje, **cambios):
+        """
+        Pasa el trabajo a un estado final y libera lo que se guardaba de él en
+        memoria. La vista previa de un trabajo cancelado o fallido se guarda
+        antes en vista_previa.json, para poder revisarla después.
+
+        Returns:
+            False si el trabajo ya estaba en un estado final
+        """
+        vista = self.vista_previa(trabajo_id) if estado != COMPLETADO else None
+        if vista is not None:
+            self._escribir_json(self._ruta(trabajo_id, 'vista_previa.json'), vista)
+        terminado = self._actualizar(trabajo_id, estado=estado, mensaje=mensaje, fin=time.time(), **cambios)
+        with self._lock:
+            self._vistas.pop(trabajo_id, None)
+            self._persistido.pop(trabajo_id, None)
+            self._cancelaciones.pop(trabajo_id, None)
+        return terminado
+
+    def _recuperar(self):
+        """
+        Carga los trabajos persistidos: elimina los caducados, reencola los que
+        estaban en cola y reanuda los que estaban en curso hasta REANUDACIONES_MAX
+        veces (después quedan en error).
+        """
+        limite = time.time() - TRABAJOS_TTL_HORAS * 3600
+        pendientes = []
+        for trabajo_id in os.listdir(self.directorio):
+            try:
+                with open(self._ruta(trabajo_id, 'estado.json'), encoding='utf-8') as f:
+                    estado = json.load(f)
+            except (OSError, ValueError):
+                shutil.rmtree(self._ruta(trabajo_id), ignore_errors=True)
+                continue
+            if estado['creado'] < limite:
+                shutil.rmtree(self._ruta(trabajo_id), ignore_errors=True)
+                continue
+            if estado['estado'] == PROCESANDO and estado.get('reanudaciones', 0) >= REANUDACIONES_MAX:
+                print(f"❌ Trabajo {trabajo_id} interrumpido de nuevo por un reinicio: no se reanuda")
+                estado.update(estado=ERROR, mensaje="Error", fin=time.time(),
+                              error="Interrumpido por un reinicio del servidor")
+                self._guardar_estado(estado)
+            elif estado['estado'] not in TERMINADOS:
+                if estado['estado'] == PROCESANDO:
+                    estado['reanudaciones'] = estado.get('reanudaciones', 0) + 1
+                estado.update(estado=EN_COLA, progreso=0, mensaje="En cola (reanudado tras reinicio)")
+                self._guardar_estado(estado)
+                pendientes.append(estado)
+            else:
+                self._estados[trabajo_id] = estado
+
+        for estado in sorted(pendientes, key=lambda e: e['creado']):
+            self._evento_cancelacion(estado['id'])
+            self._cola.poner(estado['usuario'], estado['id'])
+
+    def limpiar_caducados(self):
+        """
+        Elimina los trabajos terminados creados hace más de TRABAJOS_TTL_HORAS
+        (carpeta y estado en memoria).
+
+        Returns:
+            Número de trabajos eliminados
+        """
+        limite = time.time() - TRABAJOS_TTL_HORAS * 3600
+        with self._lock:
+            caducados = [
+                trabajo_id for trabajo_id, estado in self._estados.items()
+                if estado['estado'] in TERMINADOS and estado['creado'] < limite
+            ]
+            for trabajo_id in caducados:
+                del self._estados[trabajo_id]
+        for trabajo_id in caducados:
+            shutil.rmtree(self._ruta(trabajo_id), ignore_errors=True)
+        return len(caducados)
+
+    def _bucle_limpieza(self):
+        while True:
+            time.sleep(INTERVALO_LIMPIEZA_S)
+            try:
+                eliminados = self.limpiar_caducados()
+                if eliminados:
+                    print(f"🧹 {eliminados} trabajo(s) caducado(s) eliminado(s)")
+            except Exception:
+                traceback.print_exc()
+
+    def enviar(self, usuario, data_file, plantillas, docs_empresa=None):
+        """
+        Guarda las entradas en disco y encola un trabajo.
+
+        Args:
+            usuario: Identificador del usuario (turno de la cola)
+            data_file: Archivo DATA.xlsx (UploadedFile o cualquier objeto con name y read)
+            plantillas: Lista de plantillas .docx / .xlsx
+            docs_empresa: Lista de documentos de la empresa (opcional)
+
+        Returns:
+            Id del trabajo
+        """
+        trabajo_id = uuid.uuid4().hex[:12]
+        grupos = {'data': [data_file], 'plantillas': plantillas, 'empresa': docs_empresa or []}
+        for grupo, archivos in grupos.items():
+            carpeta = self._ruta(trabajo_id, 'entrada', grupo)
+            os.makedirs(carpeta, exist_ok=True)
+            # Prefijo de orden: se conserva el orden de subida y se admiten nombres repetidos
+            for i, archivo in enumerate(archivos):
+                with open(os.path.join(carpeta, f"{i:03d}_{os.path.basename(archivo.name)}"), 'wb') as f:
+                    if hasattr(archivo, 'seek'):
+                        archivo.seek(0)
+                        shutil.copyfileobj(archivo, f)
+                    else:
+                        f.write(archivo.read())
+
+        self._guardar_estado({
+            'id': trabajo_id,
+            'usuario': usuario,
+            'estado': EN_COLA,
+            'progreso': 0,
+            'mensaje': "En cola",
+            'error': None,
+            'plantillas': [p.name for p in plantillas],
+            'creado': time.time(),
+            'inicio': None,
+            'fin': None,
+        })
+        self._evento_cancelacion(trabajo_id)
+        self._cola.poner(usuario, trabajo_id)
+        return trabajo_id
+
+    def estado(self, trabajo_id):
+        """
+        Estado actual de un trabajo.
+
+        Returns:
+            Diccionario con id, usuario, estado, progreso, mensaje, error,
+            plantillas, creado, inicio, fin y posicion (en cola), o None si no existe
+        """
+        with self._lock:
+            estado = self._estados.get(trabajo_id)
+        if estado is None:
+            return None
+        estado = dict(estado)
+        estado['posicion'] = self._cola.posicion(trabajo_id) if estado['estado'] == EN_COLA else None
+        return estado
+
+    def vista_previa(self, trabajo_id):
+        """
+        Respuestas IA del trabajo generadas hasta ahora (ver crear_vista_previa).
+
+        Se conserva en memoria mientras el trabajo está en curso y, si se
+        canceló o falló, en vista_previa.json, para revisar las respuestas.
+
+        Returns:
+            Diccionario {'plantillas': [...], 'etiquetas': {...}}, o None si no hay vista previa
+        """
+        vista = self._vistas.get(trabajo_id)
+        if vista is None:
+            try:
+                with open(self._ruta(trabajo_id, 'vista_previa.json'), encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return None
+        return {'plantillas': vista['plantillas'], 'etiquetas': dict(vista['etiquetas'])}
+
+    def _evento_cancelacion(self, trabajo_id):
+        with self._lock:
+            return self._cancelaciones.setdefault(trabajo_id, threading.Event())
+
+    def cancelar(self, trabajo_id):
+        """
+        Cancela un trabajo sin terminar. Si está en cola, sale de ella; si está
+        en curso, no se hacen más llamadas a la IA, las respuestas en
+        streaming se cortan en el siguiente fragmento y, si ya se están
+        escribiendo las plantillas, se detiene antes de la siguiente.
+
+        Returns:
+            True si el trabajo seguía sin terminar
+        """
+        with self._lock:
+            # El evento existe desde que el trabajo entra en la cola hasta que termina
+            evento = self._cancelaciones.get(trabajo_id)
+        if evento is None:
+            return False
+        evento.set()
+        if self._cola.quitar(trabajo_id):
+            return self._terminar(trabajo_id, CANCELADO, "⛔ Cancelado")
+        return self._actualizar(trabajo_id, mensaje="Cancelando...")
+
+    def trabajos_usuario(self, usuario):
+        """Estados de los trabajos de un usuario, del más reciente al más antiguo."""
+        with self._lock:
+            ids = [e['id'] for e in self._estados.values() if e['usuario'] == usuario]
+        return sorted((self.estado(i) for i in ids), key=lambda e: e['creado'], reverse=True)
+
+    def resultado(self, trabajo_id):
+        """
+        Referencias a los archivos generados por un trabajo completado.
+
+        Returns:
+            Diccionario {'documentos': [...], 'paquete': {...}}, o None si no hay resultado.
+            Cada documento es {'nombre', 'tipo', 'archivo', 'bytes'} (más 'resumen'
+            en la traza) y el paquete es {'nombre', 'archivo', 'bytes'}; 'archivo'
+            se lee con leer_artefacto
+        """
+        try:
+            with open(self._ruta(trabajo_id, 'resultado.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def leer_artefacto(self, trabajo_id, archivo):
+        """Contenido (bytes) de un archivo de salida del trabajo (ver resultado)."""
+        with open(self._ruta(trabajo_id, 'salida', os.path.basename(archivo)), 'rb') as f:
+            return f.read()
+
+    def _guardar_resultado(self, trabajo_id, documentos):
+        """
+        Escribe los documentos generados y el ZIP en salida/ y sus referencias
+        en resultado.json (al final, así su existencia indica un resultado completo).
+        Los documentos se copian por bloques y el ZIP se comprime desde esas
+        copias, sin juntar todo el contenido en memoria.
+        """
+        carpeta = self._ruta(trabajo_id, 'salida')
+        os.makedirs(carpeta, exist_ok=True)
+
+        referencias = []
+        for i, doc in enumerate(documentos):
+            # Prefijo de orden: admite nombres repetidos entre plantillas
+            archivo = f"{i:03d}_{os.path.basename(doc['nombre'])}"
+            ruta = os.path.join(carpeta, archivo)
+            with doc['contenido'] as contenido, open(ruta, 'wb') as f:
+                shutil.copyfileobj(contenido, f)
+            referencia = {k: v for k, v in doc.items() if k != 'contenido'}
+            referencia.update(archivo=archivo, bytes=os.path.getsize(ruta))
+            referencias.append(referencia)
+
+        paquete = {
+            'nombre': f"documentos_auditoria_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            'archivo': 'paquete.zip',
+        }
+        ruta_zip = os.path.join(carpeta, paquete['archivo'])
+        with zipfile.ZipFile(ruta_zip, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for referencia in referencias:
+                zip_file.write(os.path.join(carpeta, referencia['archivo']), arcname=referencia['nombre'])
+        paquete['bytes'] = os.path.getsize(ruta_zip)
+
+        self._escribir_json(self._ruta(trabajo_id, 'resultado.json'), {'documentos': referencias, 'paquete': paquete})
+
+    def _entradas(self, trabajo_id, grupo):
+        carpeta = self._ruta(trabajo_id, 'entrada', grupo)
+        return [ArchivoEntrada(os.path.join(carpeta, nombre), nombre[4:]) for nombre in sorted(os.listdir(carpeta))]
+
+    def _bucle_worker(self):
+        while True:
+            trabajo_id = self._cola.tomar()
+            try:
+                self._ejecutar(trabajo_id)
+            except Exception as e:
+                # Un error inesperado no debe matar el hilo de trabajo ni dejar el trabajo en curso
+                traceback.print_exc()
+                self._terminar(trabajo_id, ERROR, "Error", error=str(e))
+
+    def _ejecutar(self, trabajo_id):
+        procesar = self._procesar
+        if procesar is None:
+            from procesador_streamlit import procesar_documentos_streamlit
+            procesar = procesar_documentos_streamlit
+
+        cancelar = self._evento_cancelacion(trabajo_id)
+        # Cancelado entre salir de la cola y empezar
+        if cancelar.is_set():
+            self._terminar(trabajo_id, CANCELADO, "⛔ Cancelado")
+            return
+
+        self._actualizar(trabajo_id, estado=PROCESANDO, inicio=time.time(), mensaje="Inicializando...")
+        try:
+            documentos = procesar(
+                data_file=self._entradas(trabajo_id, 'data')[0],
+                plantillas=self._entradas(trabajo_id, 'plantillas'),
+                docs_empresa=self._entradas(trabajo_id, 'empresa') or None,
+                progress_callback=lambda progreso, mensaje: self._progreso(trabajo_id, progreso, mensaje),
+                limitador=self.limitador,
+                semaforo_ia=self.semaforo_ia,
+                vista_previa_callback=lambda vista: self._vistas.__setitem__(trabajo_id, vista),
+                cancelar=cancelar,
+            )
+            self._guardar_resultado(trabajo_id, documentos)
+        except GeneracionCancelada:
+            print(f"⛔ Trabajo {trabajo_id} cancelado")
+            self._terminar(trabajo_id, CANCELADO, "⛔ Cancelado por el usuario")
+            return
+        except Exception as e:
+            print(f"❌ Trabajo {trabajo_id}: {e}")
+            self._terminar(trabajo_id, ERROR, "Error", error=str(e))
+            return
+        self._terminar(trabajo_id, COMPLETADO, "✅ Procesamiento completado!", progreso=100)
+
+_gestor = None
+_lock_gestor = threading.Lock()
+
+def obtener_gestor():
+    """Gestor de trabajos del proceso (uno solo, compartido por todas las sesiones)."""
+    global _gestor
+    with _lock_gestor:
+        if _gestor is None:
+            _gestor = GestorTrabajos()
+        return _gestor
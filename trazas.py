@@ -0,0 +1,212 @@
+"""
+Instrumentación del pipeline: eventos de traza en JSON-lines y resumen por etapa.
+
+Cada ejecución crea una Traza y la activa; las funciones instrumentadas
+registran un evento por llamada (duración y detalles como tokens, aciertos
+de caché o reintentos). Si no hay traza activa, la instrumentación no hace nada.
+
+La traza activa vive en un contextvar: cada ejecución de Streamlit (un hilo
+por sesión) tiene la suya, y generacion_ia copia el contexto a los hilos del
+pool para que las llamadas concurrentes a la IA queden en la misma traza.
+
+Ejemplo:
+    >>> traza = Traza('traza.jsonl')
+    >>> with activar_traza(traza):
+    ...     with medir('render_plantilla', plantilla='Plan.docx') as evento:
+    ...         evento['ubicaciones'] = 73
+    >>> print(traza.tabla_resumen())
+"""
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+_traza_activa = contextvars.ContextVar('traza_activa', default=None)
+
+# Campos numéricos de los eventos que se suman en el resumen
+CAMPOS_SUMADOS = ('prompt_tokens', 'respuesta_tokens', 'reintentos', 'espera_limitador_s', 'llamadas_ahorradas')
+
+class Traza:
+    """Colección de eventos de una ejecución, opcionalmente volcada a un .jsonl."""
+
+    def __init__(self, ruta=None):
+        """
+        Args:
+            ruta: Archivo .jsonl donde se escribe cada evento al registrarse
+                  (None = solo en memoria)
+        """
+        self.ruta = ruta
+        self.eventos = []
+        self.inicio = time.time()
+        self._lock = threading.Lock()
+        self._archivo = None
+        if ruta:
+            os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+            self._archivo = open(ruta, 'a', encoding='utf-8')
+
+    def registrar(self, evento, **datos):
+        """Añade un evento con marca de tiempo relativa al inicio de la traza."""
+        registro = {
+            'evento': evento,
+            't': round(time.time() - self.inicio, 4),
+            'hilo': threading.current_thread().name,
+        }
+        registro.update(datos)
+        with self._lock:
+            self.eventos.append(registro)
+            if self._archivo is not None:
+                self._archivo.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+                self._archivo.flush()
+        return registro
+
+    def cerrar(self):
+        with self._lock:
+            if self._archivo is not None:
+                self._archivo.close()
+                self._archivo = None
+
+    def jsonl(self):
+        """Devuelve todos los eventos en formato JSON-lines (bytes UTF-8)."""
+        with self._lock:
+            eventos = list(self.eventos)
+        return "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in eventos).encode('utf-8')
+
+    def resumen(self):
+        """
+        Agrega los eventos por etapa.
+
+        La duración total de eventos concurrentes (generar_texto) es la suma
+        de todas las llamadas, no el tiempo real transcurrido.
+
+        Returns:
+            Lista de diccionarios, una fila por etapa en orden de aparición
+        """
+        with self._lock:
+            eventos = list(self.eventos)
+
+        filas = {}
+        for e in eventos:
+            fila = filas.get(e['evento'])
+            if fila is None:
+                fila = filas[e['evento']] = {
+                    'etapa': e['evento'], 'llamadas': 0, 'total_s': 0.0, 'max_s': 0.0,
+                    'prompt_tokens': 0, 'respuesta_tokens': 0, 'aciertos_cache': 0,
+                    'reintentos': 0, 'espera_limitador_s': 0.0, 'errores': 0,
+                    'llamadas_ahorradas': 0,
+                }
+            duracion = e.get('duracion_s', 0.0)
+            fila['llamadas'] += 1
+            fila['total_s'] += duracion
+            fila['max_s'] = max(fila['max_s'], duracion)
+            for campo in CAMPOS_SUMADOS:
+                fila[campo] += e.get(campo) or 0
+            if e.get('cache') == 'acierto':
+                fila['aciertos_cache'] += 1
+            if e.get('error'):
+                fila['errores'] += 1
+
+        for fila in filas.values():
+            fila['promedio_s'] = fila['total_s'] / fila['llamadas']
+            for campo in ('total_s', 'max_s', 'promedio_s', 'espera_limitador_s'):
+                fila[campo] = round(fila[campo], 3)
+        return list(filas.values())
+
+    def tabla_resumen(self):
+        """Resumen por etapa como tabla de texto para la consola."""
+        encabezado = (f"{'Etapa':<26}{'N':>6}{'Total s':>10}{'Prom. s':>9}{'Máx s':>9}"
+                      f"{'Tok. prompt':>13}{'Tok. resp.':>12}{'Caché':>7}{'Reint.':>8}{'Errores':>9}")
+        lineas = [encabezado, "-" * len(encabezado)]
+        filas = self.resumen()
+        for f in filas:
+            lineas.append(
+                f"{f['etapa']:<26}{f['llamadas']:>6}{f['total_s']:>10.2f}{f['promedio_s']:>9.2f}{f['max_s']:>9.2f}"
+                f"{f['prompt_tokens']:>13}{f['respuesta_tokens']:>12}{f['aciertos_cache']:>7}"
+                f"{f['reintentos']:>8}{f['errores']:>9}"
+            )
+        ahorradas = sum(f['llamadas_ahorradas'] for f in filas)
+        if ahorradas:
+            lineas.append(f"Llamadas IA ahorradas (etiquetas repetidas): {ahorradas}")
+        lineas.append(f"Tiempo total de la ejecución: {time.time() - self.inicio:.1f} s")
+        return "\n".join(lineas)
+
+def traza_actual():
+    """Devuelve la traza activa en este contexto, o None."""
+    return _traza_activa.get()
+
+@contextmanager
+def activar_traza(traza):
+    """Activa la traza para el código del bloque (y los hilos que copien el contexto)."""
+    token = _traza_activa.set(traza)
+    try:
+        yield traza
+    finally:
+        _traza_activa.reset(token)
+
+@contextmanager
+def medir(evento, **datos):
+    """
+    Mide la duración del bloque y registra un evento en la traza activa.
+
+    Devuelve un diccionario en el que el bloque puede añadir detalles
+    (tokens, aciertos de caché...). Si el bloque lanza una excepción se
+    registra en el campo 'error' y se propaga.
+    """
+    traza = _traza_activa.get()
+    detalles = dict(datos)
+    if traza is None:
+        yield detalles
+        return
+
+    inicio = time.perf_counter()
+    try:
+        yield detalles
+    except BaseException as e:
+        detalles['error'] = f"{type(e).__name__}: {str(e)[:200]}"
+        raise
+    finally:
+        traza.registrar(evento, duracion_s=round(time.perf_counter() - inicio, 4), **detalles)
+
+def medido(evento, detalles=None):
+    """
+    Decorador: registra un evento por cada llamada a la función.
+
+    Args:
+        evento: Nombre del evento
+        detalles: Función opcional resultado -> diccionario de detalles
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with medir(evento) as datos:
+                resultado = funcion(*args, **kwargs)
+                if detalles is not None:
+                    try:
+                        datos.update(detalles(resultado))
+                    except Exception:
+                        pass  # La instrumentación nunca debe romper el proceso
+                return resultado
+        return envoltura
+    return decorador
+
+@contextmanager
+def ejecucion_trazada(nombre, directorio):
+    """
+    Traza una ejecución de consola: escribe directorio/TRAZAS/traza_<nombre>_<fecha>.jsonl
+    y al terminar imprime el resumen por etapa.
+    """
+    marca = datetime.now().strftime("%Y%m%d_%H%M%S")
+    traza = Traza(os.path.join(directorio, 'TRAZAS', f"traza_{nombre}_{marca}.jsonl"))
+    try:
+        with activar_traza(traza):
+            yield traza
+    finally:
+        traza.cerrar()
+        if traza.eventos:
+            print("\n⏱️  RESUMEN DE RENDIMIENTO")
+            print(traza.tabla_resumen())
+            print(f"📝 Traza guardada en: {traza.ruta}")